@@ -0,0 +1,240 @@
+"""
+爬蟲准入控制模組
+- ScrapeAdmission: 限制同時對104送出請求的爬蟲任務數，超過時排隊（逾時則任務失敗），
+  佇列已滿時拒絕；設定slot_dir時以檔案鎖讓同一台機器上的多個行程共用名額
+- TokenBucketLimiter: 依用戶端的權杖桶限制觸發爬蟲的頻率
+"""
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+
+from metrics import SCRAPE_ADMISSION_REJECTED, SCRAPE_QUEUE_DEPTH, SCRAPES_RUNNING
+
+try:
+    import fcntl
+except ImportError:  # Windows：沒有檔案鎖，名額只在行程內生效
+    fcntl = None
+
+
+class AdmissionRejected(Exception):
+    """爬蟲請求未被受理（retry_after為建議的重試秒數）"""
+
+    def __init__(self, message: str, reason: str, retry_after: float):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTimeout(Exception):
+    """已受理的爬蟲任務排隊超過時限"""
+
+
+class ScrapeTicket:
+    """已受理的爬蟲任務（position為受理時前面等待的任務數，0代表不必等待）"""
+
+    def __init__(self, deadline: float, position: int):
+        self.deadline = deadline
+        self.position = position
+        # 已離開等待（進入slot()或由release()釋出）
+        self.settled = False
+
+
+class ScrapeAdmission:
+    """
+    爬蟲任務的准入控制
+
+    使用方式：
+        ticket = admission.admit()      # 請求中呼叫，佇列已滿時拋出AdmissionRejected
+        with admission.slot(ticket):    # 背景任務中呼叫，等待執行名額，逾時拋出AdmissionTimeout
+            ...爬取...
+        admission.release(ticket)       # 受理後沒有成功提交背景任務時呼叫，釋出等待名額
+    """
+
+    def __init__(self, max_concurrent: int = 2, max_queue: int = 10, queue_timeout: float = 120.0,
+                 slot_dir: Optional[str] = None, poll_interval: float = 0.2):
+        """
+        Args:
+            max_concurrent: 同時執行的爬蟲任務數上限
+            max_queue: 等待執行名額的任務數上限（超過時拒絕）
+            queue_timeout: 受理後最多等待執行名額的秒數
+            slot_dir: 跨行程共用名額的鎖檔目錄（None代表名額只在行程內生效）
+            poll_interval: 等待其他行程釋出名額時的輪詢間隔秒數
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.slot_dir = slot_dir if fcntl is not None else None
+        self.poll_interval = poll_interval
+
+        self._cond = threading.Condition()
+        self.waiting = 0
+        self.running = 0
+        self.counts = {'admitted': 0, 'queue_full': 0, 'timeout': 0}
+
+        if self.slot_dir:
+            os.makedirs(self.slot_dir, exist_ok=True)
+
+    def _update_gauges(self):
+        SCRAPE_QUEUE_DEPTH.set(self.waiting)
+        SCRAPES_RUNNING.set(self.running)
+
+    def admit(self) -> ScrapeTicket:
+        """
+        受理一個爬蟲任務
+
+        Raises:
+            AdmissionRejected: 等待中的任務已達max_queue
+        """
+        with self._cond:
+            if self.waiting >= self.max_queue:
+                self.counts['queue_full'] += 1
+                SCRAPE_ADMISSION_REJECTED.inc(reason='queue_full')
+                raise AdmissionRejected(
+                    f"爬蟲佇列已滿（{self.waiting} 個任務等待中），請稍後再試",
+                    'queue_full', retry_after=min(self.queue_timeout, 30.0))
+            position = max(0, self.running + self.waiting - self.max_concurrent + 1)
+            self.waiting += 1
+            self.counts['admitted'] += 1
+            self._update_gauges()
+        return ScrapeTicket(time.monotonic() + self.queue_timeout, position)
+
+    @contextmanager
+    def slot(self, ticket: ScrapeTicket):
+        """等待並佔用一個執行名額（離開時釋出）"""
+        with self._cond:
+            while self.running >= self.max_concurrent:
+                remaining = ticket.deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            if not ticket.settled:
+                ticket.settled = True
+                self.waiting -= 1
+            if self.running >= self.max_concurrent:
+                self._timed_out()
+            self.running += 1
+            self._update_gauges()
+
+        lock_file = None
+        try:
+            if self.slot_dir:
+                lock_file = self._lock_shared_slot(ticket.deadline)
+                if lock_file is None:
+                    with self._cond:
+                        self._timed_out()
+            yield
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+            with self._cond:
+                self.running -= 1
+                self._update_gauges()
+                self._cond.notify()
+
+    def release(self, ticket: ScrapeTicket):
+        """釋出尚未進入slot()的受理名額（重複呼叫或已進入slot()時沒有作用）"""
+        with self._cond:
+            if ticket.settled:
+                return
+            ticket.settled = True
+            self.waiting -= 1
+            self._update_gauges()
+
+    def _timed_out(self):
+        """記錄並拋出排隊逾時（呼叫時需持有鎖）"""
+        self.counts['timeout'] += 1
+        self._update_gauges()
+        SCRAPE_ADMISSION_REJECTED.inc(reason='timeout')
+        raise AdmissionTimeout(f"爬蟲任務排隊超過 {self.queue_timeout:g} 秒，已取消")
+
+    def _lock_shared_slot(self, deadline: float):
+        """
+        取得其他行程也使用的名額鎖檔（關閉時釋放）
+
+        Returns:
+            已鎖定的檔案；超過deadline仍沒有空出的名額時為None
+        """
+        while True:
+            for index in range(self.max_concurrent):
+                lock_file = open(os.path.join(self.slot_dir, f"slot-{index}.lock"), 'a')
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock_file.close()
+                    continue
+                return lock_file
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def stats(self) -> dict:
+        """目前的執行與等待數，以及受理、拒絕與逾時的次數"""
+        with self._cond:
+            return dict(self.counts, running=self.running, waiting=self.waiting,
+                        max_concurrent=self.max_concurrent, max_queue=self.max_queue)
+
+
+class TokenBucketLimiter:
+    """
+    每個用戶端一個權杖桶：最多累積burst個權杖，每秒補充rate個，每次觸發爬蟲消耗一個
+
+    只保留最近使用的max_clients個用戶端（其他用戶端的桶視為已滿）
+    """
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 10000):
+        """
+        Args:
+            rate: 每秒補充的權杖數（0代表不限制）
+            burst: 權杖桶容量（連續觸發的上限）
+            max_clients: 最多記錄的用戶端數
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def consume(self, client: str, tokens: float = 1.0) -> float:
+        """
+        消耗權杖
+
+        Returns:
+            float: 0代表允許；否則為需要等待的秒數（不消耗權杖）
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        now = time.monotonic()
+        with self._lock:
+            available, updated = self._buckets.pop(client, (float(self.burst), now))
+            available = min(float(self.burst), available + (now - updated) * self.rate)
+
+            if available >= tokens:
+                available -= tokens
+                wait = 0.0
+            else:
+                wait = (tokens - available) / self.rate
+
+            self._buckets[client] = (available, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def check(self, client: str):
+        """
+        消耗權杖，不足時拋出例外
+
+        Raises:
+            AdmissionRejected: 權杖不足（retry_after為補足一個權杖的秒數）
+        """
+        wait = self.consume(client)
+        if wait > 0:
+            SCRAPE_ADMISSION_REJECTED.inc(reason='rate_limited')
+            raise AdmissionRejected(f"觸發爬蟲過於頻繁，請在 {math.ceil(wait)} 秒後再試",
+                                    'rate_limited', retry_after=wait)
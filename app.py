@@ -1,49 +1,494 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, request, jsonify, render_template, send_file, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from scrape_104 import Job104Scraper
 from database import JobDatabase
 from cloudflare_d1 import create_d1_database, CloudflareD1Database
+from tasks import BackgroundTaskManager
+from query_cache import CachedJobDatabase
+from d1_spool import SpooledD1Database
+from d1_tiered import TieredD1Database
+from scrape_coalescer import ScrapeCoalescer
+from admission import AdmissionRejected, ScrapeAdmission, TokenBucketLimiter
+from job_feed import FeedFilter, FeedFull, FeedPublishingDatabase, JobFeed, format_events
+from job_fields import COMPACT_TEXT_LENGTH, parse_fields, project_jobs
+from http_cache import compress_response, conditional
+from metrics import CONTENT_TYPE, HTTP_REQUEST_SECONDS, REGISTRY, InstrumentedDatabase
+from profiling import RequestProfiler, phase, pstats_text
 import os
+import atexit
+import io
+import csv
+import json
 import logging
+import math
+import threading
+import time
 from datetime import datetime
 
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON回應的序列化時間計入請求的json階段"""
+    
+    def response(self, *args, **kwargs):
+        with phase('json'):
+            return super().response(*args, **kwargs)
+
 app = Flask(__name__)
+app.json = TimedJSONProvider(app)
 CORS(app)  # 允許跨域請求
 
-# 初始化爬蟲和資料庫
-scraper = Job104Scraper()
+# 回應壓縮（HTTP_COMPRESS=0 停用，例如已由反向代理壓縮時）
+HTTP_COMPRESS = os.getenv('HTTP_COMPRESS', '1') != '0'
+HTTP_COMPRESS_MIN_SIZE = int(os.getenv('HTTP_COMPRESS_MIN_SIZE', '1024'))
+# 以寫入世代產生的ETag另外依時間分段的秒數
+HTTP_ETAG_WINDOW = float(os.getenv('HTTP_ETAG_WINDOW', '60'))
+
+# 請求剖析：設定PROFILE_TOKEN後，帶 X-Profile: cprofile|sample 與 X-Profile-Token 標頭
+# （或 profile= 與 profile_token= 參數）的請求會被剖析，結果由 /api/profiles/<id> 下載；
+# 超過SLOW_REQUEST_MS毫秒的請求記錄各階段耗時（0 停用）
+request_profiler = RequestProfiler(
+    directory=os.getenv('PROFILE_DIR', 'profiles'),
+    token=os.getenv('PROFILE_TOKEN') or None,
+    slow_threshold=float(os.getenv('SLOW_REQUEST_MS', '1000')) / 1000,
+    max_files=int(os.getenv('PROFILE_MAX_FILES', '50')),
+    sample_interval=float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '5')) / 1000
+)
+
+def _profile_token():
+    return request.headers.get('X-Profile-Token') or request.args.get('profile_token')
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+    g.profile_status = request_profiler.start(
+        token=_profile_token(),
+        mode=request.headers.get('X-Profile') or request.args.get('profile')
+    )
+
+@app.after_request
+def record_request(response):
+    """記錄API請求處理時間（串流回應只計算到開始傳送為止），在壓縮之後執行"""
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint,
+                                     method=request.method, status=response.status_code)
+    
+    profile_id = request_profiler.finish(request.method, request.path, response.status_code)
+    profile_status = g.get('profile_status')
+    if profile_status:
+        response.headers['X-Profile-Status'] = profile_status
+    if profile_id:
+        response.headers['X-Profile-Id'] = profile_id
+        response.headers['X-Profile-Url'] = f"/api/profiles/{profile_id}"
+    return response
+
+@app.after_request
+def compress(response):
+    if HTTP_COMPRESS:
+        with phase('compress'):
+            return compress_response(response, min_size=HTTP_COMPRESS_MIN_SIZE)
+    return response
+
+@app.teardown_request
+def stop_profiler(error=None):
+    """請求因例外中止時停止剖析"""
+    request_profiler.discard()
+
+# 爬蟲、背景任務與資料庫在第一個需要它們的請求才建立（ensure_state），載入程式、
+# /healthz 與 /metrics 不會連接資料庫（D1會呼叫遠端API檢查結構描述）；多行程WSGI伺服器
+# （gunicorn.conf.py）預先載入程式後，每個worker各自建立，執行緒與資料庫連線不會跨越fork
+scraper = None
+task_manager = None
+search_flights = None
+scrape_flights = None
+scrape_admission = None
+scrape_limiter = None
+job_feed = None
+db = None
+_d1_db = None
+_state_ready = False
+_state_lock = threading.Lock()
+_stopping = False
+
+def init_state():
+    """建立爬蟲、背景任務管理器與資料庫（每個行程呼叫一次，一般經由ensure_state）"""
+    global scraper, task_manager, search_flights, scrape_flights, scrape_admission, scrape_limiter
+    global job_feed, db, _d1_db, _state_ready
+    
+    scraper = Job104Scraper()
+    # TASK_STORE_PATH: 多個worker共用的任務狀態檔，任一worker都能查詢其他worker的任務
+    task_manager = BackgroundTaskManager(
+        max_workers=int(os.getenv('TASK_WORKERS', '2')),
+        store_path=os.getenv('TASK_STORE_PATH') or None
+    )
+    
+    # 相同條件的即時爬蟲只執行一次；即時搜尋的結果快取SCRAPE_CACHE_TTL秒，
+    # 之後到SCRAPE_CACHE_STALE_TTL秒內先返回舊結果並在背景重新爬取
+    search_flights = ScrapeCoalescer(
+        task_manager, 'search',
+        fresh_ttl=float(os.getenv('SCRAPE_CACHE_TTL', '60')),
+        stale_ttl=float(os.getenv('SCRAPE_CACHE_STALE_TTL', '300'))
+    )
+    scrape_flights = ScrapeCoalescer(task_manager, 'scrape', fresh_ttl=0, stale_ttl=0)
+    
+    # 同時對104送出請求的爬蟲任務最多SCRAPE_MAX_CONCURRENT個，其餘最多SCRAPE_MAX_QUEUE個排隊
+    # SCRAPE_QUEUE_TIMEOUT秒；SCRAPE_SLOT_DIR: 多個worker共用名額的鎖檔目錄
+    scrape_admission = ScrapeAdmission(
+        max_concurrent=int(os.getenv('SCRAPE_MAX_CONCURRENT', '2')),
+        max_queue=int(os.getenv('SCRAPE_MAX_QUEUE', '10')),
+        queue_timeout=float(os.getenv('SCRAPE_QUEUE_TIMEOUT', '120')),
+        slot_dir=os.getenv('SCRAPE_SLOT_DIR') or None
+    )
+    # 每個用戶端每分鐘可觸發SCRAPE_RATE_PER_MINUTE次新的爬蟲（最多連續SCRAPE_BURST次，0 不限制）
+    scrape_limiter = TokenBucketLimiter(
+        rate=float(os.getenv('SCRAPE_RATE_PER_MINUTE', '6')) / 60,
+        burst=int(os.getenv('SCRAPE_BURST', '3'))
+    )
+    
+    # 根據環境變數選擇資料庫類型
+    db_type = os.getenv('DB_TYPE', 'sqlite').lower()
+    
+    if db_type == 'd1':
+        try:
+            db = create_d1_database()
+            logger.info("使用Cloudflare D1資料庫")
+            # 寫入先進本機暫存佇列再由背景寫入D1（D1_SPOOL=0 停用，改為同步寫入）
+            if os.getenv('D1_SPOOL', '1') != '0':
+                db = SpooledD1Database(
+                    db,
+                    spool_path=os.getenv('D1_SPOOL_PATH', 'd1_spool.db'),
+                    batch_size=int(os.getenv('D1_SPOOL_BATCH_SIZE', '500')),
+                    flush_interval=float(os.getenv('D1_SPOOL_FLUSH_INTERVAL', '1'))
+                )
+                logger.info("D1寫入暫存佇列已啟用")
+            # D1_LOCAL_REPLICA: 本機SQLite副本路徑，設定後讀取改由副本回應並從D1增量同步
+            local_replica = os.getenv('D1_LOCAL_REPLICA')
+            if local_replica:
+                db = TieredD1Database(
+                    db,
+                    JobDatabase(db_type="sqlite", db_path=local_replica),
+                    max_staleness=float(os.getenv('D1_MAX_STALENESS', '30'))
+                )
+                logger.info(f"D1本機副本已啟用（{local_replica}）")
+            _d1_db = db
+        except Exception as e:
+            logger.warning(f"D1資料庫初始化失敗，回退到SQLite: {e}")
+            db = JobDatabase(db_type="sqlite", db_path="jobs.db")
+    else:
+        # DB_READ_REPLICAS: 以逗號分隔的唯讀副本檔案路徑（例如由Litestream還原的複本）
+        read_replicas = [path for path in os.getenv('DB_READ_REPLICAS', '').split(',') if path]
+        db = JobDatabase(
+            db_type="sqlite",
+            db_path="jobs.db",
+            replicas=read_replicas,
+            max_replica_lag=float(os.getenv('DB_MAX_REPLICA_LAG', '5'))
+        )
+        logger.info(f"使用SQLite資料庫（唯讀副本: {len(read_replicas)}）")
+    
+    # 記錄每個資料庫方法的耗時（快取命中不計入）
+    db = InstrumentedDatabase(db, backend='d1' if _d1_db is not None else 'sqlite')
+    
+    # 寫入的職缺推送給 /api/jobs/feed 的訂閱者；FEED_STORE_PATH: 多個worker與排程器共用的推送紀錄
+    # FEED_MAX_SUBSCRIBERS: 本行程的訂閱者上限（gunicorn.conf.py 限制為 WEB_THREADS - FEED_RESERVED_THREADS，
+    # 大量訂閱者由 feed_server.py 服務）
+    job_feed = JobFeed(
+        buffer_size=int(os.getenv('FEED_BUFFER_SIZE', '200')),
+        max_subscribers=int(os.getenv('FEED_MAX_SUBSCRIBERS', '1000')),
+        store_path=os.getenv('FEED_STORE_PATH') or None,
+        poll_interval=float(os.getenv('FEED_POLL_INTERVAL', '1'))
+    )
+    db = FeedPublishingDatabase(db, job_feed)
+    
+    # METRICS_DIR: 多個worker共用的指標目錄，/metrics合併所有worker的數值
+    metrics_dir = os.getenv('METRICS_DIR')
+    if metrics_dir and REGISTRY.directory is None:
+        REGISTRY.enable_multiprocess(metrics_dir)
+    
+    # 查詢結果快取（CACHE_TTL=0 停用）
+    cache_ttl = float(os.getenv('CACHE_TTL', '60'))
+    if cache_ttl > 0:
+        db = CachedJobDatabase(
+            db,
+            max_entries=int(os.getenv('CACHE_MAX_ENTRIES', '256')),
+            max_bytes=int(os.getenv('CACHE_MAX_BYTES', str(64 * 1024 * 1024))),
+            ttl=cache_ttl,
+            check_interval=float(os.getenv('CACHE_CHECK_INTERVAL', '1'))
+        )
+    
+    _state_ready = True
+
+def ensure_state():
+    """第一次呼叫時建立爬蟲、背景任務與資料庫（執行緒安全，同時到達的請求等待同一次初始化）"""
+    if _state_ready:
+        return
+    with _state_lock:
+        if not _state_ready:
+            started = time.perf_counter()
+            init_state()
+            logger.info(f"初始化完成，耗時 {time.perf_counter() - started:.2f} 秒")
+
+def shutdown_state():
+    """等待執行中的背景任務結束並關閉資料庫（送出D1暫存佇列中的職缺），可重複呼叫"""
+    global _d1_db, _stopping
+    _stopping = True
+    # 先結束推送連線，SSE請求才不會佔住worker直到逾時
+    if job_feed is not None:
+        job_feed.close()
+    if task_manager is not None:
+        task_manager.shutdown(wait=True)
+    if _d1_db is not None:
+        d1_db, _d1_db = _d1_db, None
+        d1_db.close()
+    if REGISTRY.directory:
+        REGISTRY.close()
 
-# 根據環境變數選擇資料庫類型
-db_type = os.getenv('DB_TYPE', 'sqlite').lower()
+atexit.register(shutdown_state)
 
-if db_type == 'd1':
+# 不需要爬蟲與資料庫的端點（不觸發初始化）
+STATELESS_ENDPOINTS = {'index', 'static', 'healthz', 'readyz', 'prometheus_metrics',
+                       'list_profiles', 'download_profile'}
+
+@app.before_request
+def load_state():
+    if request.endpoint is not None and request.endpoint not in STATELESS_ENDPOINTS:
+        with phase('init'):
+            ensure_state()
+
+# /readyz 的資料庫檢查結果重用的秒數
+READYZ_CACHE_SECONDS = float(os.getenv('READYZ_CACHE_SECONDS', '10'))
+_readiness = {"ready": False, "checked_at": None, "latency_ms": None, "error": None}
+_readiness_lock = threading.Lock()
+
+def check_readiness() -> dict:
+    """
+    初始化並ping資料庫，結果在READYZ_CACHE_SECONDS秒內重用
+    （同時到達的檢查等待同一次ping，頻繁的健康檢查不會增加資料庫負載）
+    """
+    with _readiness_lock:
+        checked_at = _readiness['checked_at']
+        if checked_at is not None and time.monotonic() - checked_at < READYZ_CACHE_SECONDS:
+            return dict(_readiness)
+        
+        started = time.perf_counter()
+        try:
+            ensure_state()
+            db.ping()
+            ready, error = True, None
+        except Exception as e:
+            logger.warning(f"就緒檢查失敗: {e}")
+            ready, error = False, str(e)
+        _readiness.update(ready=ready, error=error, checked_at=time.monotonic(),
+                          latency_ms=round((time.perf_counter() - started) * 1000, 1))
+        return dict(_readiness)
+
+def _projection_args():
+    """
+    解析 fields=（逗號分隔的欄位）與 compact=true（截斷長文字欄位）參數
+    
+    Returns:
+        tuple: (fields, truncate)，傳給search_jobs / get_recent_jobs
+    
+    Raises:
+        ValueError: fields包含不存在的欄位
+    """
+    fields = parse_fields(request.args.get('fields', default=None, type=str))
+    compact = request.args.get('compact', default='false', type=str).lower() == 'true'
+    return fields, COMPACT_TEXT_LENGTH if compact else None
+
+def _write_generation():
+    """目前的資料庫寫入世代（ETag使用）"""
+    return db.get_write_generation()
+
+def _searches_database():
+    """搜尋請求是否讀取資料庫（即時爬取的結果與寫入世代無關）"""
+    use_database = request.args.get('use_database', default='true', type=str).lower() == 'true'
+    return use_database and bool(request.args.get('keyword'))
+
+def _bad_request(message: str):
+    return jsonify({
+        "status": "error",
+        "message": message
+    }), 400
+
+# 單次爬蟲最多的頁數
+SCRAPE_MAX_PAGES = int(os.getenv('SCRAPE_MAX_PAGES', '10'))
+
+def _check_pages(pages) -> int:
+    """
+    檢查爬取頁數
+    
+    Raises:
+        ValueError: 不是1到SCRAPE_MAX_PAGES的整數
+    """
     try:
-        db = create_d1_database()
-        logger.info("使用Cloudflare D1資料庫")
-    except Exception as e:
-        logger.warning(f"D1資料庫初始化失敗，回退到SQLite: {e}")
-        db = JobDatabase(db_type="sqlite", db_path="jobs.db")
-else:
-    db = JobDatabase(db_type="sqlite", db_path="jobs.db")
-    logger.info("使用SQLite資料庫")
+        pages = int(pages)
+    except (TypeError, ValueError):
+        raise ValueError("pages必須是整數")
+    if not 1 <= pages <= SCRAPE_MAX_PAGES:
+        raise ValueError(f"pages必須介於1到{SCRAPE_MAX_PAGES}之間")
+    return pages
+
+def _positive_int(value, name: str) -> int:
+    """
+    檢查JSON參數是否為正整數
+    
+    Raises:
+        ValueError: 不是正整數
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{name}必須是正整數")
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{name}必須是正整數")
+    if value < 1:
+        raise ValueError(f"{name}必須是正整數")
+    return value
+
+def _client_id() -> str:
+    """速率限制使用的用戶端識別（反向代理之後需由代理設定正確的remote_addr）"""
+    return request.remote_addr or 'unknown'
+
+def _too_many_requests(error: AdmissionRejected):
+    """速率限制或爬蟲佇列已滿的回應"""
+    response = jsonify({
+        "status": "error",
+        "reason": error.reason,
+        "message": str(error),
+        "retry_after": round(error.retry_after, 1)
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(error.retry_after)))
+    return response
+
+def _lookup_scrape(flights, params: dict, keep_jobs: bool = False) -> dict:
+    """
+    以ScrapeCoalescer取得快取結果或提交新的爬蟲任務
+    
+    受理後提交背景任務失敗時釋出受理的名額，避免等待數只增不減、最後拒絕所有爬蟲
+    
+    Raises:
+        AdmissionRejected: 用戶端觸發過於頻繁或爬蟲佇列已滿
+    """
+    try:
+        return flights.lookup(params, lambda: _admitted_scrape_task(params, keep_jobs=keep_jobs))
+    except AdmissionRejected:
+        raise
+    except Exception:
+        ticket = g.pop('scrape_ticket', None)
+        if ticket is not None:
+            scrape_admission.release(ticket)
+        raise
+
+def _admitted_scrape_task(params: dict, keep_jobs: bool = False):
+    """
+    通過用戶端速率限制與准入控制後建立背景爬蟲任務（只在需要提交新任務時由ScrapeCoalescer呼叫）
+    
+    Raises:
+        AdmissionRejected: 用戶端觸發過於頻繁或爬蟲佇列已滿
+    """
+    scrape_limiter.check(_client_id())
+    ticket = scrape_admission.admit()
+    g.scrape_ticket = ticket
+    return _scrape_task(params, ticket, keep_jobs=keep_jobs)
+
+def _scrape_task(params: dict, ticket, keep_jobs: bool = False):
+    """
+    建立背景爬蟲任務：取得執行名額後逐頁爬取並寫入資料庫，每完成一頁更新進度
+    
+    Args:
+        params: scraper.iter_pages的參數
+        ticket: scrape_admission.admit()的結果
+        keep_jobs: 是否在任務結果中保留爬到的職缺（即時搜尋需要返回資料）
+    """
+    def run(progress):
+        jobs = []
+        inserted_count = 0
+        progress(pages_done=0, pages_total=params['pages'], jobs_found=0, jobs_inserted=0,
+                 queue_position=ticket.position)
+        
+        with scrape_admission.slot(ticket):
+            progress(queue_position=0)
+            for page, page_jobs in scraper.iter_pages(**params):
+                if page_jobs:
+                    inserted_count += db.insert_jobs(page_jobs, keyword=params['keyword'])
+                jobs.extend(page_jobs)
+                progress(pages_done=page, jobs_found=len(jobs), jobs_inserted=inserted_count)
+        
+        result = {
+            "scraped_count": len(jobs),
+            "inserted_count": inserted_count,
+            "message": f"成功爬取 {len(jobs)} 筆職缺，存入 {inserted_count} 筆"
+        }
+        if keep_jobs:
+            result["data"] = jobs
+        return result
+    
+    return run
+
+def _task_accepted(task_id: str, message: str, coalesced: bool = False):
+    """背景任務已受理的回應（coalesced代表共用相同條件、執行中的任務）"""
+    body = {
+        "status": "accepted",
+        "task_id": task_id,
+        "status_url": f"/api/tasks/{task_id}",
+        "events_url": f"/api/tasks/{task_id}/events",
+        "coalesced": coalesced,
+        "message": message
+    }
+    # 這次請求提交的爬蟲任務需要排隊時，附上前面等待的任務數
+    ticket = g.get('scrape_ticket')
+    if ticket is not None:
+        body["queue_position"] = ticket.position
+        if ticket.position:
+            body["message"] = f"爬蟲任務排隊中，前面還有 {ticket.position} 個任務"
+    return jsonify(body), 202
 
 @app.route('/')
 def index():
     """首頁"""
     return render_template('index.html')
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """存活檢查：只確認行程能處理請求，不連接資料庫"""
+    return jsonify({
+        "status": "ok",
+        "initialized": _state_ready
+    })
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """就緒檢查：完成初始化且資料庫可連接（結果快取READYZ_CACHE_SECONDS秒），關閉中返回503"""
+    if _stopping:
+        return jsonify({
+            "status": "stopping"
+        }), 503
+    
+    readiness = check_readiness()
+    return jsonify({
+        "status": "ready" if readiness['ready'] else "unavailable",
+        "database": {
+            "latency_ms": readiness['latency_ms'],
+            "error": readiness['error']
+        },
+        "checked_seconds_ago": round(time.monotonic() - readiness['checked_at'], 1)
+    }), 200 if readiness['ready'] else 503
+
 @app.route('/api/search', methods=['GET'])
+@conditional(generation=_write_generation, when=_searches_database, window=HTTP_ETAG_WINDOW)
 def search_jobs():
     """搜尋職缺API"""
     try:
         # 從請求參數中獲取搜尋條件
         keyword = request.args.get('keyword', default='', type=str)
         area = request.args.get('area', default='6001001000', type=str)
-        pages = request.args.get('pages', default=1, type=int)
+        pages = request.args.get('pages', default=1, type=str)
         jobcat = request.args.get('jobcat', default=None, type=str)
         salary_min = request.args.get('salary_min', default=None, type=int)
         salary_max = request.args.get('salary_max', default=None, type=int)
@@ -52,31 +497,50 @@ def search_jobs():
         
         # 檢查是否要從資料庫搜尋還是重新爬取
         use_database = request.args.get('use_database', default='true', type=str).lower() == 'true'
+        collapse_duplicates = request.args.get('collapse_duplicates', default='false', type=str).lower() == 'true'
+        try:
+            fields, truncate = _projection_args()
+            pages = _check_pages(pages)
+        except ValueError as e:
+            return _bad_request(str(e))
         
         if use_database and keyword:
-            # 從資料庫搜尋
-            jobs = db.search_jobs(keyword=keyword, limit=50)
+            # 從資料庫搜尋（可合併近似重複的職缺），只讀取需要的欄位
+            if collapse_duplicates and hasattr(db, 'rebuild_duplicates'):
+                jobs = db.search_jobs(keyword=keyword, limit=50, collapse_duplicates=True,
+                                      fields=fields, truncate=truncate)
+            else:
+                jobs = db.search_jobs(keyword=keyword, limit=50, fields=fields, truncate=truncate)
             source = "database"
         else:
-            # 重新爬取資料
+            # 在背景重新爬取資料，完成後的職缺在任務結果的data中
             logger.info(f"開始爬取職缺: keyword={keyword}, area={area}, pages={pages}")
             
-            jobs = scraper.scrape_104(
-                keyword=keyword,
-                area=area,
-                pages=pages,
-                jobcat=jobcat,
-                salary_min=salary_min,
-                salary_max=salary_max,
-                experience=experience,
-                remote_work=remote_work
-            )
+            params = dict(keyword=keyword, area=area, pages=pages, jobcat=jobcat,
+                          salary_min=salary_min, salary_max=salary_max,
+                          experience=experience, remote_work=remote_work)
+            try:
+                with phase('scrape'):
+                    flight = _lookup_scrape(search_flights, params, keep_jobs=True)
+            except AdmissionRejected as e:
+                return _too_many_requests(e)
             
-            # 將爬取的資料存入資料庫
-            if jobs:
-                db.insert_jobs(jobs)
+            if flight['result'] is None:
+                return _task_accepted(flight['task_id'], "爬蟲任務已在背景執行",
+                                      coalesced=flight['state'] == 'inflight')
             
-            source = "scraper"
+            # 返回快取的爬取結果；過期的結果同時在背景重新爬取（revalidate_task_id）
+            jobs = project_jobs(flight['result']['data'], fields, truncate)
+            return jsonify({
+                "status": "success",
+                "source": "scraper_cache",
+                "count": len(jobs),
+                "data": jobs,
+                "cached_at": flight['cached_at'],
+                "stale": flight['state'] == 'stale',
+                "revalidate_task_id": flight['task_id'],
+                "timestamp": datetime.now().isoformat()
+            })
         
         return jsonify({
             "status": "success",
@@ -94,11 +558,16 @@ def search_jobs():
         }), 500
 
 @app.route('/api/jobs/recent', methods=['GET'])
+@conditional(generation=_write_generation, window=HTTP_ETAG_WINDOW)
 def get_recent_jobs():
     """獲取最近的職缺"""
     try:
         days = request.args.get('days', default=7, type=int)
-        jobs = db.get_recent_jobs(days=days)
+        try:
+            fields, truncate = _projection_args()
+        except ValueError as e:
+            return _bad_request(str(e))
+        jobs = db.get_recent_jobs(days=days, fields=fields, truncate=truncate)
         
         return jsonify({
             "status": "success",
@@ -114,19 +583,29 @@ def get_recent_jobs():
         }), 500
 
 @app.route('/api/jobs/stats', methods=['GET'])
+@conditional('public, max-age=30', generation=_write_generation, window=HTTP_ETAG_WINDOW)
 def get_job_stats():
     """獲取職缺統計資訊"""
     try:
-        total_count = db.get_job_count()
-        recent_jobs = db.get_recent_jobs(days=7)
+        days = request.args.get('days', default=7, type=int)
+        breakdown = request.args.get('breakdown', default=None, type=str)
+        
+        # 讀取預先計算的統計數字，不掃描jobs表格
+        summary = db.get_stats_summary(days=days)
+        stats = {
+            "total_jobs": summary['total_jobs'],
+            "unique_jobs": summary.get('unique_jobs', summary['total_jobs']),
+            "recent_jobs": summary['recent_jobs'],
+            "new_jobs_today": summary['new_jobs_today'],
+            "last_updated": datetime.now().isoformat()
+        }
+        
+        if breakdown in ('area', 'keyword'):
+            stats[f"by_{breakdown}"] = db.get_stats_breakdown(breakdown, days=days)
         
         return jsonify({
             "status": "success",
-            "stats": {
-                "total_jobs": total_count,
-                "recent_jobs": len(recent_jobs),
-                "last_updated": datetime.now().isoformat()
-            }
+            "stats": stats
         })
         
     except Exception as e:
@@ -136,19 +615,175 @@ def get_job_stats():
             "message": str(e)
         }), 500
 
-@app.route('/api/jobs/cleanup', methods=['POST'])
-def cleanup_old_jobs():
-    """清理舊的職缺資料"""
+@app.route('/api/jobs/facets', methods=['GET'])
+@conditional('public, max-age=60', generation=_write_generation, window=HTTP_ETAG_WINDOW)
+def get_job_facets():
+    """地區、職類、公司、遠端工作的分面計數"""
     try:
-        days = request.json.get('days', 30) if request.is_json else 30
-        deleted_count = db.delete_old_jobs(days=days)
+        if not hasattr(db, 'facet_counts'):
+            return jsonify({
+                "status": "error",
+                "message": "目前的資料庫不支援分面計數"
+            }), 501
+        
+        filters = {
+            key: request.args.get(key, default=None, type=str)
+            for key in ('keyword', 'area', 'category', 'company', 'remote')
+        }
+        limit = request.args.get('limit', default=20, type=int)
         
         return jsonify({
             "status": "success",
-            "deleted_count": deleted_count,
-            "message": f"成功刪除 {deleted_count} 筆舊職缺資料"
+            "filters": {key: value for key, value in filters.items() if value},
+            "facets": db.facet_counts(filters, limit=limit)
         })
         
+    except Exception as e:
+        logger.error(f"獲取分面計數時發生錯誤: {e}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@app.route('/api/jobs/trends', methods=['GET'])
+@conditional('public, max-age=300', generation=_write_generation, window=HTTP_ETAG_WINDOW)
+def get_job_trends():
+    """每日在架職缺數趨勢（依觀測歷史計算）"""
+    try:
+        if not hasattr(db, 'get_alive_per_day'):
+            return jsonify({
+                "status": "error",
+                "message": "目前的資料庫不支援觀測歷史"
+            }), 501
+        
+        keyword = request.args.get('keyword', default=None, type=str)
+        days = request.args.get('days', default=30, type=int)
+        
+        return jsonify({
+            "status": "success",
+            "keyword": keyword,
+            "data": db.get_alive_per_day(keyword=keyword, days=days)
+        })
+        
+    except Exception as e:
+        logger.error(f"獲取職缺趨勢時發生錯誤: {e}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@app.route('/api/jobs/<job_id>/history', methods=['GET'])
+@conditional('public, max-age=60', generation=_write_generation, window=HTTP_ETAG_WINDOW)
+def get_job_history(job_id):
+    """單一職缺的觀測歷史（首次/最後出現時間與內容變化）"""
+    try:
+        if not hasattr(db, 'get_job_history'):
+            return jsonify({
+                "status": "error",
+                "message": "目前的資料庫不支援觀測歷史"
+            }), 501
+        
+        history = db.get_job_history(job_id)
+        
+        return jsonify({
+            "status": "success",
+            "job_id": job_id,
+            "count": len(history),
+            "data": history
+        })
+        
+    except Exception as e:
+        logger.error(f"獲取職缺歷史時發生錯誤: {e}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+def _ndjson_lines(jobs):
+    """將職缺逐筆轉成NDJSON行"""
+    for job in jobs:
+        yield json.dumps(job, ensure_ascii=False, default=str) + "\n"
+
+def _csv_lines(jobs):
+    """將職缺逐筆轉成CSV行（欄位以第一筆資料為準）"""
+    buffer = io.StringIO()
+    writer = None
+    
+    for job in jobs:
+        if writer is None:
+            # 加上BOM讓Excel正確辨識UTF-8
+            buffer.write('\ufeff')
+            writer = csv.DictWriter(buffer, fieldnames=list(job.keys()), extrasaction='ignore')
+            writer.writeheader()
+        writer.writerow(job)
+        
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+@app.route('/api/jobs/export', methods=['GET'])
+def export_jobs():
+    """串流匯出職缺資料（NDJSON或CSV），記憶體用量與資料量無關"""
+    export_format = request.args.get('format', default='ndjson', type=str).lower()
+    keyword = request.args.get('keyword', default=None, type=str)
+    company = request.args.get('company', default=None, type=str)
+    days = request.args.get('days', default=None, type=int)
+    
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({
+            "status": "error",
+            "message": f"不支援的匯出格式: {export_format}"
+        }), 400
+    
+    jobs = db.iter_jobs(keyword=keyword, company=company, days=days)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    
+    if export_format == 'csv':
+        body = _csv_lines(jobs)
+        mimetype = 'text/csv; charset=utf-8'
+    else:
+        body = _ndjson_lines(jobs)
+        mimetype = 'application/x-ndjson; charset=utf-8'
+    
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=jobs_{timestamp}.{export_format}'}
+    )
+
+@app.route('/api/jobs/cleanup', methods=['POST'])
+def cleanup_old_jobs():
+    """在背景分批清理舊的職缺資料，立即返回任務ID"""
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            days = _positive_int(data.get('days', 30), 'days')
+            batch_size = _positive_int(data.get('batch_size', 1000), 'batch_size')
+        except ValueError as e:
+            return _bad_request(str(e))
+        
+        # 同一時間只執行一個清理任務：已有任一worker的清理任務時返回該任務；
+        # 多個worker同時提交時，任務內的跨行程鎖讓清理依序執行
+        task_id = task_manager.find_active('cleanup')
+        if task_id is None:
+            def run_cleanup(progress):
+                with task_manager.exclusive('cleanup'):
+                    deleted_count = db.delete_old_jobs(
+                        days=days,
+                        batch_size=batch_size,
+                        progress_callback=lambda count: progress(deleted_count=count)
+                    )
+                return {"deleted_count": deleted_count}
+            
+            task_id = task_manager.submit('cleanup', run_cleanup, days=days, batch_size=batch_size)
+        
+        return jsonify({
+            "status": "accepted",
+            "task_id": task_id,
+            "status_url": f"/api/tasks/{task_id}",
+            "message": "清理任務已在背景執行"
+        }), 202
+        
     except Exception as e:
         logger.error(f"清理舊職缺時發生錯誤: {e}")
         return jsonify({
@@ -156,6 +791,212 @@ def cleanup_old_jobs():
             "message": str(e)
         }), 500
 
+@app.route('/api/tasks/<task_id>', methods=['GET'])
+@conditional()
+def get_task_status(task_id):
+    """查詢背景任務進度"""
+    task = task_manager.get(task_id)
+    
+    if task is None:
+        return jsonify({
+            "status": "error",
+            "message": "任務不存在"
+        }), 404
+    
+    return jsonify({
+        "status": "success",
+        "task": task
+    })
+
+@app.route('/api/tasks/<task_id>/events', methods=['GET'])
+def stream_task_events(task_id):
+    """以Server-Sent Events推送背景任務進度，任務結束後送出done事件並關閉"""
+    if task_manager.get(task_id) is None:
+        return jsonify({
+            "status": "error",
+            "message": "任務不存在"
+        }), 404
+    
+    def events():
+        for task in task_manager.iter_updates(task_id):
+            if task is None:
+                # 保持連線（避免代理伺服器關閉閒置連線）
+                yield ": keep-alive\n\n"
+                continue
+            
+            event = 'done' if task['status'] in ('success', 'error') else 'progress'
+            yield f"event: {event}\ndata: {json.dumps(task, ensure_ascii=False)}\n\n"
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# 沒有新職缺時送出保持連線訊息的間隔秒數
+FEED_HEARTBEAT = float(os.getenv('FEED_HEARTBEAT', '15'))
+
+@app.route('/api/jobs/feed', methods=['GET'])
+def stream_job_feed():
+    """
+    以Server-Sent Events推送新寫入或更新的職缺
+    
+    keyword（職缺名稱）、area（地區代碼或地址文字）、company（公司名稱）篩選，fields、compact同最近職缺；
+    用戶端來不及接收、丟棄職缺時送出lagged事件（用戶端應重新載入最近職缺）
+    """
+    try:
+        fields, truncate = _projection_args()
+    except ValueError as e:
+        return _bad_request(str(e))
+    
+    feed_filter = FeedFilter(
+        keyword=request.args.get('keyword', default=None, type=str),
+        area=request.args.get('area', default=None, type=str),
+        company=request.args.get('company', default=None, type=str)
+    )
+    try:
+        subscription = job_feed.subscribe(feed_filter)
+    except FeedFull as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 503
+    
+    def events():
+        try:
+            yield ": connected\n\n"
+            for jobs, dropped in job_feed.iter_batches(subscription, heartbeat=FEED_HEARTBEAT):
+                yield format_events(jobs, dropped, fields, truncate)
+        finally:
+            job_feed.unsubscribe(subscription)
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus格式的指標"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+def _profiles_forbidden():
+    """剖析結果需要權杖（未設定PROFILE_TOKEN時停用）"""
+    if not request_profiler.enabled:
+        return jsonify({
+            "status": "error",
+            "message": "請求剖析未啟用（未設定PROFILE_TOKEN）"
+        }), 404
+    if not request_profiler.authorized(_profile_token()):
+        return jsonify({
+            "status": "error",
+            "message": "剖析權杖不正確"
+        }), 403
+    return None
+
+@app.route('/api/profiles', methods=['GET'])
+def list_profiles():
+    """已儲存的剖析結果"""
+    forbidden = _profiles_forbidden()
+    if forbidden:
+        return forbidden
+    
+    profiles = [{key: value for key, value in info.items() if key != 'path'}
+                for info in request_profiler.list_profiles()]
+    return jsonify({
+        "status": "success",
+        "count": len(profiles),
+        "data": profiles
+    })
+
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """下載剖析結果（cProfile結果加上 format=text 時返回依累計時間排序的文字摘要）"""
+    forbidden = _profiles_forbidden()
+    if forbidden:
+        return forbidden
+    
+    path = request_profiler.find(profile_id)
+    if path is None:
+        return jsonify({
+            "status": "error",
+            "message": "剖析結果不存在"
+        }), 404
+    
+    if request.args.get('format') == 'text' and path.endswith('.prof'):
+        return Response(pstats_text(path, limit=request.args.get('limit', default=40, type=int)),
+                        content_type='text/plain; charset=utf-8')
+    return send_file(os.path.abspath(path), as_attachment=True,
+                     download_name=os.path.basename(path), max_age=0)
+
+@app.route('/api/scrape/admission', methods=['GET'])
+def get_scrape_admission():
+    """爬蟲准入控制狀態（本行程的執行與排隊數）"""
+    return jsonify({
+        "status": "success",
+        "admission": scrape_admission.stats()
+    })
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """查詢快取命中率與記憶體用量，以及即時搜尋的結果快取與請求合併次數"""
+    if not isinstance(db, CachedJobDatabase):
+        return jsonify({
+            "status": "success",
+            "enabled": False,
+            "scrape": search_flights.stats()
+        })
+
+    return jsonify({
+        "status": "success",
+        "enabled": True,
+        "cache": db.cache_stats(),
+        "scrape": search_flights.stats()
+    })
+
+@app.route('/api/db/metrics', methods=['GET'])
+def get_db_metrics():
+    """資料庫查詢延遲統計（D1依SQL類型統計次數、錯誤、重試與延遲）"""
+    if not hasattr(db, 'query_metrics'):
+        return jsonify({
+            "status": "error",
+            "message": "目前的資料庫不提供查詢統計"
+        }), 501
+    
+    return jsonify({
+        "status": "success",
+        "metrics": db.query_metrics()
+    })
+
+@app.route('/api/db/spool', methods=['GET'])
+def get_db_spool():
+    """D1寫入暫存佇列狀態（等待寫入筆數、失敗重試、無法寫入的職缺數）"""
+    if not hasattr(db, 'spool_status'):
+        return jsonify({
+            "status": "error",
+            "message": "目前的資料庫未使用寫入暫存佇列"
+        }), 501
+    
+    return jsonify({
+        "status": "success",
+        "spool": db.spool_status()
+    })
+
+@app.route('/api/db/tier', methods=['GET'])
+def get_db_tier():
+    """D1本機副本的同步狀態（落後秒數、水位、讀取分流）"""
+    if not hasattr(db, 'tier_status'):
+        return jsonify({
+            "status": "error",
+            "message": "目前的資料庫未使用本機副本"
+        }), 501
+    
+    return jsonify({
+        "status": "success",
+        "tier": db.tier_status()
+    })
+
 @app.route('/api/scrape', methods=['POST'])
 def scrape_jobs():
     """手動觸發爬蟲"""
@@ -170,32 +1011,23 @@ def scrape_jobs():
         salary_max = data.get('salary_max')
         experience = data.get('experience')
         remote_work = data.get('remote_work', False)
+        try:
+            pages = _check_pages(pages)
+        except ValueError as e:
+            return _bad_request(str(e))
         
         logger.info(f"手動觸發爬蟲: keyword={keyword}, pages={pages}")
         
-        jobs = scraper.scrape_104(
-            keyword=keyword,
-            area=area,
-            pages=pages,
-            jobcat=jobcat,
-            salary_min=salary_min,
-            salary_max=salary_max,
-            experience=experience,
-            remote_work=remote_work
-        )
-        
-        # 存入資料庫
-        if jobs:
-            inserted_count = db.insert_jobs(jobs)
-        else:
-            inserted_count = 0
-        
-        return jsonify({
-            "status": "success",
-            "scraped_count": len(jobs),
-            "inserted_count": inserted_count,
-            "message": f"成功爬取 {len(jobs)} 筆職缺，存入 {inserted_count} 筆"
-        })
+        params = dict(keyword=keyword, area=area, pages=pages, jobcat=jobcat,
+                      salary_min=salary_min, salary_max=salary_max,
+                      experience=experience, remote_work=remote_work)
+        try:
+            with phase('scrape'):
+                flight = _lookup_scrape(scrape_flights, params)
+        except AdmissionRejected as e:
+            return _too_many_requests(e)
+        return _task_accepted(flight['task_id'], "爬蟲任務已在背景執行",
+                              coalesced=flight['state'] == 'inflight')
         
     except Exception as e:
         logger.error(f"手動爬蟲時發生錯誤: {e}")
@@ -224,10 +1056,26 @@ if __name__ == '__main__':
     
     print("啟動104職缺搜尋API伺服器...")
     print("API端點:")
+    print("  GET  /healthz - 存活檢查 (不連接資料庫)")
+    print("  GET  /readyz - 就緒檢查 (快取的資料庫ping)")
     print("  GET  /api/search - 搜尋職缺")
     print("  GET  /api/jobs/recent - 獲取最近職缺")
     print("  GET  /api/jobs/stats - 獲取統計資訊")
-    print("  POST /api/jobs/cleanup - 清理舊職缺")
-    print("  POST /api/scrape - 手動觸發爬蟲")
+    print("  GET  /api/jobs/export - 串流匯出職缺 (NDJSON/CSV)")
+    print("  GET  /api/jobs/facets - 分面計數 (地區/職類/公司/遠端)")
+    print("  GET  /api/jobs/trends - 每日在架職缺趨勢")
+    print("  GET  /api/jobs/<job_id>/history - 職缺觀測歷史")
+    print("  GET  /api/jobs/feed - 新職缺即時推送 (SSE)")
+    print("  POST /api/jobs/cleanup - 清理舊職缺 (背景執行)")
+    print("  GET  /api/tasks/<task_id> - 查詢背景任務進度")
+    print("  GET  /api/tasks/<task_id>/events - 背景任務進度串流 (SSE)")
+    print("  GET  /api/cache/stats - 查詢快取統計")
+    print("  GET  /api/db/metrics - 資料庫查詢延遲統計")
+    print("  GET  /api/db/spool - D1寫入暫存佇列狀態")
+    print("  GET  /api/db/tier - D1本機副本同步狀態")
+    print("  GET  /metrics - Prometheus指標")
+    print("  GET  /api/profiles - 請求剖析結果 (需PROFILE_TOKEN)")
+    print("  POST /api/scrape - 手動觸發爬蟲 (背景執行)")
+    print("  GET  /api/scrape/admission - 爬蟲准入控制狀態")
     
     app.run(debug=True, host='0.0.0.0', port=5001) 
\ No newline at end of file
@@ -0,0 +1,364 @@
+"""
+非同步資料庫模組
+提供與JobDatabase相同操作的非同步版本：
+- SQLite：同步操作移到背景執行緒，寫入固定由單一執行緒執行
+- PostgreSQL：使用asyncpg連線池
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from database import JobDatabase
+from job_dedup import JobDedupTracker, band_keys
+from job_fields import JOB_FIELDS
+from job_history import TRACKED_FIELDS, JobHistoryTracker
+from job_stats import ALL_TIME, DIM_DUPLICATE, STAT_COLUMNS, JobStatsTracker
+
+logger = logging.getLogger(__name__)
+
+# 遞增寫入世代（查詢快取依此判斷失效）
+BUMP_GENERATION_SQL = "UPDATE write_generation SET generation = generation + 1 WHERE id = 1"
+
+
+def numbered(count: int, start: int = 1) -> List[str]:
+    """asyncpg的編號參數佔位符 $start ... $(start + count - 1)"""
+    return [f"${i}" for i in range(start, start + count)]
+
+
+class AsyncSQLiteJobDatabase:
+    """
+    非同步SQLite資料庫
+
+    包裝同步的JobDatabase：寫入（insert_jobs/delete_old_jobs）在單一寫入執行緒上依序執行，
+    避免多個連線爭奪SQLite寫入鎖；讀取使用獨立的執行緒池，可與寫入同時進行
+    """
+
+    def __init__(self, db: JobDatabase, read_workers: int = 4):
+        """
+        初始化非同步SQLite資料庫
+
+        Args:
+            db: 同步JobDatabase實例
+            read_workers: 讀取執行緒數
+        """
+        self.db = db
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="sqlite-reader")
+
+    async def _run(self, executor: ThreadPoolExecutor, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, lambda: func(*args, **kwargs))
+
+    async def insert_jobs(self, jobs: List[Dict], keyword: Optional[str] = None) -> int:
+        """插入職缺資料"""
+        return await self._run(self._writer, self.db.insert_jobs, jobs, keyword=keyword)
+
+    async def search_jobs(self, keyword: str = None, company: str = None,
+                          limit: int = 50, offset: int = 0) -> List[Dict]:
+        """搜尋職缺資料"""
+        return await self._run(self._readers, self.db.search_jobs,
+                               keyword=keyword, company=company, limit=limit, offset=offset)
+
+    async def get_job_count(self) -> int:
+        """獲取職缺總數"""
+        return await self._run(self._readers, self.db.get_job_count)
+
+    async def get_recent_jobs(self, days: int = 7) -> List[Dict]:
+        """獲取最近幾天的職缺"""
+        return await self._run(self._readers, self.db.get_recent_jobs, days=days)
+
+    async def delete_old_jobs(self, days: int = 30, batch_size: int = 1000) -> int:
+        """分批刪除舊的職缺資料"""
+        return await self._run(self._writer, self.db.delete_old_jobs, days=days, batch_size=batch_size)
+
+    async def close(self):
+        """等待進行中的操作完成並釋放執行緒"""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+
+
+class AsyncPostgresJobDatabase:
+    """
+    非同步PostgreSQL資料庫（asyncpg）
+
+    使用與JobDatabase相同的表格結構（非分區模式），寫入時在同一個交易中
+    維護job_stats統計與job_observations觀測歷史
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.stats = JobStatsTracker("postgresql")
+        self.dedup = JobDedupTracker("postgresql")
+
+    @classmethod
+    async def connect(cls, pg_config: Optional[Dict] = None, min_size: int = 1,
+                      max_size: int = 10) -> 'AsyncPostgresJobDatabase':
+        """
+        建立連線池
+
+        表格需先由同步的JobDatabase(db_type="postgresql")初始化
+        """
+        try:
+            import asyncpg
+        except ImportError:
+            raise ImportError("使用非同步PostgreSQL需要安裝asyncpg: pip install asyncpg")
+
+        pg_config = dict(pg_config or JobDatabase.default_pg_config())
+        # asyncpg的資料庫名稱參數與psycopg2不同
+        pg_config['database'] = pg_config.pop('database', None) or pg_config.pop('dbname', None)
+
+        pool = await asyncpg.create_pool(min_size=min_size, max_size=max_size, **pg_config)
+        return cls(pool)
+
+    async def _snapshot(self, conn, job_ids: List[str]) -> Counter:
+        """取得指定職缺目前對統計的貢獻"""
+        contribution = Counter()
+        rows = await conn.fetch(
+            f"SELECT {STAT_COLUMNS} FROM jobs WHERE job_id = ANY($1::text[])",
+            job_ids
+        )
+        for row in rows:
+            self.stats.count_row(contribution, row)
+        return contribution
+
+    async def insert_jobs(self, jobs: List[Dict], keyword: Optional[str] = None) -> int:
+        """插入職缺資料（與JobDatabase相同，失敗的職缺只撤銷該筆，統計與歷史只包含成功寫入的職缺）"""
+        if not jobs:
+            return 0
+
+        now = datetime.now()
+        job_ids = list(dict.fromkeys(job.get('jobId', '') for job in jobs))
+        rows = [[job.get(key, '') for key, _ in JOB_FIELDS] + [now] for job in jobs]
+
+        columns = ', '.join(column for _, column in JOB_FIELDS)
+        marks = ', '.join(f"${i}" for i in range(1, len(JOB_FIELDS) + 2))
+        updates = ',\n'.join(f"{column} = EXCLUDED.{column}" for _, column in JOB_FIELDS[1:])
+        sql = f'''
+            INSERT INTO jobs ({columns}, updated_at) VALUES ({marks})
+            ON CONFLICT (job_id) DO UPDATE SET
+                {updates},
+                updated_at = EXCLUDED.updated_at
+        '''
+
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                stats_before = await self._snapshot(conn, job_ids)
+                written_jobs = await self._write_rows(conn, sql, jobs, rows)
+                written = len(written_jobs)
+
+                # 以寫入前後的差異增量更新統計（與JobDatabase.insert_jobs相同的計算）
+                stats_after = await self._snapshot(conn, job_ids)
+                duplicate_delta = await self._record_duplicates(conn, written_jobs, now)
+                stats_rows = self.stats.merge(self.stats.write_delta(
+                    stats_before, stats_after, keyword, now, written, duplicate_delta
+                ))
+                if stats_rows:
+                    await conn.executemany(self.stats.upsert_sql(['$1', '$2', '$3', '$4']), stats_rows)
+
+                await self._record_history(conn, written_jobs, keyword or '', now)
+                await conn.execute(BUMP_GENERATION_SQL)
+
+        logger.info(f"成功插入 {written} 筆職缺資料")
+        return written
+
+    @staticmethod
+    async def _write_rows(conn, sql: str, jobs: List[Dict], rows: List[list]) -> List[Dict]:
+        """
+        寫入職缺列，返回成功寫入的職缺
+
+        先在一個儲存點中整批寫入；失敗時改為每筆各自一個儲存點，只撤銷失敗的職缺
+        （與JobDatabase的逐筆儲存點結果相同）
+        """
+        try:
+            async with conn.transaction():
+                await conn.executemany(sql, rows)
+            return list(jobs)
+        except Exception as e:
+            logger.warning(f"整批寫入職缺失敗，改為逐筆寫入: {e}")
+
+        written = []
+        for job, row in zip(jobs, rows):
+            try:
+                async with conn.transaction():
+                    await conn.execute(sql, *row)
+            except Exception as e:
+                logger.error(f"插入職缺資料時發生錯誤: {e}")
+                continue
+            written.append(job)
+        return written
+
+    async def _record_duplicates(self, conn, jobs: List[Dict], observed_at: datetime) -> int:
+        """近似重複歸群，返回重複職缺數的增減量"""
+        signatures = self.dedup.signatures(jobs)
+        if not signatures:
+            return 0
+
+        job_ids = list(signatures)
+        rows = await conn.fetch(self.dedup.existing_sql(numbered(len(job_ids))), *job_ids)
+        existing = {row[0]: (row[1], row[2], row[3]) for row in rows}
+
+        keys = list(dict.fromkeys(
+            key for signature in signatures.values() if signature is not None for key in band_keys(signature)
+        ))
+        candidates = {}
+        if keys:
+            marks = numbered(len(keys) * 2)
+            rows = await conn.fetch(
+                self.dedup.candidates_sql(list(zip(marks[::2], marks[1::2]))),
+                *[value for key in keys for value in key]
+            )
+            for band, bucket, job_id, signature_hex, canonical_id in rows:
+                candidates.setdefault((band, bucket), []).append((job_id, signature_hex, canonical_id))
+
+        plan = self.dedup.assign(signatures, existing, candidates, observed_at)
+        if plan['changed']:
+            await conn.execute("DELETE FROM job_lsh_buckets WHERE job_id = ANY($1::text[])", plan['changed'])
+        if plan['rows']:
+            await conn.executemany(self.dedup.upsert_sql(numbered(4)), plan['rows'])
+        if plan['buckets']:
+            await conn.executemany(self.dedup.bucket_sql(numbered(3)), plan['buckets'])
+        return plan['duplicate_delta']
+
+    async def _remove_duplicates(self, conn, job_ids: List[str]) -> int:
+        """移除已刪除職缺的簽章並為失去代表的群重新選出代表，返回重複職缺數的增減量"""
+        rows = await conn.fetch(
+            "SELECT job_id, canonical_id FROM job_signatures WHERE job_id = ANY($1::text[])", job_ids
+        )
+        delta = -sum(1 for row in rows if row['canonical_id'] != row['job_id'])
+
+        await conn.execute("DELETE FROM job_lsh_buckets WHERE job_id = ANY($1::text[])", job_ids)
+        await conn.execute("DELETE FROM job_signatures WHERE job_id = ANY($1::text[])", job_ids)
+
+        for row in rows:
+            if row['canonical_id'] != row['job_id']:
+                continue
+            new_id = await conn.fetchval('''
+                SELECT job_id FROM job_signatures WHERE canonical_id = $1
+                ORDER BY created_at, job_id
+                LIMIT 1
+            ''', row['job_id'])
+            if new_id:
+                await conn.execute("UPDATE job_signatures SET canonical_id = $1 WHERE canonical_id = $2",
+                                   new_id, row['job_id'])
+                delta -= 1
+
+        return delta
+
+    async def _record_history(self, conn, jobs: List[Dict], keyword: str, observed_at: datetime):
+        """追加觀測紀錄"""
+        by_id = {job['jobId']: job for job in jobs if job.get('jobId')}
+        if not by_id:
+            return
+
+        latest_rows = await conn.fetch('''
+            SELECT DISTINCT ON (job_id) job_id, content_hash FROM job_observations
+            WHERE keyword = $1 AND job_id = ANY($2::text[])
+            ORDER BY job_id, valid_to DESC
+        ''', keyword, list(by_id))
+        latest = {row['job_id']: row['content_hash'] for row in latest_rows}
+
+        rows = JobHistoryTracker.build_rows(by_id, keyword, latest, observed_at)
+        marks = [f"${i}" for i in range(1, len(TRACKED_FIELDS) + 6)]
+        await conn.executemany(JobHistoryTracker.insert_sql(marks), rows)
+
+    async def search_jobs(self, keyword: str = None, company: str = None,
+                          limit: int = 50, offset: int = 0) -> List[Dict]:
+        """搜尋職缺資料"""
+        conditions = []
+        params = []
+
+        if keyword:
+            params.append(f"%{keyword}%")
+            conditions.append(f"job_name ILIKE ${len(params)}")
+
+        if company:
+            params.append(f"%{company}%")
+            conditions.append(f"cust_name ILIKE ${len(params)}")
+
+        where_clause = " AND ".join(conditions) if conditions else "1=1"
+        params.extend([int(limit), int(offset)])
+
+        rows = await self.pool.fetch(f'''
+            SELECT * FROM jobs
+            WHERE {where_clause}
+            ORDER BY created_at DESC
+            LIMIT ${len(params) - 1} OFFSET ${len(params)}
+        ''', *params)
+        return [dict(row) for row in rows]
+
+    async def get_job_count(self) -> int:
+        """獲取職缺總數"""
+        return await self.pool.fetchval("SELECT COUNT(*) FROM jobs")
+
+    async def get_recent_jobs(self, days: int = 7) -> List[Dict]:
+        """獲取最近幾天的職缺"""
+        rows = await self.pool.fetch('''
+            SELECT * FROM jobs
+            WHERE created_at >= CURRENT_DATE - $1::integer * INTERVAL '1 day'
+            ORDER BY created_at DESC
+        ''', int(days))
+        return [dict(row) for row in rows]
+
+    async def delete_old_jobs(self, days: int = 30, batch_size: int = 1000) -> int:
+        """分批刪除舊的職缺資料，每批獨立交易"""
+        deleted_count = 0
+
+        async with self.pool.acquire() as conn:
+            while True:
+                async with conn.transaction():
+                    rows = await conn.fetch(f'''
+                        SELECT id, job_id, {STAT_COLUMNS} FROM jobs
+                        WHERE created_at < CURRENT_DATE - $1::integer * INTERVAL '1 day'
+                        LIMIT $2
+                    ''', int(days), int(batch_size))
+                    if not rows:
+                        break
+
+                    stats_delta = Counter()
+                    for row in rows:
+                        self.stats.count_row(stats_delta, tuple(row)[2:], weight=-1)
+
+                    await conn.execute("DELETE FROM jobs WHERE id = ANY($1::bigint[])", [row['id'] for row in rows])
+                    stats_delta[(ALL_TIME, DIM_DUPLICATE, '')] += await self._remove_duplicates(
+                        conn, [row['job_id'] for row in rows]
+                    )
+                    stats_rows = self.stats.merge(stats_delta)
+                    if stats_rows:
+                        await conn.executemany(self.stats.upsert_sql(['$1', '$2', '$3', '$4']), stats_rows)
+                    await conn.execute(BUMP_GENERATION_SQL)
+
+                deleted_count += len(rows)
+                if len(rows) < batch_size:
+                    break
+                await asyncio.sleep(0.05)
+
+        logger.info(f"刪除了 {deleted_count} 筆舊職缺資料")
+        return deleted_count
+
+    async def close(self):
+        """關閉連線池"""
+        await self.pool.close()
+
+
+async def create_async_database(db_type: str = "sqlite", db_path: str = "jobs.db",
+                                pg_config: Optional[Dict] = None):
+    """
+    創建非同步資料庫實例
+
+    Args:
+        db_type: 資料庫類型 ("sqlite" 或 "postgresql")
+        db_path: SQLite資料庫檔案路徑
+        pg_config: PostgreSQL連接配置
+    """
+    if db_type == "sqlite":
+        return AsyncSQLiteJobDatabase(JobDatabase(db_type="sqlite", db_path=db_path))
+    elif db_type == "postgresql":
+        # 先以同步連線建立表格，再改用連線池
+        JobDatabase(db_type="postgresql", pg_config=pg_config)
+        return await AsyncPostgresJobDatabase.connect(pg_config)
+    else:
+        raise ValueError(f"不支援的資料庫類型: {db_type}")
@@ -0,0 +1,66 @@
+"""
+D1寫入效能比較
+以local_d1替身模擬Cloudflare的網路往返時間，比較逐筆寫入與批次並行寫入：
+
+    python benchmark_d1.py --jobs 300 --latency 0.05
+"""
+
+import argparse
+import logging
+import time
+
+from cloudflare_d1 import CloudflareD1Database
+from local_d1 import LocalD1Server
+
+
+def make_jobs(count: int, prefix: str):
+    """產生測試用職缺"""
+    return [
+        {
+            'jobId': f"{prefix}-{i}",
+            'jobName': f"Python工程師 {i}",
+            'custName': f"測試公司 {i % 50}",
+            'jobAddrNoDesc': '台北市信義區',
+            'jobDetail': '負責後端API開發與維護' * 20,
+            'remoteWork': '1'
+        }
+        for i in range(count)
+    ]
+
+
+def run(label: str, jobs_count: int, latency: float, **options):
+    """以指定設定寫入並返回 (秒數, 請求數)"""
+    server = LocalD1Server(latency=latency).start()
+    try:
+        db = CloudflareD1Database('local', 'local', 'local', base_url=server.url, **options)
+        jobs = make_jobs(jobs_count, label)
+
+        server.request_count = 0
+        started = time.perf_counter()
+        inserted = db.insert_jobs(jobs)
+        elapsed = time.perf_counter() - started
+
+        assert inserted == jobs_count and db.get_job_count() == jobs_count
+        return elapsed, server.request_count
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='D1寫入效能比較')
+    parser.add_argument('--jobs', type=int, default=300, help='寫入的職缺數')
+    parser.add_argument('--latency', type=float, default=0.05, help='模擬的往返時間（秒）')
+    parser.add_argument('--concurrency', type=int, default=4, help='批次寫入的並行數')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    baseline, baseline_requests = run('single', args.jobs, args.latency,
+                                      rows_per_statement=1, write_concurrency=1)
+    batched, batched_requests = run('batched', args.jobs, args.latency,
+                                    write_concurrency=args.concurrency)
+
+    print(f"職缺數 {args.jobs}，模擬往返 {args.latency * 1000:.0f} ms")
+    print(f"  逐筆寫入: {baseline:.2f} 秒，{baseline_requests} 個請求")
+    print(f"  批次寫入: {batched:.2f} 秒，{batched_requests} 個請求（並行 {args.concurrency}）")
+    print(f"  加速 {baseline / batched:.1f} 倍")
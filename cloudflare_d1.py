@@ -5,17 +5,157 @@ Cloudflare D1 資料庫整合模組
 
 import os
 import json
+import time
+import random
 import logging
-from typing import List, Dict, Optional
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
 from datetime import datetime
 import requests
+from requests.adapters import HTTPAdapter
+
+from job_fields import JOB_FIELDS, select_list
+from metrics import D1_REQUEST_SECONDS, D1_RETRIES
+from job_stats import FACET_EXPRESSIONS, facet_conditions, facet_group_sql
 
 logger = logging.getLogger(__name__)
 
+# D1每個查詢最多可綁定的參數數量
+D1_MAX_PARAMS = 100
+
+# 可重試的HTTP狀態碼（速率限制與暫時性錯誤）
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class D1QueryError(Exception):
+    """D1返回的錯誤回應（status_code為HTTP狀態碼）"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def permanent(self) -> bool:
+        """重送也不會成功的錯誤（例如SQL或資料錯誤），不含速率限制與暫時性錯誤"""
+        return 400 <= self.status_code < 500 and self.status_code not in RETRY_STATUS
+
+
+class QueryMetrics:
+    """依SQL類型（SELECT、INSERT...）統計D1查詢次數、錯誤、重試與延遲"""
+    
+    def __init__(self, window: int = 1000):
+        """
+        Args:
+            window: 計算延遲百分位數時保留的最近查詢數
+        """
+        self.window = window
+        self._lock = threading.Lock()
+        self._kinds = {}
+    
+    def record(self, kind: str, seconds: float, error: bool = False, retries: int = 0):
+        """記錄一次查詢（含重試在內的總耗時），同時匯出到 /metrics"""
+        D1_REQUEST_SECONDS.observe(seconds, kind=kind, outcome='error' if error else 'ok')
+        if retries:
+            D1_RETRIES.inc(retries, kind=kind)
+        with self._lock:
+            entry = self._kinds.setdefault(kind, {
+                'count': 0, 'errors': 0, 'retries': 0, 'total_seconds': 0.0,
+                'latencies': deque(maxlen=self.window)
+            })
+            entry['count'] += 1
+            entry['errors'] += int(error)
+            entry['retries'] += retries
+            entry['total_seconds'] += seconds
+            entry['latencies'].append(seconds)
+    
+    def snapshot(self) -> Dict:
+        """各SQL類型的查詢數、錯誤數、重試數與延遲（毫秒）"""
+        with self._lock:
+            report = {}
+            for kind, entry in self._kinds.items():
+                latencies = sorted(entry['latencies'])
+                
+                def percentile(p):
+                    return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1)
+                
+                report[kind] = {
+                    'count': entry['count'],
+                    'errors': entry['errors'],
+                    'retries': entry['retries'],
+                    'avg_ms': round(entry['total_seconds'] / entry['count'] * 1000, 1),
+                    'p50_ms': percentile(0.5),
+                    'p95_ms': percentile(0.95),
+                    'max_ms': round(latencies[-1] * 1000, 1)
+                }
+            return report
+
+
+# 資料庫結構遷移 (版本, 說明, SQL語句)，只能在最後新增，語句必須可重複執行
+D1_MIGRATIONS = [
+    (1, 'jobs表格與索引', [
+        '''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT UNIQUE,
+            job_name TEXT NOT NULL,
+            cust_name TEXT,
+            job_url TEXT,
+            job_addr_no_desc TEXT,
+            salary_desc TEXT,
+            job_detail TEXT,
+            appear_date TEXT,
+            job_cat TEXT,
+            job_type TEXT,
+            work_exp TEXT,
+            edu TEXT,
+            skill TEXT,
+            benefit TEXT,
+            remote_work TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_job_id ON jobs(job_id)',
+        'CREATE INDEX IF NOT EXISTS idx_job_name ON jobs(job_name)',
+        'CREATE INDEX IF NOT EXISTS idx_cust_name ON jobs(cust_name)',
+        'CREATE INDEX IF NOT EXISTS idx_created_at ON jobs(created_at)'
+    ]),
+    # 寫入世代計數器，供查詢快取跨行程判斷是否失效
+    (2, 'write_generation表格', [
+        '''
+        CREATE TABLE IF NOT EXISTS write_generation (
+            id INTEGER PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        "INSERT OR IGNORE INTO write_generation (id, generation) VALUES (1, 0)"
+    ]),
+    # 依updated_at增量同步
+    (3, 'updated_at索引', [
+        'CREATE INDEX IF NOT EXISTS idx_updated_at ON jobs(updated_at, job_id)'
+    ])
+]
+
+
 class CloudflareD1Database:
     """Cloudflare D1 資料庫管理類別"""
     
-    def __init__(self, account_id: str, database_id: str, api_token: str):
+    MIGRATIONS = D1_MIGRATIONS
+    
+    def __init__(self, account_id: str, database_id: str, api_token: str,
+                 base_url: Optional[str] = None, write_concurrency: int = 4,
+                 rows_per_statement: Optional[int] = None, read_concurrency: int = 4,
+                 timeout: Tuple[float, float] = (5.0, 30.0), max_retries: int = 3,
+                 retry_backoff: float = 0.5, schema_cache_path: Optional[str] = None):
         """
         初始化D1資料庫連接
         
@@ -23,11 +163,33 @@ class CloudflareD1Database:
             account_id: Cloudflare帳戶ID
             database_id: D1資料庫ID
             api_token: Cloudflare API Token
+            base_url: API位址（預設為Cloudflare，測試時可指向local_d1替身）
+            write_concurrency: 同時送出的寫入批次數上限
+            rows_per_statement: 每個INSERT語句的職缺筆數（預設為參數上限允許的最大值）
+            read_concurrency: 同時執行的讀取查詢數上限
+            timeout: (連線逾時, 讀取逾時) 秒數
+            max_retries: 速率限制、5xx或連線錯誤時的重試次數
+            retry_backoff: 重試等待的基準秒數（指數遞增，429會優先使用Retry-After）
+            schema_cache_path: 記錄已套用結構版本的本機檔案（None代表每次啟動都向D1確認版本）
         """
         self.account_id = account_id
         self.database_id = database_id
         self.api_token = api_token
-        self.base_url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}"
+        self.base_url = base_url or \
+            f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}"
+        
+        # 每筆職缺佔用 len(JOB_FIELDS) + 1 個參數
+        max_rows = D1_MAX_PARAMS // (len(JOB_FIELDS) + 1)
+        self.rows_per_statement = max(1, min(rows_per_statement or max_rows, max_rows))
+        self.write_concurrency = max(1, write_concurrency)
+        # 最近一次批次寫入的結果，每個執行緒各自保存（gthread worker的多個請求共用同一個實例）
+        self._insert_report = threading.local()
+        
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.schema_cache_path = schema_cache_path
+        self.metrics = QueryMetrics()
         
         # 設置請求標頭
         self.headers = {
@@ -35,62 +197,116 @@ class CloudflareD1Database:
             'Content-Type': 'application/json'
         }
         
-        # 初始化資料庫表格
+        # 保持連線的Session，連線池大小與最大並行數一致，避免每個查詢重新TLS握手
+        pool_size = max(read_concurrency, write_concurrency)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        self._read_executor = ThreadPoolExecutor(max_workers=max(1, read_concurrency),
+                                                 thread_name_prefix="d1-read")
+        self._write_executor = ThreadPoolExecutor(max_workers=self.write_concurrency,
+                                                  thread_name_prefix="d1-write")
+        
+        # 確認資料庫結構版本（標記檔已是最新版本時不發出請求）
         self.init_database()
     
     def init_database(self):
-        """初始化資料庫表格"""
+        """
+        確認資料庫結構為最新版本
+
+        本機標記檔記錄的版本已是最新時不發出任何請求；
+        否則讀取schema_version的版本，只執行尚未套用的遷移
+        """
+        latest = self.MIGRATIONS[-1][0]
+        if self._cached_schema_version() == latest:
+            return
+        
         try:
-            # 創建jobs表格
-            create_table_sql = '''
-            CREATE TABLE IF NOT EXISTS jobs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                job_id TEXT UNIQUE,
-                job_name TEXT NOT NULL,
-                cust_name TEXT,
-                job_url TEXT,
-                job_addr_no_desc TEXT,
-                salary_desc TEXT,
-                job_detail TEXT,
-                appear_date TEXT,
-                job_cat TEXT,
-                job_type TEXT,
-                work_exp TEXT,
-                edu TEXT,
-                skill TEXT,
-                benefit TEXT,
-                remote_work TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            '''
-            
-            self.execute_query(create_table_sql)
-            
-            # 創建索引
-            index_sqls = [
-                'CREATE INDEX IF NOT EXISTS idx_job_id ON jobs(job_id)',
-                'CREATE INDEX IF NOT EXISTS idx_job_name ON jobs(job_name)',
-                'CREATE INDEX IF NOT EXISTS idx_cust_name ON jobs(cust_name)',
-                'CREATE INDEX IF NOT EXISTS idx_created_at ON jobs(created_at)'
-            ]
-            
-            for index_sql in index_sqls:
-                try:
-                    self.execute_query(index_sql)
-                except Exception as e:
-                    logger.warning(f"創建索引時發生警告: {e}")
-                    
-            logger.info("D1資料庫初始化完成")
-            
+            version = self.get_schema_version()
+            applied = self.migrate(version)
+            self._store_schema_version(latest)
+            if applied:
+                logger.info(f"D1資料庫結構已更新到第 {latest} 版（套用遷移 {applied}）")
         except Exception as e:
             logger.error(f"D1資料庫初始化失敗: {e}")
             raise
     
+    def get_schema_version(self) -> int:
+        """讀取D1上已套用的結構版本（尚未建立schema_version表格時為0）"""
+        # 先確認表格是否存在，全新資料庫的第一次啟動不會產生查詢錯誤的紀錄
+        result = self.execute_query(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'")
+        if not result.get('results') or not result['results'][0].get('values', [0])[0]:
+            return 0
+        
+        result = self.execute_query("SELECT MAX(version) FROM schema_version")
+        if result.get('results'):
+            return result['results'][0].get('values', [0])[0] or 0
+        return 0
+    
+    def migrate(self, current_version: int) -> List[int]:
+        """
+        依序套用版本大於current_version的遷移，每個遷移完成後記錄在schema_version
+        
+        遷移語句必須可重複執行（IF NOT EXISTS / INSERT OR IGNORE），
+        多個行程同時啟動時可能重複套用同一個遷移
+        
+        Returns:
+            List[int]: 套用的遷移版本
+        """
+        applied = []
+        for version, description, statements in self.MIGRATIONS:
+            if version <= current_version:
+                continue
+            
+            for sql in statements:
+                self.execute_query(sql)
+            self.execute_query(
+                "INSERT OR IGNORE INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                [version, description, datetime.now().isoformat()]
+            )
+            applied.append(version)
+        return applied
+    
+    def _cached_schema_version(self) -> Optional[int]:
+        """本機標記檔中這個資料庫的結構版本"""
+        if not self.schema_cache_path:
+            return None
+        try:
+            with open(self.schema_cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get(self.base_url)
+        except (OSError, ValueError):
+            return None
+    
+    def _store_schema_version(self, version: int):
+        """更新本機標記檔（先寫入暫存檔再取代，避免多個行程同時寫入時檔案損壞）"""
+        if not self.schema_cache_path:
+            return
+        try:
+            try:
+                with open(self.schema_cache_path, 'r', encoding='utf-8') as f:
+                    versions = json.load(f)
+            except (OSError, ValueError):
+                versions = {}
+            versions[self.base_url] = version
+            
+            temp_path = f"{self.schema_cache_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(versions, f)
+            os.replace(temp_path, self.schema_cache_path)
+        except OSError as e:
+            logger.warning(f"寫入D1結構版本標記時發生錯誤: {e}")
+    
     def execute_query(self, sql: str, params: List = None) -> Dict:
         """
         執行SQL查詢
         
+        速率限制（429）、5xx與連線錯誤會重試max_retries次，
+        429回應帶有Retry-After時依其等待，否則以指數遞增加隨機抖動的間隔等待
+        
         Args:
             sql: SQL查詢語句
             params: 查詢參數
@@ -98,89 +314,296 @@ class CloudflareD1Database:
         Returns:
             Dict: 查詢結果
         """
+        payload = {
+            'sql': sql
+        }
+        
+        if params:
+            payload['params'] = params
+        
+        kind = sql.split(None, 1)[0].upper() if sql.strip() else 'UNKNOWN'
+        started = time.perf_counter()
+        attempt = 0
+        
         try:
-            payload = {
-                'sql': sql
-            }
-            
-            if params:
-                payload['params'] = params
-            
-            response = requests.post(
-                f"{self.base_url}/query",
-                headers=self.headers,
-                json=payload
-            )
-            
-            response.raise_for_status()
-            result = response.json()
-            
-            if not result.get('success'):
-                raise Exception(f"D1查詢失敗: {result.get('errors', '未知錯誤')}")
-            
-            return result.get('result', {})
-            
+            while True:
+                try:
+                    response = self.session.post(f"{self.base_url}/query", json=payload, timeout=self.timeout)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self._backoff(attempt)
+                    reason = str(e)
+                else:
+                    if response.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                        result = self._parse_response(response)
+                        self.metrics.record(kind, time.perf_counter() - started, retries=attempt)
+                        return result
+                    delay = self._retry_after(response)
+                    if delay is None:
+                        delay = self._backoff(attempt)
+                    reason = f"HTTP {response.status_code}"
+                
+                attempt += 1
+                logger.warning(f"D1查詢失敗（{reason}），{delay:.2f} 秒後第 {attempt} 次重試")
+                time.sleep(delay)
+                
         except Exception as e:
+            self.metrics.record(kind, time.perf_counter() - started, error=True, retries=attempt)
             logger.error(f"執行D1查詢時發生錯誤: {e}")
             raise
     
-    def insert_jobs(self, jobs: List[Dict]) -> int:
+    @staticmethod
+    def _parse_response(response) -> Dict:
+        """解析D1回應，失敗時拋出包含D1錯誤訊息的例外"""
+        try:
+            result = response.json()
+        except ValueError:
+            response.raise_for_status()
+            raise
+        
+        # D1的錯誤回應也帶有errors，保留原因以便回報是哪一筆失敗
+        if not response.ok or not result.get('success'):
+            raise D1QueryError(f"D1查詢失敗 ({response.status_code}): {result.get('errors', '未知錯誤')}",
+                               response.status_code)
+        
+        return result.get('result', {})
+    
+    def _backoff(self, attempt: int) -> float:
+        """第attempt次重試前的等待秒數（指數遞增加隨機抖動）"""
+        return self.retry_backoff * (2 ** attempt) * (0.5 + random.random())
+    
+    @staticmethod
+    def _retry_after(response) -> Optional[float]:
+        """讀取Retry-After標頭（秒數），最多等待60秒"""
+        value = response.headers.get('Retry-After')
+        try:
+            return min(max(float(value), 0.0), 60.0) if value is not None else None
+        except ValueError:
+            return None
+    
+    def submit_query(self, sql: str, params: List = None) -> Future:
+        """在讀取執行緒池中執行查詢，返回Future（同時執行數不超過read_concurrency）"""
+        return self._read_executor.submit(self.execute_query, sql, params)
+    
+    def execute_many(self, queries: List[Tuple[str, Optional[List]]]) -> List[Dict]:
+        """
+        並行執行多個互不相依的讀取查詢
+        
+        Args:
+            queries: [(sql, params)]
+            
+        Returns:
+            List[Dict]: 依輸入順序的查詢結果（任一查詢失敗時拋出例外）
+        """
+        futures = [self.submit_query(sql, params) for sql, params in queries]
+        return [future.result() for future in futures]
+    
+    def query_metrics(self) -> Dict:
+        """各SQL類型的查詢延遲統計"""
+        return self.metrics.snapshot()
+    
+    @property
+    def last_insert_report(self) -> Optional[Dict]:
+        """本執行緒最近一次insert_jobs / insert_jobs_batched的結果（格式見insert_jobs_batched）"""
+        return getattr(self._insert_report, 'value', None)
+    
+    @last_insert_report.setter
+    def last_insert_report(self, report: Optional[Dict]):
+        self._insert_report.value = report
+    
+    def close(self):
+        """關閉執行緒池與HTTP連線"""
+        self._read_executor.shutdown(wait=True)
+        self._write_executor.shutdown(wait=True)
+        self.session.close()
+    
+    def insert_jobs(self, jobs: List[Dict], keyword: Optional[str] = None) -> int:
         """
         插入職缺資料到D1資料庫
         
         Args:
             jobs: 職缺資料列表
+            keyword: 搜尋關鍵字（與JobDatabase介面一致，D1不維護關鍵字統計）
             
         Returns:
-            int: 成功插入的記錄數
+            int: 成功插入的記錄數（詳細結果見last_insert_report）
         """
         if not jobs:
             return 0
         
-        inserted_count = 0
+        report = self.insert_jobs_batched(jobs)
+        return report['inserted']
+    
+    def _upsert_sql(self, row_count: int) -> str:
+        """多筆職缺的UPSERT語句（INSERT OR REPLACE）"""
+        columns = ', '.join(column for _, column in JOB_FIELDS)
+        row = '(' + ', '.join(['?'] * (len(JOB_FIELDS) + 1)) + ')'
+        return f"INSERT OR REPLACE INTO jobs ({columns}, updated_at) VALUES " + ', '.join([row] * row_count)
+    
+    @staticmethod
+    def _job_params(job: Dict, updated_at: str) -> List:
+        """單筆職缺的參數"""
+        return [job.get(key, '') for key, _ in JOB_FIELDS] + [updated_at]
+    
+    def _write_chunk(self, chunk: List[Dict], updated_at: str) -> Dict:
+        """
+        以一個多列INSERT寫入一批職缺
         
-        for job in jobs:
+        整批因資料錯誤（D1QueryError.permanent）失敗時逐筆重試，找出失敗的職缺；
+        暫時性錯誤（逾時、速率限制、5xx）已由execute_query重試過，直接整批回報為可重送，
+        避免D1故障時每批再多送出逐筆請求
+        
+        Returns:
+            Dict: inserted、error（整批失敗的原因）、failed_rows
+        """
+        params = [value for job in chunk for value in self._job_params(job, updated_at)]
+        try:
+            self.execute_query(self._upsert_sql(len(chunk)), params)
+            return {'inserted': len(chunk), 'error': None, 'failed_rows': []}
+        except Exception as e:
+            chunk_error = str(e)
+            if not (isinstance(e, D1QueryError) and e.permanent):
+                failed_rows = [{'job_id': job.get('jobId', ''), 'error': chunk_error, 'permanent': False}
+                               for job in chunk]
+                return {'inserted': 0, 'error': chunk_error, 'failed_rows': failed_rows}
+        
+        inserted = 0
+        failed_rows = []
+        for job in chunk:
             try:
-                # 使用UPSERT語法（INSERT OR REPLACE）
-                sql = '''
-                INSERT OR REPLACE INTO jobs (
-                    job_id, job_name, cust_name, job_url, job_addr_no_desc,
-                    salary_desc, job_detail, appear_date, job_cat, job_type,
-                    work_exp, edu, skill, benefit, remote_work, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                '''
-                
-                params = [
-                    job.get('jobId', ''),
-                    job.get('jobName', ''),
-                    job.get('custName', ''),
-                    job.get('jobUrl', ''),
-                    job.get('jobAddrNoDesc', ''),
-                    job.get('salaryDesc', ''),
-                    job.get('jobDetail', ''),
-                    job.get('appearDate', ''),
-                    job.get('jobCat', ''),
-                    job.get('jobType', ''),
-                    job.get('workExp', ''),
-                    job.get('edu', ''),
-                    job.get('skill', ''),
-                    job.get('benefit', ''),
-                    job.get('remoteWork', ''),
-                    datetime.now().isoformat()
-                ]
-                
-                result = self.execute_query(sql, params)
-                inserted_count += 1
-                
+                self.execute_query(self._upsert_sql(1), self._job_params(job, updated_at))
+                inserted += 1
             except Exception as e:
-                logger.error(f"插入職缺資料時發生錯誤: {e}")
-                continue
+                failed_rows.append({
+                    'job_id': job.get('jobId', ''),
+                    'error': str(e),
+                    'permanent': isinstance(e, D1QueryError) and e.permanent
+                })
+        
+        return {'inserted': inserted, 'error': chunk_error, 'failed_rows': failed_rows}
+    
+    def insert_jobs_batched(self, jobs: List[Dict]) -> Dict:
+        """
+        批次寫入職缺
         
-        logger.info(f"成功插入 {inserted_count} 筆職缺資料到D1")
-        return inserted_count
+        每個多列INSERT不超過D1的參數上限，最多write_concurrency個批次同時送出。
+        
+        Args:
+            jobs: 職缺資料列表
+            
+        Returns:
+            Dict: inserted（成功筆數）、chunks（批次數）、
+                failed_chunks（[{"chunk": 批次序號, "job_ids": [...], "error": ...}]）、
+                failed_rows（逐筆重試後仍失敗的 [{"job_id": ..., "error": ..., "permanent": 是否為重送也不會成功的錯誤}]）
+        """
+        updated_at = datetime.now().isoformat()
+        size = self.rows_per_statement
+        chunks = [jobs[start:start + size] for start in range(0, len(jobs), size)]
+        
+        report = {'inserted': 0, 'chunks': len(chunks), 'failed_chunks': [], 'failed_rows': []}
+        if not chunks:
+            self.last_insert_report = report
+            return report
+        
+        results = list(self._write_executor.map(lambda chunk: self._write_chunk(chunk, updated_at), chunks))
+        
+        for index, (chunk, result) in enumerate(zip(chunks, results)):
+            report['inserted'] += result['inserted']
+            report['failed_rows'].extend(result['failed_rows'])
+            if result['error']:
+                report['failed_chunks'].append({
+                    'chunk': index,
+                    'job_ids': [job.get('jobId', '') for job in chunk],
+                    'error': result['error']
+                })
+        
+        if report['inserted']:
+            self._bump_generation()
+        
+        if report['failed_rows']:
+            logger.error(f"D1寫入失敗 {len(report['failed_rows'])} 筆: "
+                         f"{[row['job_id'] for row in report['failed_rows']]}")
+        logger.info(f"成功插入 {report['inserted']} 筆職缺資料到D1（{report['chunks']} 個批次）")
+        
+        self.last_insert_report = report
+        return report
+    
+    @staticmethod
+    def _sync_values(row: Dict) -> List:
+        """同步寫入的單筆參數：職缺欄位、created_at與updated_at（updated_at統一為insert_jobs使用的ISO格式）"""
+        created_at, updated_at = row.get('created_at'), row.get('updated_at')
+        return [row.get(column) if row.get(column) is not None else '' for _, column in JOB_FIELDS] + [
+            str(created_at) if created_at is not None else datetime.now().isoformat(sep=' ', timespec='seconds'),
+            updated_at.isoformat() if isinstance(updated_at, datetime) else str(updated_at).replace(' ', 'T', 1)
+        ]
+    
+    def apply_changes(self, rows: List[Dict]) -> Dict:
+        """
+        套用從其他資料庫同步來的職缺列（資料表欄位名稱，保留來源的created_at與updated_at）
+        
+        以job_id比對，只有updated_at比D1新的版本會寫入（後寫入者優先）。
+        與insert_jobs不同，任一批次失敗時拋出例外，讓同步程序不推進水位
+        
+        Args:
+            rows: 職缺列（search_jobs等方法返回的格式）
+            
+        Returns:
+            Dict: applied（寫入筆數）、skipped（D1已是相同或較新版本的筆數）
+        """
+        # 同一批中同一個職缺只保留最新版本
+        incoming = {}
+        for row in rows:
+            values = self._sync_values(row)
+            current = incoming.get(row['job_id'])
+            if current is None or values[-1] > current[-1]:
+                incoming[row['job_id']] = values
+        
+        if not incoming:
+            return {'applied': 0, 'skipped': 0}
+        
+        columns = [column for _, column in JOB_FIELDS] + ['created_at', 'updated_at']
+        size = max(1, D1_MAX_PARAMS // len(columns))
+        values = list(incoming.values())
+        chunks = [values[start:start + size] for start in range(0, len(values), size)]
+        
+        placeholders = '(' + ', '.join(['?'] * len(columns)) + ')'
+        updates = ', '.join(f"{column} = excluded.{column}" for column in columns[1:])
+        
+        def write(chunk):
+            sql = f'''
+            INSERT INTO jobs ({', '.join(columns)}) VALUES {', '.join([placeholders] * len(chunk))}
+            ON CONFLICT (job_id) DO UPDATE SET {updates}
+            WHERE excluded.updated_at > jobs.updated_at
+            '''
+            result = self.execute_query(sql, [value for row in chunk for value in row])
+            return result.get('meta', {}).get('changes', 0)
+        
+        applied = sum(self._write_executor.map(write, chunks))
+        if applied:
+            self._bump_generation()
+        
+        return {'applied': applied, 'skipped': len(rows) - applied}
+    
+    def _bump_generation(self):
+        """遞增寫入世代"""
+        try:
+            self.execute_query("UPDATE write_generation SET generation = generation + 1 WHERE id = 1")
+        except Exception as e:
+            logger.warning(f"更新寫入世代時發生錯誤: {e}")
+    
+    def get_write_generation(self) -> int:
+        """讀取目前的寫入世代"""
+        result = self.execute_query("SELECT generation FROM write_generation WHERE id = 1")
+        
+        if 'results' in result and result['results']:
+            return result['results'][0].get('values', [0])[0]
+        
+        return 0
     
     def search_jobs(self, keyword: str = None, company: str = None, 
-                   limit: int = 50, offset: int = 0) -> List[Dict]:
+                   limit: int = 50, offset: int = 0, fields: Optional[Tuple[str, ...]] = None,
+                   truncate: Optional[int] = None) -> List[Dict]:
         """
         搜尋職缺資料
         
@@ -189,6 +612,8 @@ class CloudflareD1Database:
             company: 公司名稱關鍵字
             limit: 限制返回記錄數
             offset: 偏移量
+            fields: 只讀取的資料表欄位（None代表全部欄位）
+            truncate: 長文字欄位在D1端截斷到的字元數，減少回應的資料量
             
         Returns:
             List[Dict]: 職缺資料列表
@@ -209,7 +634,7 @@ class CloudflareD1Database:
             where_clause = " AND ".join(conditions) if conditions else "1=1"
             
             sql = f'''
-            SELECT * FROM jobs 
+            SELECT {select_list(fields, truncate)} FROM jobs 
             WHERE {where_clause}
             ORDER BY created_at DESC
             LIMIT {limit} OFFSET {offset}
@@ -217,23 +642,75 @@ class CloudflareD1Database:
             
             result = self.execute_query(sql, params)
             
-            # 轉換結果格式
-            jobs = []
-            if 'results' in result:
-                for row in result['results']:
-                    job = {}
-                    if 'columns' in result and 'values' in row:
-                        for i, column in enumerate(result['columns']):
-                            if i < len(row['values']):
-                                job[column] = row['values'][i]
-                    jobs.append(job)
-            
-            return jobs
+            return self._rows_to_dicts(result)
             
         except Exception as e:
             logger.error(f"搜尋職缺時發生錯誤: {e}")
             return []
     
+    @staticmethod
+    def _rows_to_dicts(result: Dict) -> List[Dict]:
+        """將D1查詢結果轉換為字典列表"""
+        jobs = []
+        if 'results' in result:
+            for row in result['results']:
+                job = {}
+                if 'columns' in result and 'values' in row:
+                    for i, column in enumerate(result['columns']):
+                        if i < len(row['values']):
+                            job[column] = row['values'][i]
+                jobs.append(job)
+        
+        return jobs
+    
+    def iter_jobs(self, keyword: str = None, company: str = None,
+                  days: Optional[int] = None, batch_size: int = 500) -> Iterator[Dict]:
+        """
+        以串流方式逐筆讀取職缺
+        
+        D1沒有伺服器端游標，改以id做鍵集分頁（WHERE id > 上一批最大id），
+        每次只持有一批資料，且不會因OFFSET變大而越來越慢
+        """
+        conditions = ["id > ?"]
+        params = []
+        
+        if keyword:
+            conditions.append("job_name LIKE ?")
+            params.append(f"%{keyword}%")
+        
+        if company:
+            conditions.append("cust_name LIKE ?")
+            params.append(f"%{company}%")
+        
+        if days is not None:
+            conditions.append("created_at >= datetime('now', ?)")
+            params.append(f"-{int(days)} days")
+        
+        sql = f'''
+        SELECT * FROM jobs
+        WHERE {" AND ".join(conditions)}
+        ORDER BY id
+        LIMIT {int(batch_size)}
+        '''
+        
+        last_id = 0
+        while True:
+            jobs = self._rows_to_dicts(self.execute_query(sql, [last_id] + params))
+            if not jobs:
+                break
+            
+            for job in jobs:
+                yield job
+            
+            next_id = jobs[-1].get('id')
+            if len(jobs) < batch_size or next_id is None or next_id == last_id:
+                break
+            last_id = next_id
+    
+    def ping(self):
+        """檢查D1是否可連接（就緒檢查使用，失敗時拋出例外）"""
+        self.execute_query("SELECT 1")
+    
     def get_job_count(self) -> int:
         """獲取職缺總數"""
         try:
@@ -249,53 +726,175 @@ class CloudflareD1Database:
             logger.error(f"獲取職缺總數時發生錯誤: {e}")
             return 0
     
-    def get_recent_jobs(self, days: int = 7) -> List[Dict]:
-        """獲取最近幾天的職缺"""
+    def get_changes(self, since: Optional[str] = None, after_job_id: str = '',
+                    limit: int = 1000) -> List[Dict]:
+        """
+        依 (updated_at, job_id) 順序讀取在指定位置之後更新的職缺，供增量同步分頁使用
+    
+        與其他讀取方法不同，查詢失敗時拋出例外，同步程序才不會把失敗當成沒有新資料
+    
+        Args:
+            since: 上一頁最後一筆的updated_at（None代表從頭開始）
+            after_job_id: 上一頁最後一筆的job_id
+            limit: 每頁筆數
+    
+        Returns:
+            List[Dict]: 職缺資料列表
+        """
+        if since is None:
+            sql = "SELECT * FROM jobs ORDER BY updated_at, job_id LIMIT ?"
+            params = [limit]
+        else:
+            sql = '''
+            SELECT * FROM jobs
+            WHERE updated_at > ? OR (updated_at = ? AND job_id > ?)
+            ORDER BY updated_at, job_id
+            LIMIT ?
+            '''
+            params = [since, since, after_job_id, limit]
+    
+        return self._rows_to_dicts(self.execute_query(sql, params))
+    
+    def get_recent_jobs(self, days: int = 7, fields: Optional[Tuple[str, ...]] = None,
+                        truncate: Optional[int] = None) -> List[Dict]:
+        """獲取最近幾天的職缺（fields、truncate同search_jobs）"""
         try:
             sql = '''
-            SELECT * FROM jobs 
+            SELECT {} FROM jobs 
             WHERE created_at >= datetime('now', '-{} days')
             ORDER BY created_at DESC
-            '''.format(days)
+            '''.format(select_list(fields, truncate), days)
             
             result = self.execute_query(sql)
             
-            # 轉換結果格式
-            jobs = []
-            if 'results' in result:
-                for row in result['results']:
-                    job = {}
-                    if 'columns' in result and 'values' in row:
-                        for i, column in enumerate(result['columns']):
-                            if i < len(row['values']):
-                                job[column] = row['values'][i]
-                    jobs.append(job)
-            
-            return jobs
+            return self._rows_to_dicts(result)
             
         except Exception as e:
             logger.error(f"獲取最近職缺時發生錯誤: {e}")
             return []
     
-    def delete_old_jobs(self, days: int = 30) -> int:
-        """刪除舊的職缺資料"""
+    def delete_old_jobs(self, days: int = 30, batch_size: int = 1000, pause: float = 0.05,
+                        progress_callback: Optional[Callable[[int], None]] = None) -> int:
+        """分批刪除舊的職缺資料，避免單一查詢長時間佔用D1"""
+        deleted_count = 0
+        
         try:
             sql = '''
-            DELETE FROM jobs 
-            WHERE created_at < datetime('now', '-{} days')
-            '''.format(days)
+            DELETE FROM jobs WHERE id IN (
+                SELECT id FROM jobs
+                WHERE created_at < datetime('now', '-{} days')
+                LIMIT {}
+            )
+            '''.format(int(days), int(batch_size))
             
-            result = self.execute_query(sql)
+            while True:
+                result = self.execute_query(sql)
+                
+                # 獲取刪除的記錄數
+                changes = result.get('meta', {}).get('changes', 0)
+                deleted_count += changes
+                
+                if progress_callback:
+                    progress_callback(deleted_count)
+                
+                if changes < batch_size:
+                    break
+                time.sleep(pause)
             
-            # 獲取刪除的記錄數
-            deleted_count = result.get('meta', {}).get('changes', 0)
+            if deleted_count:
+                self._bump_generation()
             
             logger.info(f"成功刪除 {deleted_count} 筆舊職缺資料")
             return deleted_count
             
         except Exception as e:
             logger.error(f"刪除舊職缺時發生錯誤: {e}")
-            return 0
+            return deleted_count
+    
+    def get_stats_summary(self, days: int = 7) -> Dict:
+        """
+        獲取統計數字
+        
+        D1沒有增量統計表格，改以COUNT查詢計算，避免下載整段期間的職缺資料
+        """
+        summary = {'total_jobs': 0, 'recent_jobs': 0, 'new_jobs_today': 0}
+        
+        try:
+            sql = '''
+            SELECT
+                COUNT(*) AS total_jobs,
+                SUM(CASE WHEN created_at >= date('now', '-{} days') THEN 1 ELSE 0 END) AS recent_jobs,
+                SUM(CASE WHEN created_at >= date('now') THEN 1 ELSE 0 END) AS new_jobs_today
+            FROM jobs
+            '''.format(int(days))
+            
+            result = self.execute_query(sql)
+            
+            if 'results' in result and result['results']:
+                values = result['results'][0].get('values', [0, 0, 0])
+                summary['total_jobs'] = values[0] or 0
+                summary['recent_jobs'] = values[1] or 0
+                summary['new_jobs_today'] = values[2] or 0
+            
+        except Exception as e:
+            logger.error(f"獲取統計數字時發生錯誤: {e}")
+        
+        return summary
+    
+    def get_stats_breakdown(self, dimension: str, days: Optional[int] = None,
+                            limit: int = 50) -> List[Dict]:
+        """依地區列出職缺數（D1未記錄搜尋關鍵字，keyword維度返回空列表）"""
+        if dimension != 'area':
+            return []
+        
+        try:
+            where_clause = "1=1"
+            if days is not None:
+                where_clause = "created_at >= date('now', '-{} days')".format(int(days))
+            
+            sql = f'''
+            SELECT substr(job_addr_no_desc, 1, 3) AS area, COUNT(*) AS count FROM jobs
+            WHERE {where_clause}
+            GROUP BY area
+            ORDER BY count DESC
+            LIMIT {int(limit)}
+            '''
+            
+            result = self.execute_query(sql)
+            
+            breakdown = []
+            if 'results' in result:
+                for row in result['results']:
+                    values = row.get('values', [])
+                    if len(values) >= 2:
+                        breakdown.append({'value': values[0] or '', 'count': values[1]})
+            
+            return breakdown
+            
+        except Exception as e:
+            logger.error(f"獲取地區統計時發生錯誤: {e}")
+            return []
+    
+    def facet_counts(self, filters: Optional[Dict] = None, limit: int = 20) -> Dict[str, List[Dict]]:
+        """分面計數（D1沒有預先計算的彙總，各分面的GROUP BY並行執行）"""
+        filters = {key: value for key, value in (filters or {}).items() if value not in (None, '')}
+        
+        futures = {}
+        for dimension in FACET_EXPRESSIONS:
+            others = {key: value for key, value in filters.items() if key != dimension}
+            conditions, params = facet_conditions(others, '?')
+            futures[dimension] = self.submit_query(facet_group_sql(dimension, conditions, limit), params)
+        
+        facets = {}
+        for dimension, future in futures.items():
+            try:
+                facets[dimension] = [{'value': row.get('value'), 'count': row.get('count', 0)}
+                                     for row in self._rows_to_dicts(future.result())]
+            except Exception as e:
+                logger.error(f"獲取分面計數時發生錯誤: {e}")
+                facets[dimension] = []
+        
+        return facets
     
     def get_database_info(self) -> Dict:
         """獲取資料庫資訊"""
@@ -326,7 +925,13 @@ def get_d1_config():
     return {
         'account_id': os.getenv('CLOUDFLARE_ACCOUNT_ID'),
         'database_id': os.getenv('CLOUDFLARE_D1_DATABASE_ID', '845a885d-2722-4b74-9f50-e404d02216f3'),
-        'api_token': os.getenv('CLOUDFLARE_API_TOKEN')
+        'api_token': os.getenv('CLOUDFLARE_API_TOKEN'),
+        'base_url': os.getenv('D1_API_BASE_URL'),
+        'write_concurrency': int(os.getenv('D1_WRITE_CONCURRENCY', '4')),
+        'read_concurrency': int(os.getenv('D1_READ_CONCURRENCY', '4')),
+        'timeout': (float(os.getenv('D1_CONNECT_TIMEOUT', '5')), float(os.getenv('D1_READ_TIMEOUT', '30'))),
+        'max_retries': int(os.getenv('D1_MAX_RETRIES', '3')),
+        'schema_cache_path': os.getenv('D1_SCHEMA_CACHE', '.d1_schema_cache.json') or None
     }
 
 def create_d1_database():
@@ -339,5 +944,11 @@ def create_d1_database():
     return CloudflareD1Database(
         account_id=config['account_id'],
         database_id=config['database_id'],
-        api_token=config['api_token']
+        api_token=config['api_token'],
+        base_url=config['base_url'],
+        write_concurrency=config['write_concurrency'],
+        read_concurrency=config['read_concurrency'],
+        timeout=config['timeout'],
+        max_retries=config['max_retries'],
+        schema_cache_path=config['schema_cache_path']
     ) 
\ No newline at end of file
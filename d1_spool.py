@@ -0,0 +1,375 @@
+"""
+D1寫入暫存佇列模組
+insert_jobs先將職缺寫入本機SQLite檔案後立即返回，背景執行緒再依序分批寫入Cloudflare D1，
+API延遲不再受D1往返時間影響，D1無法連線或行程重啟時資料也不會遺失
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows：沒有跨行程的寫入鎖，只能由單一行程使用同一個暫存檔
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SPOOL_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS spool (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id TEXT,
+        keyword TEXT,
+        payload TEXT NOT NULL,
+        enqueued_at REAL NOT NULL,
+        attempts INTEGER DEFAULT 0,
+        last_error TEXT
+    )
+'''
+
+# 重送也不會成功的職缺（例如資料違反D1的限制），移出佇列以免阻塞後面的資料
+DEAD_LETTER_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS spool_dead_letter (
+        seq INTEGER PRIMARY KEY,
+        job_id TEXT,
+        keyword TEXT,
+        payload TEXT NOT NULL,
+        enqueued_at REAL NOT NULL,
+        failed_at REAL NOT NULL,
+        error TEXT
+    )
+'''
+
+
+def coalesce(rows: List[tuple]) -> List[Dict]:
+    """
+    合併同一批次中重複的職缺，只保留最後寫入的版本
+
+    同一個職缺在一批中只送出一次，D1上的結果因此與依序逐筆寫入相同
+
+    Args:
+        rows: 依seq排序的 [(seq, job_id, payload)]
+
+    Returns:
+        List[Dict]: 依最後一次出現的順序排列的職缺
+    """
+    latest = OrderedDict()
+    for seq, job_id, payload in rows:
+        key = job_id or f"#{seq}"
+        latest.pop(key, None)
+        latest[key] = json.loads(payload)
+    return list(latest.values())
+
+
+class SpooledD1Database:
+    """
+    帶本機暫存佇列的D1資料庫包裝
+
+    - insert_jobs將職缺附加到SQLite暫存檔（同步寫入磁碟）後立即返回
+    - 背景執行緒依seq順序每次取出batch_size筆，以insert_jobs_batched寫入D1，
+      只刪除確定寫入成功的資料；D1無法連線時保留在佇列中並以指數退避重試
+    - 同一批中的同一個職缺只送出最新版本；寫入失敗時這個職缺的所有版本一起留在佇列中，
+      因此D1上的職缺不會被較舊的版本覆蓋。重送也不會成功的職缺（D1返回4xx）移到spool_dead_letter表格
+    - 其他屬性與方法（搜尋、統計等讀取）直接轉交給底層資料庫，
+      尚未寫入D1的職缺要等背景寫入後才查得到
+    - 多個行程（例如多個WSGI worker）共用同一個暫存檔時，以檔案鎖確保同一時間只有一個行程寫入D1，
+      同一個職缺的新舊版本不會由不同行程同時送出
+    """
+
+    def __init__(self, db, spool_path: str = 'd1_spool.db', batch_size: int = 500,
+                 flush_interval: float = 1.0, retry_backoff: float = 1.0,
+                 max_backoff: float = 60.0, autostart: bool = True):
+        """
+        初始化暫存佇列
+
+        Args:
+            db: CloudflareD1Database實例
+            spool_path: 暫存佇列的SQLite檔案路徑
+            batch_size: 每次寫入D1的最多職缺數
+            flush_interval: 佇列為空時多久檢查一次（有新資料時立即寫入）
+            retry_backoff: 寫入失敗後第一次重試前的等待秒數
+            max_backoff: 重試等待秒數上限
+            autostart: 是否立即啟動背景寫入執行緒
+        """
+        self.db = db
+        self.spool_path = spool_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+        self.flushed = 0
+        self.dead_lettered = 0
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_flush_at = None
+
+        self._init_spool()
+        if autostart:
+            self.start()
+
+    def __getattr__(self, name: str):
+        return getattr(self.db, name)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.spool_path, timeout=30)
+
+    def _init_spool(self):
+        """建立暫存表格；WAL模式讓附加與背景寫入互不阻塞，synchronous=FULL確保提交後不會遺失"""
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(SPOOL_TABLE_SQL)
+            conn.execute(DEAD_LETTER_TABLE_SQL)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def start(self):
+        """啟動背景寫入執行緒"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='d1-spool-flusher', daemon=True)
+        self._thread.start()
+
+    def insert_jobs(self, jobs: List[Dict], keyword: Optional[str] = None) -> int:
+        """
+        將職缺加入暫存佇列
+
+        Args:
+            jobs: 職缺資料列表
+            keyword: 搜尋關鍵字
+
+        Returns:
+            int: 加入佇列的職缺數（實際寫入D1的結果見spool_status）
+        """
+        if not jobs:
+            return 0
+
+        now = time.time()
+        rows = [(job.get('jobId', ''), keyword, json.dumps(job, ensure_ascii=False), now) for job in jobs]
+
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA synchronous=FULL')
+            conn.executemany(
+                'INSERT INTO spool (job_id, keyword, payload, enqueued_at) VALUES (?, ?, ?, ?)', rows
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+        self._wakeup.set()
+        logger.info(f"已將 {len(jobs)} 筆職缺加入D1暫存佇列")
+        return len(jobs)
+
+    def flush_once(self) -> Dict:
+        """
+        將佇列最前面的一批職缺寫入D1
+
+        Returns:
+            Dict: fetched（取出筆數）、sent（合併後送出的職缺數）、flushed（移出佇列筆數）、
+                dead_lettered（移到spool_dead_letter的筆數）、retrying（留在佇列等待重試的筆數）、error、
+                busy（其他行程正在寫入，這次沒有取出資料）
+        """
+        with self._flush_lock:
+            lock_file = self._lock_other_processes()
+            if lock_file is False:
+                return {'fetched': 0, 'sent': 0, 'flushed': 0, 'dead_lettered': 0,
+                        'retrying': 0, 'error': None, 'busy': True}
+            try:
+                return self._flush_locked()
+            finally:
+                if lock_file is not None:
+                    lock_file.close()
+
+    def _lock_other_processes(self):
+        """
+        取得暫存檔的跨行程寫入鎖
+
+        Returns:
+            已鎖定的檔案（關閉時釋放）；其他行程正在寫入時為False；不支援檔案鎖時為None
+        """
+        if fcntl is None:
+            return None
+        lock_file = open(self.spool_path + '.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        return lock_file
+
+    def _flush_locked(self) -> Dict:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT seq, job_id, payload FROM spool ORDER BY seq LIMIT ?', (self.batch_size,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+        result = {'fetched': len(rows), 'sent': 0, 'flushed': 0,
+                  'dead_lettered': 0, 'retrying': 0, 'error': None, 'busy': False}
+        if not rows:
+            return result
+
+        jobs = coalesce(rows)
+        result['sent'] = len(jobs)
+
+        try:
+            report = self.db.insert_jobs_batched(jobs)
+        except Exception as e:
+            report = {'failed_rows': [{'job_id': job.get('jobId', ''), 'error': str(e), 'permanent': False}
+                                      for job in jobs]}
+
+        # 同一個職缺在這批中的所有版本一起處理
+        retry_errors = {}
+        dead_errors = {}
+        for row in report['failed_rows']:
+            target = dead_errors if row.get('permanent') else retry_errors
+            target[row['job_id']] = row['error']
+
+        job_ids = {seq: job_id for seq, job_id, _ in rows}
+        retry_seqs = [seq for seq, job_id, _ in rows if job_id in retry_errors]
+        dead_seqs = [seq for seq, job_id, _ in rows if job_id in dead_errors and job_id not in retry_errors]
+        done_seqs = [seq for seq, job_id, _ in rows if job_id not in retry_errors and job_id not in dead_errors]
+
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA synchronous=FULL')
+            for seq in dead_seqs:
+                conn.execute('''
+                    INSERT OR REPLACE INTO spool_dead_letter
+                    (seq, job_id, keyword, payload, enqueued_at, failed_at, error)
+                    SELECT seq, job_id, keyword, payload, enqueued_at, ?, ?
+                    FROM spool WHERE seq = ?
+                ''', (now, dead_errors[job_ids[seq]], seq))
+            conn.executemany('DELETE FROM spool WHERE seq = ?', [(seq,) for seq in done_seqs + dead_seqs])
+            conn.executemany(
+                'UPDATE spool SET attempts = attempts + 1, last_error = ? WHERE seq = ?',
+                [(retry_errors[job_ids[seq]], seq) for seq in retry_seqs]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+        result['flushed'] = len(done_seqs)
+        result['dead_lettered'] = len(dead_seqs)
+        result['retrying'] = len(retry_seqs)
+
+        self.flushed += len(done_seqs)
+        self.dead_lettered += len(dead_seqs)
+        self.last_flush_at = now
+        if retry_seqs:
+            result['error'] = next(iter(retry_errors.values()))
+            self.last_error = result['error']
+            self.consecutive_failures += 1
+        else:
+            self.consecutive_failures = 0
+
+        if dead_seqs:
+            logger.error(f"{len(dead_seqs)} 筆職缺無法寫入D1，已移到spool_dead_letter")
+        if retry_seqs:
+            logger.warning(f"{len(retry_seqs)} 筆職缺寫入D1失敗，保留在暫存佇列中重試: {result['error']}")
+        return result
+
+    def _backoff(self) -> float:
+        """連續失敗後的等待秒數"""
+        return min(self.max_backoff, self.retry_backoff * (2 ** (self.consecutive_failures - 1)))
+
+    def _run(self):
+        """背景寫入迴圈"""
+        while not self._stopping.is_set():
+            try:
+                result = self.flush_once()
+            except Exception as e:
+                # 暫存檔本身的錯誤（例如磁碟已滿），稍後重試
+                logger.error(f"寫入D1暫存佇列時發生錯誤: {e}")
+                self.last_error = str(e)
+                self.consecutive_failures += 1
+                result = {'fetched': 0, 'error': str(e), 'busy': False}
+
+            if result['error']:
+                self._stopping.wait(self._backoff())
+            elif result['fetched'] < self.batch_size:
+                # 佇列已清空，等待新資料或下一次檢查
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """
+        在目前執行緒中寫入佇列中的所有職缺
+
+        Args:
+            timeout: 最多等待秒數
+
+        Returns:
+            bool: 佇列是否已清空
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            result = self.flush_once()
+            if result['busy']:
+                time.sleep(0.1)
+                continue
+            if result['fetched'] == 0:
+                return True
+            if result['error']:
+                time.sleep(min(self._backoff(), max(deadline - time.monotonic(), 0)))
+        return self.pending_count() == 0
+
+    def pending_count(self) -> int:
+        """佇列中等待寫入的職缺數"""
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+        finally:
+            conn.close()
+
+    def spool_status(self) -> Dict:
+        """暫存佇列狀態"""
+        conn = self._connect()
+        try:
+            pending, oldest, max_attempts = conn.execute(
+                'SELECT COUNT(*), MIN(enqueued_at), MAX(attempts) FROM spool'
+            ).fetchone()
+            dead = conn.execute('SELECT COUNT(*) FROM spool_dead_letter').fetchone()[0]
+        finally:
+            conn.close()
+
+        return {
+            'pending': pending,
+            'oldest_age_seconds': round(time.time() - oldest, 3) if oldest else 0.0,
+            'max_attempts': max_attempts or 0,
+            'dead_letter': dead,
+            'flushed': self.flushed,
+            'dead_lettered': self.dead_lettered,
+            'consecutive_failures': self.consecutive_failures,
+            'last_error': self.last_error,
+            'last_flush_at': self.last_flush_at,
+            'flusher_running': self._thread is not None and self._thread.is_alive()
+        }
+
+    def close(self, timeout: float = 10.0):
+        """停止背景寫入，盡量送出剩餘的職缺後關閉底層資料庫（未送出的職缺留在暫存檔，下次啟動時繼續）"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        try:
+            self.flush(timeout)
+        except Exception as e:
+            logger.warning(f"關閉前寫入D1暫存佇列時發生錯誤: {e}")
+        self.db.close()
@@ -0,0 +1,245 @@
+"""
+D1增量同步模組
+在本機JobDatabase（SQLite / PostgreSQL）與Cloudflare D1之間雙向同步變更的職缺：
+依 (updated_at, job_id) 水位分頁讀取來源的變更並套用到目標，同一個職缺以updated_at較新者為準，
+水位記錄在本機資料庫的sync_state表格，中斷後從上次的位置繼續
+
+    python d1_sync.py --db jobs.db --direction both
+"""
+
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SYNC_STATE_SQL = '''
+    CREATE TABLE IF NOT EXISTS sync_state (
+        name TEXT PRIMARY KEY,
+        watermark TEXT,
+        last_job_id TEXT,
+        rows_total BIGINT DEFAULT 0,
+        synced_at TEXT
+    )
+'''
+
+
+def watermark_of(value) -> Optional[str]:
+    """將來源的updated_at轉成水位字串（保留來源的格式，才能與來源資料直接比較）"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return str(value)
+
+
+def throughput(rows: int, seconds: float) -> float:
+    """每秒處理筆數"""
+    return round(rows / seconds, 1) if seconds > 0 else 0.0
+
+
+class DeltaSync:
+    """
+    單向增量同步：source.get_changes → target.apply_changes
+
+    來源上同一批寫入的職缺可能共用同一個updated_at，而且可能由多個並行請求分段提交；
+    每次同步從水位往前overlap秒重新讀取，補上水位推進後才提交的職缺
+    （apply_changes只寫入較新的版本，重複讀取不影響結果）
+    """
+
+    def __init__(self, source, target, state_db, name: str, batch_size: int = 1000,
+                 overlap: float = 60.0):
+        """
+        初始化單向同步
+
+        Args:
+            source: 提供get_changes的資料庫
+            target: 提供apply_changes的資料庫
+            state_db: 記錄水位的本機JobDatabase
+            name: 水位名稱
+            batch_size: 每頁讀取筆數
+            overlap: 每次同步重新讀取水位前多少秒的變更
+        """
+        self.source = source
+        self.target = target
+        self.state_db = state_db
+        self.name = name
+        self.batch_size = batch_size
+        self.overlap = overlap
+        self._init_state()
+
+    def _init_state(self):
+        conn = self.state_db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(SYNC_STATE_SQL)
+        conn.commit()
+        conn.close()
+
+    def get_state(self) -> Tuple[Optional[str], str]:
+        """讀取水位 (updated_at, job_id)"""
+        p = self.state_db.stats.placeholder
+        conn = self.state_db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT watermark, last_job_id FROM sync_state WHERE name = {p}", (self.name,))
+        row = cursor.fetchone()
+        conn.close()
+        return (row[0], row[1] or '') if row else (None, '')
+
+    def _save_state(self, watermark: str, last_job_id: str, rows: int):
+        p = self.state_db.stats.placeholder
+        conn = self.state_db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            INSERT INTO sync_state (name, watermark, last_job_id, rows_total, synced_at)
+            VALUES ({p}, {p}, {p}, {p}, {p})
+            ON CONFLICT (name) DO UPDATE SET
+                watermark = EXCLUDED.watermark,
+                last_job_id = EXCLUDED.last_job_id,
+                rows_total = sync_state.rows_total + EXCLUDED.rows_total,
+                synced_at = EXCLUDED.synced_at
+        ''', (self.name, watermark, last_job_id, rows, datetime.now().isoformat()))
+        conn.commit()
+        conn.close()
+
+    def _rewind(self, watermark: Optional[str], last_job_id: str) -> Tuple[Optional[str], str]:
+        """從水位往前overlap秒開始讀取"""
+        if watermark is None or not self.overlap:
+            return watermark, last_job_id
+        try:
+            start = datetime.fromisoformat(watermark) - timedelta(seconds=self.overlap)
+        except ValueError:
+            return watermark, last_job_id
+        return start.isoformat(sep='T' if 'T' in watermark else ' '), ''
+
+    def run(self, max_batches: Optional[int] = None) -> Dict:
+        """
+        讀取來源在水位之後變更的職缺並套用到目標
+
+        每頁套用後立即保存水位，中斷後下次從最後保存的位置繼續
+
+        Args:
+            max_batches: 最多讀取幾頁（None代表讀到沒有新資料為止）
+
+        Returns:
+            Dict: rows（讀取筆數）、applied、skipped、batches、seconds、rows_per_sec、watermark
+        """
+        started = time.perf_counter()
+        watermark, last_job_id = self.get_state()
+        since, after_job_id = self._rewind(watermark, last_job_id)
+
+        report = {'rows': 0, 'applied': 0, 'skipped': 0, 'batches': 0}
+        while max_batches is None or report['batches'] < max_batches:
+            rows = self.source.get_changes(since, after_job_id, self.batch_size)
+            if not rows:
+                break
+
+            result = self.target.apply_changes(rows)
+            report['rows'] += len(rows)
+            report['applied'] += result['applied']
+            report['skipped'] += result['skipped']
+            report['batches'] += 1
+
+            since, after_job_id = watermark_of(rows[-1]['updated_at']), rows[-1]['job_id']
+            # 重新讀取的區段不會讓水位倒退
+            if watermark is None or (since, after_job_id) > (watermark, last_job_id):
+                watermark, last_job_id = since, after_job_id
+                self._save_state(watermark, last_job_id, len(rows))
+
+            if len(rows) < self.batch_size:
+                break
+
+        seconds = time.perf_counter() - started
+        report['seconds'] = round(seconds, 3)
+        report['rows_per_sec'] = throughput(report['rows'], seconds)
+        report['watermark'] = watermark
+
+        if report['applied']:
+            logger.info(f"同步 {self.name}: 套用 {report['applied']} 筆職缺（讀取 {report['rows']} 筆，"
+                        f"{report['rows_per_sec']} 筆/秒）")
+        return report
+
+
+class D1Sync:
+    """
+    本機資料庫與D1的雙向增量同步
+
+    - pull: D1 → 本機，push: 本機 → D1，各自記錄水位
+    - 衝突以job_id比對，updated_at較新的版本為準；相同時保留目標上的版本
+    - 拉回本機的職缺會在下一次push時再讀到一次，但D1上已是相同版本，不會重複寫入
+    - 刪除不會同步，兩邊各自依保留期清理（delete_old_jobs）
+    """
+
+    def __init__(self, local, remote, batch_size: int = 1000, overlap: float = 60.0,
+                 name: str = 'd1'):
+        """
+        初始化雙向同步
+
+        Args:
+            local: 本機JobDatabase（水位也記錄在這裡）
+            remote: CloudflareD1Database
+            batch_size: 每頁讀取筆數
+            overlap: 每次同步重新讀取水位前多少秒的變更
+            name: 水位名稱前綴（同一個本機資料庫可同步多個D1資料庫）
+        """
+        self.local = local
+        self.remote = remote
+        self.pull_sync = DeltaSync(remote, local, local, f'{name}_pull', batch_size, overlap)
+        self.push_sync = DeltaSync(local, remote, local, f'{name}_push', batch_size, overlap)
+
+    def pull(self, max_batches: Optional[int] = None) -> Dict:
+        """從D1同步到本機"""
+        return self.pull_sync.run(max_batches)
+
+    def push(self, max_batches: Optional[int] = None) -> Dict:
+        """從本機同步到D1"""
+        return self.push_sync.run(max_batches)
+
+    def sync(self, max_batches: Optional[int] = None) -> Dict:
+        """
+        先pull再push
+
+        Returns:
+            Dict: pull、push兩個方向的結果，以及合計的rows、seconds、rows_per_sec
+        """
+        pull = self.pull(max_batches)
+        push = self.push(max_batches)
+        rows = pull['rows'] + push['rows']
+        seconds = pull['seconds'] + push['seconds']
+        return {
+            'pull': pull,
+            'push': push,
+            'rows': rows,
+            'seconds': round(seconds, 3),
+            'rows_per_sec': throughput(rows, seconds)
+        }
+
+
+if __name__ == '__main__':
+    from cloudflare_d1 import create_d1_database
+    from database import JobDatabase
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='本機資料庫與D1的增量同步')
+    parser.add_argument('--db', default='jobs.db', help='本機SQLite資料庫檔案路徑')
+    parser.add_argument('--postgres', action='store_true', help='本機資料庫改用PostgreSQL（預設連線配置）')
+    parser.add_argument('--direction', choices=['pull', 'push', 'both'], default='both', help='同步方向')
+    parser.add_argument('--batch-size', type=int, default=1000, help='每頁讀取筆數')
+    args = parser.parse_args()
+
+    local_db = JobDatabase(db_type="postgresql") if args.postgres else JobDatabase(db_type="sqlite", db_path=args.db)
+    remote_db = create_d1_database()
+    d1_sync = D1Sync(local_db, remote_db, batch_size=args.batch_size)
+
+    try:
+        if args.direction == 'pull':
+            result = d1_sync.pull()
+        elif args.direction == 'push':
+            result = d1_sync.push()
+        else:
+            result = d1_sync.sync()
+        print(f"同步完成: {result['rows']} 筆，{result['seconds']} 秒，{result['rows_per_sec']} 筆/秒")
+    finally:
+        remote_db.close()
@@ -0,0 +1,175 @@
+"""
+D1分層儲存模組
+D1仍是正式資料來源，本機SQLite副本以增量同步保持更新並負責讀取，
+讀取延遲降到本機磁碟等級，資料落後D1的時間不超過max_staleness秒
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from d1_sync import D1Sync
+
+logger = logging.getLogger(__name__)
+
+# 由本機副本回應的讀取方法
+LOCAL_READ_METHODS = (
+    'search_jobs',
+    'get_recent_jobs',
+    'get_job_count',
+    'iter_jobs',
+    'get_stats_summary',
+    'get_stats_breakdown',
+    'facet_counts',
+    'get_write_generation'
+)
+
+
+class TieredD1Database:
+    """
+    本機副本 + D1 的分層資料庫
+
+    - 讀取（LOCAL_READ_METHODS）由本機JobDatabase回應
+    - 背景執行緒每sync_interval秒從D1增量同步；讀取時若上次成功同步已超過max_staleness秒，
+      先同步一次，同步失敗時改讀D1，因此回應的資料最多落後max_staleness秒
+    - insert_jobs / delete_old_jobs 寫入D1後同時寫入本機副本（只寫入D1接受的職缺），本行程的寫入立即可讀
+    - 其他屬性與方法直接轉交給D1
+    """
+
+    def __init__(self, remote, local, max_staleness: float = 30.0,
+                 sync_interval: Optional[float] = None, batch_size: int = 1000,
+                 autostart: bool = True):
+        """
+        初始化分層資料庫
+
+        Args:
+            remote: CloudflareD1Database（或SpooledD1Database）實例
+            local: 本機JobDatabase（SQLite）
+            max_staleness: 本機副本最多落後D1的秒數
+            sync_interval: 背景同步間隔秒數（預設為max_staleness的一半）
+            batch_size: 每次從D1讀取的筆數
+            autostart: 是否立即啟動背景同步執行緒
+        """
+        self.remote = remote
+        self.local = local
+        self.max_staleness = max_staleness
+        self.sync_interval = sync_interval if sync_interval is not None else max_staleness / 2
+        self.sync = D1Sync(local, remote, batch_size=batch_size)
+
+        self._sync_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._synced_at = None
+
+        self.last_sync = None
+        self.last_error = None
+        self.reads = {'local': 0, 'remote': 0}
+
+        if autostart:
+            self.start()
+
+    def __getattr__(self, name: str):
+        if name in LOCAL_READ_METHODS:
+            return lambda *args, **kwargs: self._read(name, args, kwargs)
+        return getattr(self.remote, name)
+
+    def start(self):
+        """啟動背景同步執行緒"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='d1-tier-sync', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self.sync_now()
+            self._stopping.wait(self.sync_interval)
+
+    def sync_now(self) -> bool:
+        """從D1增量同步一次，返回是否成功"""
+        with self._sync_lock:
+            return self._pull_locked()
+
+    def _pull_locked(self) -> bool:
+        started = time.monotonic()
+        try:
+            self.last_sync = self.sync.pull()
+        except Exception as e:
+            self.last_error = str(e)
+            logger.warning(f"從D1同步到本機副本時發生錯誤: {e}")
+            return False
+        # 同步開始之後才寫入D1的資料不一定已讀到，以開始時間計算落後程度
+        self._synced_at = started
+        self.last_error = None
+        return True
+
+    def staleness(self) -> Optional[float]:
+        """距離上次成功同步的秒數（從未同步時為None）"""
+        if self._synced_at is None:
+            return None
+        return time.monotonic() - self._synced_at
+
+    def is_fresh(self) -> bool:
+        """本機副本是否在容許的落後範圍內"""
+        staleness = self.staleness()
+        return staleness is not None and staleness <= self.max_staleness
+
+    def _read(self, name: str, args, kwargs):
+        if not self.is_fresh():
+            # 等待進行中的同步結束，仍然過期時自行同步一次（同時等待的讀取只會同步一次）
+            with self._sync_lock:
+                fresh = self.is_fresh() or self._pull_locked()
+
+            if not fresh:
+                self.reads['remote'] += 1
+                return getattr(self.remote, name)(*args, **kwargs)
+
+        self.reads['local'] += 1
+        return getattr(self.local, name)(*args, **kwargs)
+
+    def insert_jobs(self, jobs: List[Dict], keyword: Optional[str] = None) -> int:
+        """
+        寫入D1後，只把D1接受的職缺寫入本機副本
+
+        D1部分失敗時依last_insert_report的failed_rows排除失敗的職缺；
+        無法判斷哪些職缺失敗時不寫入本機副本，交給增量同步補上
+        """
+        inserted = self.remote.insert_jobs(jobs, keyword=keyword)
+        accepted = jobs
+        if inserted < len(jobs):
+            report = getattr(self.remote, 'last_insert_report', None) or {}
+            failed = {row['job_id'] for row in report.get('failed_rows', [])}
+            accepted = [job for job in jobs if job.get('jobId', '') not in failed] if failed else []
+
+        if accepted:
+            self.local.insert_jobs(accepted, keyword=keyword)
+        return inserted
+
+    def delete_old_jobs(self, days: int = 30, **kwargs) -> int:
+        """刪除D1與本機副本的舊職缺（增量同步不會傳遞刪除）"""
+        deleted = self.remote.delete_old_jobs(days=days, **kwargs)
+        self.local.delete_old_jobs(days=days, **kwargs)
+        return deleted
+
+    def tier_status(self) -> Dict:
+        """本機副本的同步狀態"""
+        staleness = self.staleness()
+        watermark, _ = self.sync.pull_sync.get_state()
+        return {
+            'fresh': self.is_fresh(),
+            'staleness_seconds': round(staleness, 3) if staleness is not None else None,
+            'max_staleness': self.max_staleness,
+            'watermark': watermark,
+            'last_sync': self.last_sync,
+            'last_error': self.last_error,
+            'reads': dict(self.reads)
+        }
+
+    def close(self):
+        """停止背景同步並關閉D1連線"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self.remote.close()
@@ -1,14 +1,33 @@
 import sqlite3
 import json
+import re
+import threading
 import time
-from typing import List, Dict, Optional
-from datetime import datetime
+from collections import Counter, OrderedDict
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
+from datetime import date, datetime, timedelta
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from job_stats import (ALL_TIME, DIM_AREA, DIM_DUPLICATE, DIM_TOTAL, FACET_EXPRESSIONS, STAT_COLUMNS, JobStatsTracker,
+                       area_of, facet_conditions, facet_group_sql)
+from job_history import JobHistoryTracker
+from job_dedup import JobDedupTracker
+from job_fields import JOB_FIELDS, select_list
+
+
+def sync_timestamp(value) -> Optional[str]:
+    """將不同來源的時間（datetime、ISO格式或SQLite格式字串）轉成可直接比較大小的字串"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return str(value).replace('T', ' ')
 
 class JobDatabase:
     def __init__(self, db_type: str = "sqlite", db_path: str = "jobs.db", 
-                 pg_config: Optional[Dict] = None):
+                 pg_config: Optional[Dict] = None, partition_by_month: bool = False,
+                 replicas: Optional[List] = None, max_replica_lag: float = 5.0,
+                 lag_check_interval: float = 1.0):
         """
         初始化資料庫連接
         
@@ -16,18 +35,54 @@ class JobDatabase:
             db_type: 資料庫類型 ("sqlite" 或 "postgresql")
             db_path: SQLite資料庫檔案路徑
             pg_config: PostgreSQL連接配置
+            partition_by_month: PostgreSQL是否依created_at建立每月分區表
+                （僅適用於新建立的資料庫，保留期清理會直接刪除整個過期分區）
+            replicas: 唯讀副本列表（SQLite為檔案路徑，PostgreSQL為連接配置），
+                search_jobs/get_recent_jobs/get_job_count/iter_jobs會輪流使用
+            max_replica_lag: 副本落後主庫超過此秒數時改讀主庫
+            lag_check_interval: 檢查副本落後程度的最短間隔秒數
         """
         self.db_type = db_type
+        self.partition_by_month = partition_by_month and db_type == "postgresql"
+        self._ready_partitions = set()
         self.db_path = db_path
-        self.pg_config = pg_config or {
+        self.pg_config = pg_config or self.default_pg_config()
+        self.stats = JobStatsTracker(db_type)
+        self.history = JobHistoryTracker(db_type)
+        self.dedup = JobDedupTracker(db_type)
+        
+        # 讀寫分離：副本狀態依寫入世代判斷落後程度
+        self.replicas = list(replicas or [])
+        self.max_replica_lag = max_replica_lag
+        self.lag_check_interval = lag_check_interval
+        self._replica_state = [
+            {'lag': None, 'generation': None, 'error': None} for _ in self.replicas
+        ]
+        # 主庫每個寫入世代第一次被觀察到的時間（由小到大），用來計算副本實際落後的秒數
+        self._generation_seen = OrderedDict()
+        self._observing_generations = False
+        self._replica_lock = threading.Lock()
+        self._replicas_checked_at = None
+        self._next_replica = 0
+        # 呼叫端（查詢快取、ETag）讀取過的最新寫入世代，讀取只使用已追上此世代的副本，
+        # 避免副本的舊結果被存在新的世代之下
+        self._min_read_generation = 0
+        self.read_routing = {'replica': 0, 'primary': 0}
+        # 最近一次insert_jobs的結果，每個執行緒各自保存（見last_insert_report）
+        self._insert_report = threading.local()
+        
+        self.init_database()
+    
+    @staticmethod
+    def default_pg_config() -> Dict:
+        """預設的PostgreSQL連接配置"""
+        return {
             'host': 'localhost',
             'database': 'jobs_db',
             'user': 'postgres',
             'password': 'password',
             'port': 5432
         }
-        
-        self.init_database()
     
     def get_connection(self):
         """獲取資料庫連接"""
@@ -38,6 +93,138 @@ class JobDatabase:
         else:
             raise ValueError(f"不支援的資料庫類型: {self.db_type}")
     
+    def _connect_replica(self, replica):
+        """以唯讀方式連接副本"""
+        if self.db_type == "sqlite":
+            return sqlite3.connect(f"file:{replica}?mode=ro", uri=True)
+        conn = psycopg2.connect(**replica)
+        conn.set_session(readonly=True)
+        return conn
+    
+    def _observe_generation(self, generation: int, now: float):
+        """記錄主庫寫入世代第一次被觀察到的時間（呼叫時需持有_replica_lock）"""
+        if generation in self._generation_seen:
+            return
+        # 開始觀察前就已存在的世代，到達時間未知（視為無限久以前）
+        self._generation_seen[generation] = now if self._observing_generations else float('-inf')
+        self._observing_generations = True
+        while len(self._generation_seen) > 10000:
+            self._generation_seen.popitem(last=False)
+    
+    def _replica_lag(self, generation: int, now: float) -> float:
+        """
+        副本的落後秒數：主庫第一次被觀察到超過副本世代的時間至今
+        （呼叫時需持有_replica_lock）
+        
+        持續寫入時主庫世代不斷前進，只落後一個世代的副本落後秒數仍只有幾毫秒到一個檢查間隔
+        """
+        for seen_generation, seen_at in self._generation_seen.items():
+            if seen_generation > generation:
+                return now - seen_at
+        return 0.0
+    
+    def _refresh_replicas(self):
+        """
+        更新各副本的落後程度（每lag_check_interval秒最多一次）
+        
+        副本的寫入世代不小於主庫時視為已同步；否則落後秒數為主庫到達副本尚未包含的寫入世代至今的時間
+        """
+        now = time.monotonic()
+        with self._replica_lock:
+            if (self._replicas_checked_at is not None
+                    and now - self._replicas_checked_at < self.lag_check_interval):
+                return
+            self._replicas_checked_at = now
+        
+        conn = self.get_connection()
+        try:
+            primary_generation = self._read_generation(conn)
+        finally:
+            conn.close()
+        
+        with self._replica_lock:
+            self._observe_generation(primary_generation, now)
+        
+        for replica, state in zip(self.replicas, self._replica_state):
+            try:
+                conn = self._connect_replica(replica)
+                try:
+                    generation = self._read_generation(conn)
+                finally:
+                    conn.close()
+            except Exception as e:
+                print(f"檢查唯讀副本時發生錯誤: {e}")
+                state.update(lag=None, error=str(e))
+                continue
+            
+            with self._replica_lock:
+                lag = 0.0 if generation >= primary_generation else self._replica_lag(generation, now)
+            state.update(lag=lag, generation=generation, error=None)
+        
+        # 所有副本都已包含的世代不再需要
+        generations = [state['generation'] for state in self._replica_state]
+        if all(generation is not None for generation in generations):
+            oldest = min(generations)
+            with self._replica_lock:
+                while self._generation_seen and next(iter(self._generation_seen)) <= oldest:
+                    self._generation_seen.popitem(last=False)
+    
+    def get_read_connection(self):
+        """
+        獲取讀取用連接
+        
+        輪流選擇落後未超過max_replica_lag的副本；沒有可用副本或連接失敗時使用主庫。
+        呼叫過get_write_generation後，只使用寫入世代不小於該值的副本（在同一個連接上確認），
+        讓以世代為鍵的查詢快取與ETag不會存入副本上較舊的結果
+        """
+        if self.replicas:
+            try:
+                self._refresh_replicas()
+            except Exception as e:
+                print(f"讀取主庫寫入世代時發生錯誤: {e}")
+            
+            for _ in range(len(self.replicas)):
+                with self._replica_lock:
+                    index = self._next_replica
+                    self._next_replica = (index + 1) % len(self.replicas)
+                
+                state = self._replica_state[index]
+                if state['lag'] is None or state['lag'] > self.max_replica_lag:
+                    continue
+                
+                try:
+                    conn = self._connect_replica(self.replicas[index])
+                    if self._min_read_generation and self._read_generation(conn) < self._min_read_generation:
+                        # 副本尚未追上呼叫端已看到的寫入
+                        conn.close()
+                        continue
+                except Exception as e:
+                    print(f"連接唯讀副本時發生錯誤: {e}")
+                    state.update(lag=None, error=str(e))
+                    continue
+                
+                self.read_routing['replica'] += 1
+                return conn
+        
+        self.read_routing['primary'] += 1
+        return self.get_connection()
+    
+    def replica_status(self) -> Dict:
+        """各副本的落後程度與讀取分流統計"""
+        return {
+            'max_replica_lag': self.max_replica_lag,
+            'replicas': [
+                {
+                    'replica': replica if self.db_type == "sqlite" else replica.get('host'),
+                    'lag': state['lag'],
+                    'usable': state['lag'] is not None and state['lag'] <= self.max_replica_lag,
+                    'error': state['error']
+                }
+                for replica, state in zip(self.replicas, self._replica_state)
+            ],
+            'reads': dict(self.read_routing)
+        }
+    
     def init_database(self):
         """初始化資料庫表格"""
         if self.db_type == "sqlite":
@@ -78,12 +265,23 @@ class JobDatabase:
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_name ON jobs(job_name)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_cust_name ON jobs(cust_name)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_created_at ON jobs(created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_addr ON jobs(job_addr_no_desc)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_job_area ON jobs(({FACET_EXPRESSIONS[DIM_AREA]}))')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_cat ON jobs(job_cat)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_remote_work ON jobs(remote_work)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_updated_at ON jobs(updated_at, job_id)')
+        
+        self._init_aux_tables(cursor)
         
         conn.commit()
         conn.close()
     
     def _init_postgresql(self):
         """初始化PostgreSQL資料庫"""
+        if self.partition_by_month:
+            self._init_postgresql_partitioned()
+            return
+        
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -115,131 +313,475 @@ class JobDatabase:
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_name ON jobs(job_name)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_cust_name ON jobs(cust_name)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_created_at ON jobs(created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_addr ON jobs(job_addr_no_desc)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_job_area ON jobs(({FACET_EXPRESSIONS[DIM_AREA]}))')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_cat ON jobs(job_cat)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_remote_work ON jobs(remote_work)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_updated_at ON jobs(updated_at, job_id)')
+        
+        self._init_aux_tables(cursor)
+        
+        conn.commit()
+        conn.close()
+    
+    def _init_postgresql_partitioned(self):
+        """初始化依created_at每月分區的PostgreSQL資料庫"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # 分區表的主鍵與唯一約束必須包含分區鍵，因此job_id改為一般索引，
+        # 由insert_jobs以先UPDATE後INSERT的方式維持每個job_id一筆
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id BIGSERIAL,
+                job_id VARCHAR(255) NOT NULL,
+                job_name VARCHAR(500) NOT NULL,
+                cust_name VARCHAR(255),
+                job_url TEXT,
+                job_addr_no_desc VARCHAR(255),
+                salary_desc VARCHAR(255),
+                job_detail TEXT,
+                appear_date VARCHAR(50),
+                job_cat VARCHAR(255),
+                job_type VARCHAR(255),
+                work_exp VARCHAR(255),
+                edu VARCHAR(255),
+                skill TEXT,
+                benefit TEXT,
+                remote_work VARCHAR(50),
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at)
+        ''')
+        
+        # 創建索引（在分區表上建立會自動套用到每個分區）
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_id ON jobs(job_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_name ON jobs(job_name)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_cust_name ON jobs(cust_name)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_created_at ON jobs(created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_addr ON jobs(job_addr_no_desc)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_job_area ON jobs(({FACET_EXPRESSIONS[DIM_AREA]}))')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_cat ON jobs(job_cat)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_remote_work ON jobs(remote_work)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_updated_at ON jobs(updated_at, job_id)')
+        
+        cursor.execute('CREATE TABLE IF NOT EXISTS jobs_default PARTITION OF jobs DEFAULT')
+        self._ensure_partitions(cursor)
+        
+        self._init_aux_tables(cursor)
         
         conn.commit()
         conn.close()
     
-    def insert_jobs(self, jobs: List[Dict]) -> int:
+    def _init_aux_tables(self, cursor):
+        """建立統計、觀測歷史與寫入世代等輔助表格"""
+        # 統計彙總表格（首次建立時從現有資料回填）
+        self.stats.create_table(cursor)
+        if not self.stats.is_initialized(cursor):
+            self.stats.rebuild(cursor)
+        
+        # 觀測歷史表格
+        self.history.create_table(cursor)
+        
+        # 近似重複偵測的簽章與分桶索引
+        self.dedup.create_table(cursor)
+        
+        # 寫入世代計數器，每次寫入遞增，供查詢快取跨行程判斷是否失效
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS write_generation (
+                id INTEGER PRIMARY KEY,
+                generation BIGINT NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO write_generation (id, generation) VALUES (1, 0)
+            ON CONFLICT (id) DO NOTHING
+        ''')
+    
+    def _bump_generation(self, cursor):
+        """遞增寫入世代（與資料寫入在同一個交易中）"""
+        cursor.execute("UPDATE write_generation SET generation = generation + 1 WHERE id = 1")
+    
+    @staticmethod
+    def _read_generation(conn) -> int:
+        """在指定連接（主庫或副本）上讀取寫入世代"""
+        cursor = conn.cursor()
+        cursor.execute("SELECT generation FROM write_generation WHERE id = 1")
+        row = cursor.fetchone()
+        return row[0] if row else 0
+    
+    def get_write_generation(self) -> int:
+        """
+        讀取主庫目前的寫入世代
+        
+        查詢快取與ETag以此為鍵，之後的讀取只會使用已追上此世代的副本
+        """
+        conn = self.get_connection()
+        try:
+            generation = self._read_generation(conn)
+        finally:
+            conn.close()
+        
+        with self._replica_lock:
+            self._min_read_generation = max(self._min_read_generation, generation)
+            if self.replicas:
+                self._observe_generation(generation, time.monotonic())
+        return generation
+    
+    @staticmethod
+    def _partition_name(year: int, month: int) -> str:
+        """每月分區的表格名稱"""
+        return f"jobs_y{year:04d}m{month:02d}"
+    
+    def _ensure_partitions(self, cursor, months_ahead: int = 1):
+        """確保本月與接下來幾個月的分區已存在"""
+        cursor.execute("SELECT CURRENT_DATE")
+        today = cursor.fetchone()[0]
+        year, month = today.year, today.month
+        
+        for _ in range(months_ahead + 1):
+            name = self._partition_name(year, month)
+            next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+            
+            if name not in self._ready_partitions:
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {name} PARTITION OF jobs
+                    FOR VALUES FROM ('{year:04d}-{month:02d}-01') TO ('{next_year:04d}-{next_month:02d}-01')
+                ''')
+                self._ready_partitions.add(name)
+            
+            year, month = next_year, next_month
+    
+    def _upsert_partitioned(self, cursor, job: Dict, now: datetime):
+        """分區表沒有job_id唯一約束，鎖定job_id後先嘗試更新，沒有資料時才新增"""
+        values = (
+            job.get('jobName', ''),
+            job.get('custName', ''),
+            job.get('jobUrl', ''),
+            job.get('jobAddrNoDesc', ''),
+            job.get('salaryDesc', ''),
+            job.get('jobDetail', ''),
+            job.get('appearDate', ''),
+            job.get('jobCat', ''),
+            job.get('jobType', ''),
+            job.get('workExp', ''),
+            job.get('edu', ''),
+            job.get('skill', ''),
+            job.get('benefit', ''),
+            job.get('remoteWork', ''),
+            now
+        )
+        
+        # 以job_id的交易級諮詢鎖序列化同一職缺的並行寫入（gunicorn worker與排程器），
+        # 避免兩邊都更新不到資料而各自新增一筆
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (job.get('jobId', ''),))
+        
+        cursor.execute('''
+            UPDATE jobs SET
+                job_name = %s, cust_name = %s, job_url = %s, job_addr_no_desc = %s,
+                salary_desc = %s, job_detail = %s, appear_date = %s, job_cat = %s,
+                job_type = %s, work_exp = %s, edu = %s, skill = %s, benefit = %s,
+                remote_work = %s, updated_at = %s
+            WHERE job_id = %s
+        ''', values + (job.get('jobId', ''),))
+        
+        if cursor.rowcount == 0:
+            cursor.execute('''
+                INSERT INTO jobs (
+                    job_name, cust_name, job_url, job_addr_no_desc,
+                    salary_desc, job_detail, appear_date, job_cat, job_type,
+                    work_exp, edu, skill, benefit, remote_work, updated_at, job_id
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ''', values + (job.get('jobId', ''),))
+    
+    def insert_jobs(self, jobs: List[Dict], keyword: Optional[str] = None) -> int:
         """
         插入職缺資料到資料庫
         
         Args:
             jobs: 職缺資料列表
+            keyword: 爬取這批職缺時使用的搜尋關鍵字（用於關鍵字統計）
             
         Returns:
-            int: 成功插入的記錄數
+            int: 成功插入的記錄數（寫入失敗的職缺見last_insert_report）
         """
+        self._insert_report.value = None
         if not jobs:
             return 0
         
         conn = self.get_connection()
+        try:
+            report = self._insert_jobs(conn, jobs, keyword)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        self._insert_report.value = report
+        print(f"成功插入 {report['inserted']} 筆職缺資料")
+        return report['inserted']
+    
+    @property
+    def last_insert_report(self) -> Optional[Dict]:
+        """
+        本執行緒最近一次insert_jobs的結果（與CloudflareD1Database相同的格式）
+        
+        Returns:
+            Optional[Dict]: inserted（成功筆數）、failed_rows（[{"job_id": ..., "error": ...}]）；
+                整批失敗或尚未寫入時為None
+        """
+        return getattr(self._insert_report, 'value', None)
+    
+    def _write_job(self, cursor, job: Dict, now: datetime):
+        """寫入或更新單筆職缺"""
+        if self.partition_by_month:
+            self._upsert_partitioned(cursor, job, now)
+        elif self.db_type == "sqlite":
+            cursor.execute('''
+                INSERT OR REPLACE INTO jobs (
+                    job_id, job_name, cust_name, job_url, job_addr_no_desc,
+                    salary_desc, job_detail, appear_date, job_cat, job_type,
+                    work_exp, edu, skill, benefit, remote_work, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                job.get('jobId', ''),
+                job.get('jobName', ''),
+                job.get('custName', ''),
+                job.get('jobUrl', ''),
+                job.get('jobAddrNoDesc', ''),
+                job.get('salaryDesc', ''),
+                job.get('jobDetail', ''),
+                job.get('appearDate', ''),
+                job.get('jobCat', ''),
+                job.get('jobType', ''),
+                job.get('workExp', ''),
+                job.get('edu', ''),
+                job.get('skill', ''),
+                job.get('benefit', ''),
+                job.get('remoteWork', ''),
+                now
+            ))
+        else:  # PostgreSQL
+            cursor.execute('''
+                INSERT INTO jobs (
+                    job_id, job_name, cust_name, job_url, job_addr_no_desc,
+                    salary_desc, job_detail, appear_date, job_cat, job_type,
+                    work_exp, edu, skill, benefit, remote_work, updated_at
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (job_id) DO UPDATE SET
+                    job_name = EXCLUDED.job_name,
+                    cust_name = EXCLUDED.cust_name,
+                    job_url = EXCLUDED.job_url,
+                    job_addr_no_desc = EXCLUDED.job_addr_no_desc,
+                    salary_desc = EXCLUDED.salary_desc,
+                    job_detail = EXCLUDED.job_detail,
+                    appear_date = EXCLUDED.appear_date,
+                    job_cat = EXCLUDED.job_cat,
+                    job_type = EXCLUDED.job_type,
+                    work_exp = EXCLUDED.work_exp,
+                    edu = EXCLUDED.edu,
+                    skill = EXCLUDED.skill,
+                    benefit = EXCLUDED.benefit,
+                    remote_work = EXCLUDED.remote_work,
+                    updated_at = EXCLUDED.updated_at
+            ''', (
+                job.get('jobId', ''),
+                job.get('jobName', ''),
+                job.get('custName', ''),
+                job.get('jobUrl', ''),
+                job.get('jobAddrNoDesc', ''),
+                job.get('salaryDesc', ''),
+                job.get('jobDetail', ''),
+                job.get('appearDate', ''),
+                job.get('jobCat', ''),
+                job.get('jobType', ''),
+                job.get('workExp', ''),
+                job.get('edu', ''),
+                job.get('skill', ''),
+                job.get('benefit', ''),
+                job.get('remoteWork', ''),
+                now
+            ))
+    
+    def _insert_jobs(self, conn, jobs: List[Dict], keyword: Optional[str]) -> Dict:
+        """
+        在同一個交易中寫入職缺，並更新統計、近似重複歸群與觀測歷史（由insert_jobs提交或回滾）
+        
+        Returns:
+            Dict: inserted（成功寫入的記錄數）、failed_rows（寫入失敗的職缺與原因）
+        """
         cursor = conn.cursor()
+        now = datetime.now()
+        job_ids = [job.get('jobId', '') for job in jobs]
+        stats_before = self.stats.snapshot(cursor, job_ids)
         
-        inserted_count = 0
+        if self.partition_by_month:
+            self._ensure_partitions(cursor)
         
+        # PostgreSQL的交易在任一語句失敗後即中止，每筆職缺以儲存點隔離，失敗時只撤銷該筆；
+        # SQLite失敗的語句只會撤銷自己
+        savepoint = self.db_type == "postgresql"
+        written = []
+        failed_rows = []
         for job in jobs:
+            if savepoint:
+                cursor.execute("SAVEPOINT insert_job")
             try:
-                if self.db_type == "sqlite":
-                    cursor.execute('''
-                        INSERT OR REPLACE INTO jobs (
-                            job_id, job_name, cust_name, job_url, job_addr_no_desc,
-                            salary_desc, job_detail, appear_date, job_cat, job_type,
-                            work_exp, edu, skill, benefit, remote_work, updated_at
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        job.get('jobId', ''),
-                        job.get('jobName', ''),
-                        job.get('custName', ''),
-                        job.get('jobUrl', ''),
-                        job.get('jobAddrNoDesc', ''),
-                        job.get('salaryDesc', ''),
-                        job.get('jobDetail', ''),
-                        job.get('appearDate', ''),
-                        job.get('jobCat', ''),
-                        job.get('jobType', ''),
-                        job.get('workExp', ''),
-                        job.get('edu', ''),
-                        job.get('skill', ''),
-                        job.get('benefit', ''),
-                        job.get('remoteWork', ''),
-                        datetime.now()
-                    ))
-                else:  # PostgreSQL
-                    cursor.execute('''
-                        INSERT INTO jobs (
-                            job_id, job_name, cust_name, job_url, job_addr_no_desc,
-                            salary_desc, job_detail, appear_date, job_cat, job_type,
-                            work_exp, edu, skill, benefit, remote_work, updated_at
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (job_id) DO UPDATE SET
-                            job_name = EXCLUDED.job_name,
-                            cust_name = EXCLUDED.cust_name,
-                            job_url = EXCLUDED.job_url,
-                            job_addr_no_desc = EXCLUDED.job_addr_no_desc,
-                            salary_desc = EXCLUDED.salary_desc,
-                            job_detail = EXCLUDED.job_detail,
-                            appear_date = EXCLUDED.appear_date,
-                            job_cat = EXCLUDED.job_cat,
-                            job_type = EXCLUDED.job_type,
-                            work_exp = EXCLUDED.work_exp,
-                            edu = EXCLUDED.edu,
-                            skill = EXCLUDED.skill,
-                            benefit = EXCLUDED.benefit,
-                            remote_work = EXCLUDED.remote_work,
-                            updated_at = EXCLUDED.updated_at
-                    ''', (
-                        job.get('jobId', ''),
-                        job.get('jobName', ''),
-                        job.get('custName', ''),
-                        job.get('jobUrl', ''),
-                        job.get('jobAddrNoDesc', ''),
-                        job.get('salaryDesc', ''),
-                        job.get('jobDetail', ''),
-                        job.get('appearDate', ''),
-                        job.get('jobCat', ''),
-                        job.get('jobType', ''),
-                        job.get('workExp', ''),
-                        job.get('edu', ''),
-                        job.get('skill', ''),
-                        job.get('benefit', ''),
-                        job.get('remoteWork', ''),
-                        datetime.now()
-                    ))
-                
-                inserted_count += 1
-                
+                self._write_job(cursor, job, now)
             except Exception as e:
+                if savepoint:
+                    cursor.execute("ROLLBACK TO SAVEPOINT insert_job")
                 print(f"插入職缺資料時發生錯誤: {e}")
+                failed_rows.append({'job_id': job.get('jobId', ''), 'error': str(e)})
                 continue
+            if savepoint:
+                cursor.execute("RELEASE SAVEPOINT insert_job")
+            written.append(job)
         
-        conn.commit()
-        conn.close()
+        # 以寫入前後的差異增量更新統計；近似重複歸群與觀測紀錄只包含成功寫入的職缺
+        stats_after = self.stats.snapshot(cursor, job_ids)
+        dedup_plan = self.dedup.record(cursor, written, now)
+        self.stats.apply(cursor, self.stats.write_delta(
+            stats_before, stats_after, keyword, now, len(written), dedup_plan['duplicate_delta']
+        ))
         
-        print(f"成功插入 {inserted_count} 筆職缺資料")
-        return inserted_count
+        self.history.record(cursor, written, keyword, now)
+        self._bump_generation(cursor)
+        return {'inserted': len(written), 'failed_rows': failed_rows}
     
-    def search_jobs(self, keyword: str = None, company: str = None, 
-                   limit: int = 50, offset: int = 0) -> List[Dict]:
+    def apply_changes(self, rows: List[Dict]) -> Dict:
         """
-        搜尋職缺資料
+        套用從其他資料庫同步來的職缺列（資料表欄位名稱，保留來源的created_at與updated_at）
+        
+        以job_id比對，只有updated_at比本機新的版本會寫入（後寫入者優先），
+        重複套用同一批資料不會改變結果。統計與近似重複歸群一併更新。
         
         Args:
-            keyword: 職缺名稱關鍵字
-            company: 公司名稱關鍵字
-            limit: 限制返回記錄數
-            offset: 偏移量
+            rows: 職缺列（search_jobs等方法返回的格式）
             
         Returns:
-            List[Dict]: 職缺資料列表
+            Dict: applied（寫入筆數）、skipped（本機已是相同或較新版本的筆數）
         """
+        if not rows:
+            return {'applied': 0, 'skipped': 0}
+        if self.partition_by_month:
+            raise ValueError("按月分區的資料表不支援套用同步資料")
+        
         conn = self.get_connection()
+        try:
+            winners = self._apply_changes(conn, rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
         
-        if self.db_type == "sqlite":
-            cursor = conn.cursor()
+        return {'applied': len(winners), 'skipped': len(rows) - len(winners)}
+    
+    def _apply_changes(self, conn, rows: List[Dict]) -> List[Dict]:
+        """
+        在同一個交易中寫入較新的職缺列並更新統計（由apply_changes提交或回滾）
+        
+        Returns:
+            List[Dict]: 實際寫入的職缺列
+        """
+        p = self.stats.placeholder
+        cursor = conn.cursor()
+        
+        # 同一批中同一個職缺只保留最新版本
+        incoming = {}
+        for row in rows:
+            current = incoming.get(row['job_id'])
+            if current is None or sync_timestamp(row.get('updated_at')) > sync_timestamp(current.get('updated_at')):
+                incoming[row['job_id']] = row
+        
+        job_ids = list(incoming)
+        cursor.execute(f"SELECT job_id, updated_at FROM jobs WHERE job_id IN ({', '.join([p] * len(job_ids))})",
+                       job_ids)
+        existing = {job_id: sync_timestamp(updated_at) for job_id, updated_at in cursor.fetchall()}
+        
+        winners = [row for job_id, row in incoming.items()
+                   if job_id not in existing or sync_timestamp(row.get('updated_at')) > (existing[job_id] or '')]
+        
+        if winners:
+            now = datetime.now()
+            winner_ids = [row['job_id'] for row in winners]
+            stats_before = self.stats.snapshot(cursor, winner_ids)
+            
+            columns = [column for _, column in JOB_FIELDS] + ['created_at', 'updated_at']
+            values = f"({', '.join([p] * len(columns))})"
+            if self.db_type == "sqlite":
+                sql = f"INSERT OR REPLACE INTO jobs ({', '.join(columns)}) VALUES {values}"
+            else:
+                updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in columns[1:])
+                sql = f"INSERT INTO jobs ({', '.join(columns)}) VALUES {values} " \
+                      f"ON CONFLICT (job_id) DO UPDATE SET {updates}"
+            
+            cursor.executemany(sql, [
+                [row.get(column) if row.get(column) is not None else '' for column in columns[:-2]] +
+                [sync_timestamp(row.get('created_at')) or now, sync_timestamp(row.get('updated_at')) or now]
+                for row in winners
+            ])
+            
+            stats_after = self.stats.snapshot(cursor, winner_ids)
+            jobs = [{key: row.get(column) for key, column in JOB_FIELDS} for row in winners]
+            dedup_plan = self.dedup.record(cursor, jobs, now)
+            self.stats.apply(cursor, self.stats.write_delta(
+                stats_before, stats_after, None, now, len(winners), dedup_plan['duplicate_delta']
+            ))
+            self._bump_generation(cursor)
+        
+        return winners
+    
+    def get_changes(self, since: Optional[str] = None, after_job_id: str = '',
+                    limit: int = 1000) -> List[Dict]:
+        """
+        依 (updated_at, job_id) 順序讀取在指定位置之後更新的職缺，供增量同步分頁使用
+        
+        Args:
+            since: 上一頁最後一筆的updated_at（None代表從頭開始）
+            after_job_id: 上一頁最後一筆的job_id
+            limit: 每頁筆數
+            
+        Returns:
+            List[Dict]: 職缺資料列表
+        """
+        p = self.stats.placeholder
+        if since is None:
+            where_clause, params = "1=1", []
         else:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            where_clause = f"updated_at > {p} OR (updated_at = {p} AND job_id > {p})"
+            params = [since, since, after_job_id]
         
-        # 構建查詢條件
+        conn = self.get_connection()
+        try:
+            if self.db_type == "sqlite":
+                cursor = conn.cursor()
+            else:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute(f'''
+                SELECT * FROM jobs
+                WHERE {where_clause}
+                ORDER BY updated_at, job_id
+                LIMIT {int(limit)}
+            ''', params)
+            
+            if self.db_type == "sqlite":
+                columns = [description[0] for description in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+    
+    def _build_conditions(self, keyword: str = None, company: str = None,
+                          days: Optional[int] = None,
+                          collapse_duplicates: bool = False) -> Tuple[str, List]:
+        """構建WHERE子句與參數"""
         conditions = []
         params = []
         
@@ -251,10 +793,51 @@ class JobDatabase:
             conditions.append("cust_name LIKE ?" if self.db_type == "sqlite" else "cust_name ILIKE %s")
             params.append(f"%{company}%")
         
+        if days is not None:
+            if self.db_type == "sqlite":
+                conditions.append("created_at >= datetime('now', ?)")
+                params.append(f"-{int(days)} days")
+            else:
+                conditions.append("created_at >= CURRENT_DATE - %s * INTERVAL '1 day'")
+                params.append(int(days))
+        
+        if collapse_duplicates:
+            conditions.append(self.dedup.collapse_condition("jobs.job_id"))
+        
         where_clause = " AND ".join(conditions) if conditions else "1=1"
+        return where_clause, params
+    
+    def search_jobs(self, keyword: str = None, company: str = None, 
+                   limit: int = 50, offset: int = 0, collapse_duplicates: bool = False,
+                   fields: Optional[Tuple[str, ...]] = None, truncate: Optional[int] = None) -> List[Dict]:
+        """
+        搜尋職缺資料
+        
+        Args:
+            keyword: 職缺名稱關鍵字
+            company: 公司名稱關鍵字
+            limit: 限制返回記錄數
+            offset: 偏移量
+            collapse_duplicates: 近似重複的職缺只返回每群的代表
+            fields: 只讀取的資料表欄位（見job_fields.parse_fields，None代表全部欄位）
+            truncate: 長文字欄位（job_detail、skill、benefit）在資料庫端截斷到的字元數
+            
+        Returns:
+            List[Dict]: 職缺資料列表
+        """
+        conn = self.get_read_connection()
+        
+        if self.db_type == "sqlite":
+            cursor = conn.cursor()
+        else:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        # 構建查詢條件
+        where_clause, params = self._build_conditions(keyword=keyword, company=company,
+                                                      collapse_duplicates=collapse_duplicates)
         
         query = f'''
-            SELECT * FROM jobs 
+            SELECT {select_list(fields, truncate)} FROM jobs 
             WHERE {where_clause}
             ORDER BY created_at DESC
             LIMIT {limit} OFFSET {offset}
@@ -271,9 +854,19 @@ class JobDatabase:
         conn.close()
         return results
     
+    def ping(self):
+        """檢查主庫是否可連接（就緒檢查使用，失敗時拋出例外）"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+        finally:
+            conn.close()
+    
     def get_job_count(self) -> int:
         """獲取職缺總數"""
-        conn = self.get_connection()
+        conn = self.get_read_connection()
         cursor = conn.cursor()
         
         cursor.execute("SELECT COUNT(*) FROM jobs")
@@ -282,52 +875,387 @@ class JobDatabase:
         conn.close()
         return count
     
-    def get_recent_jobs(self, days: int = 7) -> List[Dict]:
-        """獲取最近幾天的職缺"""
-        conn = self.get_connection()
+    def get_recent_jobs(self, days: int = 7, fields: Optional[Tuple[str, ...]] = None,
+                        truncate: Optional[int] = None) -> List[Dict]:
+        """獲取最近幾天的職缺（fields、truncate同search_jobs）"""
+        conn = self.get_read_connection()
+        columns = select_list(fields, truncate)
         
         if self.db_type == "sqlite":
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT * FROM jobs 
+                SELECT {} FROM jobs 
                 WHERE created_at >= datetime('now', '-{} days')
                 ORDER BY created_at DESC
-            '''.format(days))
+            '''.format(columns, days))
             
             columns = [description[0] for description in cursor.description]
             results = [dict(zip(columns, row)) for row in cursor.fetchall()]
         else:
             cursor = conn.cursor(cursor_factory=RealDictCursor)
             cursor.execute('''
-                SELECT * FROM jobs 
+                SELECT {} FROM jobs 
                 WHERE created_at >= CURRENT_DATE - INTERVAL '{} days'
                 ORDER BY created_at DESC
-            '''.format(days))
+            '''.format(columns, days))
             
             results = [dict(row) for row in cursor.fetchall()]
         
         conn.close()
         return results
     
-    def delete_old_jobs(self, days: int = 30) -> int:
-        """刪除舊的職缺資料"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def iter_jobs(self, keyword: str = None, company: str = None,
+                  days: Optional[int] = None, batch_size: int = 500) -> Iterator[Dict]:
+        """
+        以串流方式逐筆讀取職缺，記憶體用量與結果總數無關
+        
+        PostgreSQL使用具名伺服器端游標，SQLite使用fetchmany分批讀取。
+        結果依id遞增排序，連線在迭代結束（或生成器被關閉）時釋放。
+        
+        Args:
+            keyword: 職缺名稱關鍵字
+            company: 公司名稱關鍵字
+            days: 只讀取最近N天的職缺
+            batch_size: 每次從資料庫取回的筆數
+            
+        Yields:
+            Dict: 職缺資料
+        """
+        where_clause, params = self._build_conditions(keyword=keyword, company=company, days=days)
+        query = f"SELECT * FROM jobs WHERE {where_clause} ORDER BY id"
+        
+        conn = self.get_read_connection()
+        try:
+            if self.db_type == "sqlite":
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                columns = [description[0] for description in cursor.description]
+                
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield dict(zip(columns, row))
+            else:
+                # 具名游標讓結果留在伺服器端，每次只傳回itersize筆
+                cursor = conn.cursor(name=f"jobs_stream_{id(conn)}", cursor_factory=RealDictCursor)
+                cursor.itersize = batch_size
+                cursor.execute(query, params)
+                
+                for row in cursor:
+                    yield dict(row)
+                
+                cursor.close()
+        finally:
+            conn.close()
+    
+    def delete_old_jobs(self, days: int = 30, batch_size: int = 1000, pause: float = 0.05,
+                        progress_callback: Optional[Callable[[int], None]] = None) -> int:
+        """
+        分批刪除舊的職缺資料
+        
+        每批在獨立的交易中刪除最多batch_size筆並提交，批次之間暫停pause秒，
+        避免長時間持有SQLite寫入鎖或產生過長的PostgreSQL交易。
+        使用每月分區時，整個月都已過期的分區會直接刪除分區表。
+        
+        Args:
+            days: 保留天數
+            batch_size: 每批刪除筆數
+            pause: 批次之間的暫停秒數
+            progress_callback: 每批完成後以累計刪除筆數呼叫
+            
+        Returns:
+            int: 刪除的記錄數
+            
+        Raises:
+            ValueError: days或batch_size不是正整數
+        """
+        days, batch_size = int(days), int(batch_size)
+        if days < 1 or batch_size < 1:
+            raise ValueError("days與batch_size必須是正整數")
         
         if self.db_type == "sqlite":
-            cursor.execute('''
-                DELETE FROM jobs 
-                WHERE created_at < datetime('now', '-{} days')
-            '''.format(days))
+            where_clause = "created_at < datetime('now', '-{} days')".format(days)
         else:
-            cursor.execute('''
-                DELETE FROM jobs 
-                WHERE created_at < CURRENT_DATE - INTERVAL '{} days'
-            '''.format(days))
+            where_clause = "created_at < CURRENT_DATE - INTERVAL '{} days'".format(days)
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        placeholder = self.stats.placeholder
+        deleted_count = 0
+        
+        try:
+            if self.partition_by_month:
+                deleted_count += self._drop_expired_partitions(conn, cursor, days)
+                if progress_callback:
+                    progress_callback(deleted_count)
+            
+            while True:
+                cursor.execute(f'''
+                    SELECT id, job_id, {STAT_COLUMNS} FROM jobs
+                    WHERE {where_clause}
+                    LIMIT {int(batch_size)}
+                ''')
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                
+                # 這批職缺對統計的貢獻，與刪除在同一個交易中扣除
+                stats_delta = Counter()
+                for row in rows:
+                    self.stats.count_row(stats_delta, row[2:], weight=-1)
+                
+                # SQLite 預設最多 999 個參數，分段刪除
+                ids = [row[0] for row in rows]
+                for start in range(0, len(ids), 500):
+                    chunk = ids[start:start + 500]
+                    marks = ', '.join([placeholder] * len(chunk))
+                    cursor.execute(f"DELETE FROM jobs WHERE id IN ({marks})", chunk)
+                    deleted_count += cursor.rowcount
+                stats_delta[(ALL_TIME, DIM_DUPLICATE, '')] += self.dedup.remove(cursor, [row[1] for row in rows])
+                
+                self.stats.apply(cursor, stats_delta)
+                self._bump_generation(cursor)
+                conn.commit()
+                
+                if progress_callback:
+                    progress_callback(deleted_count)
+                
+                if len(rows) < batch_size:
+                    break
+                time.sleep(pause)
+        finally:
+            conn.close()
+        
+        print(f"刪除了 {deleted_count} 筆舊職缺資料")
+        return deleted_count
+    
+    def _drop_expired_partitions(self, conn, cursor, days: int) -> int:
+        """刪除整個月份都早於保留期限的分區，返回刪除的職缺數"""
+        cursor.execute("SELECT CURRENT_DATE - %s", (days,))
+        cutoff = cursor.fetchone()[0]
+        
+        cursor.execute('''
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = 'jobs'
+        ''')
+        partitions = [row[0] for row in cursor.fetchall()]
+        
+        dropped_count = 0
+        for name in sorted(partitions):
+            match = re.match(r'^jobs_y(\d{4})m(\d{2})$', name)
+            if not match:
+                continue
+            
+            year, month = int(match.group(1)), int(match.group(2))
+            next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+            if date(next_year, next_month, 1) > cutoff:
+                continue
+            
+            stats_delta = self.stats.snapshot_where(cursor, "1=1", table=name)
+            cursor.execute(f"SELECT job_id FROM {name}")
+            job_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(f"DROP TABLE {name}")
+            
+            removal = Counter({key: -value for key, value in stats_delta.items()})
+            removal[(ALL_TIME, DIM_DUPLICATE, '')] += self.dedup.remove(cursor, job_ids)
+            self.stats.apply(cursor, removal)
+            self._bump_generation(cursor)
+            conn.commit()
+            
+            self._ready_partitions.discard(name)
+            dropped_count += sum(
+                value for (_, dimension, _), value in stats_delta.items() if dimension == DIM_TOTAL
+            )
+            print(f"已刪除過期分區 {name}")
+        
+        return dropped_count
+    
+    def get_stats_summary(self, days: int = 7) -> Dict:
+        """
+        讀取預先計算的統計數字（不掃描jobs表格）
+        
+        Args:
+            days: 「最近新增」的天數範圍
+            
+        Returns:
+            Dict: total_jobs、unique_jobs（合併近似重複後）、recent_jobs、new_jobs_today
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        total_jobs = self.stats.get_count(cursor)
+        summary = {
+            'total_jobs': total_jobs,
+            'unique_jobs': total_jobs - self.stats.get_count(cursor, DIM_DUPLICATE),
+            'recent_jobs': self.stats.get_recent_count(cursor, days),
+            'new_jobs_today': self.stats.get_recent_count(cursor, 0)
+        }
+        
+        conn.close()
+        return summary
+    
+    def get_stats_breakdown(self, dimension: str, days: Optional[int] = None,
+                            limit: int = 50) -> List[Dict]:
+        """依地區（area）或搜尋關鍵字（keyword）列出職缺數"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        results = self.stats.get_breakdown(cursor, dimension, days=days, limit=limit)
+        
+        conn.close()
+        return results
+    
+    def facet_counts(self, filters: Optional[Dict] = None, limit: int = 20) -> Dict[str, List[Dict]]:
+        """
+        分面計數（地區、職類、公司、遠端工作）
+        
+        每個分面套用除了自己以外的篩選條件。沒有篩選條件或只篩選地區時，直接讀取
+        job_stats中隨每批寫入增量更新的計數；其他篩選條件對已建索引的欄位執行GROUP BY
+        
+        Args:
+            filters: 篩選條件，可包含 keyword、area、category、company、remote
+            limit: 每個分面最多返回幾項
+            
+        Returns:
+            Dict: {"area": [{"value": ..., "count": ...}], "category": [...], "company": [...], "remote": [...]}
+        """
+        filters = {key: value for key, value in (filters or {}).items() if value not in (None, '')}
+        if DIM_AREA in filters:
+            filters[DIM_AREA] = area_of(filters[DIM_AREA])
+        like = "LIKE" if self.db_type == "sqlite" else "ILIKE"
+        
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        
+        facets = {}
+        for dimension in FACET_EXPRESSIONS:
+            others = {key: value for key, value in filters.items() if key != dimension}
+            if list(others) == [DIM_AREA]:
+                facets[dimension] = self.stats.get_area_breakdown(cursor, dimension, others[DIM_AREA], limit=limit)
+            elif others:
+                conditions, params = facet_conditions(others, self.stats.placeholder, like)
+                cursor.execute(facet_group_sql(dimension, conditions, limit), params)
+                facets[dimension] = [{'value': value, 'count': int(count)}
+                                     for value, count in cursor.fetchall()]
+            else:
+                breakdown = self.stats.get_breakdown(cursor, dimension, limit=limit + 1)
+                facets[dimension] = [item for item in breakdown if item['value']][:limit]
+        
+        conn.close()
+        return facets
+    
+    def rebuild_stats(self):
+        """從jobs表格重建統計彙總（資料被外部修改後使用）"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        self.stats.rebuild(cursor)
+        
+        # 重複職缺數由簽章表格重新計算
+        cursor.execute(f"DELETE FROM job_stats WHERE dimension = {self.stats.placeholder}", (DIM_DUPLICATE,))
+        cursor.execute("SELECT COUNT(*) FROM job_signatures WHERE canonical_id <> job_id")
+        self.stats.apply(cursor, Counter({(ALL_TIME, DIM_DUPLICATE, ''): cursor.fetchone()[0]}))
+        self._bump_generation(cursor)
         
-        deleted_count = cursor.rowcount
         conn.commit()
         conn.close()
+    
+    def rebuild_duplicates(self, batch_size: int = 500) -> Dict:
+        """
+        重新計算所有職缺的簽章與重複群（啟用近似重複偵測前已存在的資料使用）
         
-        print(f"刪除了 {deleted_count} 筆舊職缺資料")
-        return deleted_count 
\ No newline at end of file
+        依created_at由舊到新分批歸群，讓每群的代表為最早出現的職缺
+        
+        Returns:
+            Dict: jobs（處理的職缺數）、duplicates（重複職缺數）
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        p = self.stats.placeholder
+        
+        cursor.execute("DELETE FROM job_lsh_buckets")
+        cursor.execute("DELETE FROM job_signatures")
+        conn.commit()
+        
+        processed = 0
+        last_key = None
+        while True:
+            if last_key is None:
+                cursor.execute(f'''
+                    SELECT id, created_at, job_id, job_name, cust_name, job_detail FROM jobs
+                    ORDER BY created_at, id
+                    LIMIT {int(batch_size)}
+                ''')
+            else:
+                cursor.execute(f'''
+                    SELECT id, created_at, job_id, job_name, cust_name, job_detail FROM jobs
+                    WHERE created_at > {p} OR (created_at = {p} AND id > {p})
+                    ORDER BY created_at, id
+                    LIMIT {int(batch_size)}
+                ''', (last_key[0], last_key[0], last_key[1]))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            
+            jobs = [{'jobId': job_id, 'jobName': name, 'custName': company, 'jobDetail': detail}
+                    for _, _, job_id, name, company, detail in rows]
+            self.dedup.record(cursor, jobs, rows[0][1])
+            conn.commit()
+            
+            processed += len(rows)
+            last_key = (rows[-1][1], rows[-1][0])
+        
+        conn.close()
+        
+        # 同步更新重複職缺數
+        self.rebuild_stats()
+        summary = self.get_stats_summary()
+        result = {'jobs': processed, 'duplicates': summary['total_jobs'] - summary['unique_jobs']}
+        print(f"近似重複重新計算完成: {result}")
+        return result
+    
+    def compact_history(self, max_gap_days: int = 2) -> Dict:
+        """
+        壓縮觀測歷史，把連續且內容相同的觀測合併為有效區間
+        
+        Args:
+            max_gap_days: 兩次觀測間隔超過此天數時視為職缺曾下架，不合併
+            
+        Returns:
+            Dict: chains（處理的觀測鏈數）、merged（被合併的觀測數）
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        result = self.history.compact(cursor, max_gap=timedelta(days=max_gap_days))
+        self._bump_generation(cursor)
+        
+        conn.commit()
+        conn.close()
+        
+        print(f"觀測歷史壓縮完成: {result}")
+        return result
+    
+    def get_alive_per_day(self, keyword: Optional[str] = None, days: int = 30) -> List[Dict]:
+        """每日仍在架上的職缺數（可依搜尋關鍵字篩選）"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        series = self.history.alive_per_day(cursor, keyword=keyword, days=days)
+        
+        conn.close()
+        return series
+    
+    def get_job_history(self, job_id: str) -> List[Dict]:
+        """獲取單一職缺的觀測歷史"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        timeline = self.history.timeline(cursor, job_id)
+        
+        conn.close()
+        return timeline
@@ -0,0 +1,235 @@
+"""
+新職缺推送伺服器
+以asyncio在單一執行緒中服務 /api/jobs/feed 的SSE連線：每個連線只是一個協程，不像gunicorn的gthread worker
+每個連線佔住一個請求執行緒，數千個訂閱者也不影響API；
+職缺由JobFeed的背景執行緒從FEED_STORE_PATH（與gunicorn、排程器共用的推送紀錄）讀取後分送
+
+    FEED_STORE_PATH=feed.db python feed_server.py --port 5002
+
+查詢參數與回應格式和app.py的 /api/jobs/feed 相同；GET /healthz 回傳訂閱者數等狀態
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from job_feed import FeedFilter, FeedFull, JobFeed, Subscription, format_events
+from job_fields import COMPACT_TEXT_LENGTH, parse_fields
+
+logger = logging.getLogger(__name__)
+
+# 讀取請求標頭的逾時秒數與大小上限
+REQUEST_TIMEOUT = 10.0
+MAX_REQUEST_HEAD = 16 * 1024
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               503: 'Service Unavailable'}
+
+
+class AsyncSubscription(Subscription):
+    """
+    asyncio版本的訂閱：JobFeed的背景執行緒呼叫push時轉交給事件迴圈，
+    用戶端的協程以next_batch等待，不佔用執行緒
+    """
+
+    def __init__(self, feed_filter: FeedFilter, buffer_size: int):
+        super().__init__(feed_filter, buffer_size)
+        # 由事件迴圈中的協程呼叫JobFeed.subscribe建立
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+
+    def push(self, jobs):
+        super().push(jobs)
+        self._wake()
+
+    def close(self):
+        super().close()
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # 事件迴圈已關閉
+            pass
+
+    async def next_batch(self, timeout: float):
+        """
+        等待並取出緩衝區的職缺
+
+        Returns:
+            tuple: (職缺列表, 丟棄的筆數)；timeout秒內沒有新職缺時為 ([], 0)
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+        return self._drain()
+
+
+class FeedServer:
+    """以asyncio.start_server服務SSE推送的HTTP伺服器（只支援GET）"""
+
+    def __init__(self, feed: JobFeed, heartbeat: float = 15.0):
+        """
+        Args:
+            feed: 以AsyncSubscription建立的JobFeed（store_path為共用的推送紀錄）
+            heartbeat: 沒有新職缺時送出保持連線訊息的間隔秒數
+        """
+        self.feed = feed
+        self.heartbeat = heartbeat
+        self._server = None
+        self._connections = set()
+
+    async def start(self, host: str = '0.0.0.0', port: int = 5002) -> int:
+        """開始監聽，回傳實際的埠號（port為0時由系統分配）"""
+        self._server = await asyncio.start_server(self._handle, host, port, limit=MAX_REQUEST_HEAD)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        """停止接受連線、關閉所有訂閱並等待進行中的連線結束"""
+        if self._server is not None:
+            self._server.close()
+        self.feed.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            await self._handle_request(reader, writer)
+        finally:
+            self._connections.discard(task)
+
+    async def _handle_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), REQUEST_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+
+        parts = head.split(b'\r\n', 1)[0].decode('latin-1').split()
+        try:
+            if len(parts) != 3:
+                await self._respond(writer, 400, {"status": "error", "message": "無效的請求"})
+            elif parts[0] != 'GET':
+                await self._respond(writer, 405, {"status": "error", "message": "只支援GET"})
+            else:
+                url = urlsplit(parts[1])
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if url.path == '/api/jobs/feed':
+                    await self._stream(reader, writer, query)
+                elif url.path == '/healthz':
+                    await self._respond(writer, 200, {"status": "ok", "feed": self.feed.stats()})
+                else:
+                    await self._respond(writer, 404, {"status": "error", "message": "找不到路徑"})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, body: Dict):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            "Connection: close\r\n\r\n".encode('latin-1') + data
+        )
+        await writer.drain()
+
+    async def _stream(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, query: Dict):
+        """與app.py的 /api/jobs/feed 相同的篩選條件與事件格式"""
+        try:
+            fields = parse_fields(query.get('fields'))
+        except ValueError as e:
+            await self._respond(writer, 400, {"status": "error", "message": str(e)})
+            return
+        truncate = COMPACT_TEXT_LENGTH if query.get('compact', 'false').lower() == 'true' else None
+
+        feed_filter = FeedFilter(keyword=query.get('keyword'), area=query.get('area'),
+                                 company=query.get('company'))
+        try:
+            subscription = self.feed.subscribe(feed_filter)
+        except FeedFull as e:
+            await self._respond(writer, 503, {"status": "error", "message": str(e)})
+            return
+
+        # 用戶端斷線（讀到EOF）時立即結束訂閱，不必等到下一次寫入失敗
+        disconnected = asyncio.ensure_future(reader.read())
+        disconnected.add_done_callback(lambda _: subscription.close())
+        try:
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/event-stream; charset=utf-8\r\n"
+                b"Cache-Control: no-cache\r\n"
+                b"X-Accel-Buffering: no\r\n"
+                b"Access-Control-Allow-Origin: *\r\n"
+                b"Connection: close\r\n\r\n"
+                b": connected\n\n"
+            )
+            await writer.drain()
+            while not subscription.closed:
+                jobs, dropped = await subscription.next_batch(self.heartbeat)
+                if subscription.closed:
+                    break
+                writer.write(format_events(jobs, dropped, fields, truncate).encode('utf-8'))
+                await writer.drain()
+        finally:
+            disconnected.cancel()
+            self.feed.unsubscribe(subscription)
+
+
+def create_feed(store_path: Optional[str] = None) -> JobFeed:
+    """依環境變數建立使用AsyncSubscription的JobFeed"""
+    store_path = store_path or os.getenv('FEED_STORE_PATH')
+    if not store_path:
+        raise ValueError("推送伺服器需要FEED_STORE_PATH（與gunicorn、排程器共用的推送紀錄）")
+    return JobFeed(
+        buffer_size=int(os.getenv('FEED_BUFFER_SIZE', '200')),
+        max_subscribers=int(os.getenv('FEED_MAX_SUBSCRIBERS', '10000')),
+        store_path=store_path,
+        poll_interval=float(os.getenv('FEED_POLL_INTERVAL', '1')),
+        subscription_class=AsyncSubscription
+    )
+
+
+async def run(host: str, port: int, store_path: Optional[str] = None):
+    server = FeedServer(create_feed(store_path), heartbeat=float(os.getenv('FEED_HEARTBEAT', '15')))
+    port = await server.start(host, port)
+    logger.info(f"推送伺服器監聽 {host}:{port}（推送紀錄: {server.feed.store_path}）")
+
+    # SIGTERM / SIGINT：停止接受連線並關閉所有訂閱
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+    serving = asyncio.ensure_future(server.serve_forever())
+    await stopping.wait()
+    await server.close()
+    serving.cancel()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='新職缺即時推送（SSE）伺服器')
+    parser.add_argument('--host', default='0.0.0.0', help='監聽位址')
+    parser.add_argument('--port', type=int, default=int(os.getenv('FEED_PORT', '5002')), help='監聽埠號')
+    parser.add_argument('--store', default=None, help='共用的推送紀錄（預設FEED_STORE_PATH）')
+    args = parser.parse_args()
+
+    asyncio.run(run(args.host, args.port, args.store))
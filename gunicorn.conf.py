@@ -0,0 +1,59 @@
+"""
+正式環境的WSGI伺服器配置（gunicorn）
+
+    gunicorn -c gunicorn.conf.py app:app
+
+主行程預先載入app.py（Flask應用與所有模組只載入一次，由worker以copy-on-write共用），
+爬蟲、背景任務與資料庫在每個worker第一個需要它們的請求（通常是 /readyz）才建立；收到SIGTERM時worker處理完進行中的請求、
+等待背景任務並送出D1暫存佇列後才結束（最多WEB_GRACEFUL_TIMEOUT秒）
+"""
+
+import multiprocessing
+import os
+
+# 背景任務的狀態寫入共用檔案，輪詢與SSE請求由任一worker回應都查得到
+os.environ.setdefault('TASK_STORE_PATH', 'tasks.db')
+# 各worker的指標寫入共用目錄，/metrics由任一worker回應都是所有worker的合計
+os.environ.setdefault('METRICS_DIR', 'metrics_data')
+# 同時執行的爬蟲數上限由所有worker共用（以鎖檔計算名額）
+os.environ.setdefault('SCRAPE_SLOT_DIR', 'scrape_slots')
+# 任一worker寫入的職缺都推送給所有worker的 /api/jobs/feed 訂閱者
+os.environ.setdefault('FEED_STORE_PATH', 'feed.db')
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+
+# gthread：每個worker以多個執行緒處理請求，SSE等長連線不會佔住整個worker
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_WORKERS', str(multiprocessing.cpu_count() * 2 + 1)))
+threads = int(os.getenv('WEB_THREADS', '4'))
+
+# 每個 /api/jobs/feed 連線佔住一個執行緒：保留FEED_RESERVED_THREADS個執行緒給API與 /readyz，
+# 每個worker的訂閱者上限（FEED_MAX_SUBSCRIBERS）不超過其餘的執行緒數；大量訂閱者由feed_server.py服務
+feed_threads = max(threads - int(os.getenv('FEED_RESERVED_THREADS', '2')), 0)
+os.environ['FEED_MAX_SUBSCRIBERS'] = str(min(int(os.getenv('FEED_MAX_SUBSCRIBERS', str(feed_threads))),
+                                             feed_threads))
+
+preload_app = True
+timeout = int(os.getenv('WEB_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('WEB_KEEPALIVE', '5'))
+
+# WEB_MAX_REQUESTS > 0 時每個worker處理這麼多請求後重啟，避免長時間執行累積的記憶體
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.getenv('WEB_MAX_REQUESTS_JITTER', '0'))
+
+accesslog = os.getenv('WEB_ACCESS_LOG', '-')
+loglevel = os.getenv('WEB_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    """清除上次執行留下的指標檔案"""
+    import glob
+    for path in glob.glob(os.path.join(os.environ['METRICS_DIR'], '*.json')):
+        os.remove(path)
+
+
+def worker_exit(server, worker):
+    """worker結束前等待背景任務並關閉資料庫"""
+    import app as web_app
+    web_app.shutdown_state()
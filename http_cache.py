@@ -0,0 +1,178 @@
+"""
+HTTP快取與壓縮模組
+- 以資料庫寫入世代（不必執行查詢）或回應內容的雜湊產生強ETag，
+  If-None-Match相符時返回304，不再查詢與序列化
+- 依Accept-Encoding以brotli（已安裝時）或gzip壓縮回應
+- 每個端點的Cache-Control可用環境變數覆寫
+"""
+
+import functools
+import gzip
+import hashlib
+import logging
+import os
+import time
+from typing import Callable, Iterable, Optional
+
+from flask import make_response, request
+
+try:
+    import brotli
+except ImportError:  # 未安裝brotli時只使用gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# 可壓縮的回應類型
+COMPRESSIBLE_MIMETYPES = (
+    'application/json',
+    'application/x-ndjson',
+    'text/html',
+    'text/csv',
+    'text/plain',
+    'text/css',
+    'application/javascript'
+)
+
+# 壓縮後的回應在ETag後加上的後綴（同一份資料不同編碼的強ETag必須不同）
+ENCODING_SUFFIXES = ('-br', '-gzip')
+
+
+def generation_etag(generation, *parts) -> str:
+    """由寫入世代與請求內容（路徑、參數等）產生ETag"""
+    digest = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:16]
+    return f"g{generation}-{digest}"
+
+
+def body_etag(data: bytes) -> str:
+    """由回應內容的雜湊產生ETag"""
+    return 'h' + hashlib.sha1(data).hexdigest()[:24]
+
+
+def strip_encoding(tag: str) -> str:
+    """移除ETag的壓縮後綴，比對時不分編碼"""
+    for suffix in ENCODING_SUFFIXES:
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)]
+    return tag
+
+
+def matching_etag(etag: str) -> Optional[str]:
+    """請求的If-None-Match中與etag相符的值（可能帶有壓縮後綴），沒有時為None"""
+    if_none_match = request.if_none_match
+    if if_none_match.star_tag:
+        return etag
+    for tag in if_none_match:
+        if strip_encoding(tag) == etag:
+            return tag
+    return None
+
+
+def cache_control_for(endpoint: str, default: str) -> str:
+    """端點的Cache-Control（環境變數 CACHE_CONTROL_<端點名稱大寫> 可覆寫，例如 CACHE_CONTROL_GET_JOB_STATS）"""
+    return os.getenv(f"CACHE_CONTROL_{endpoint.upper()}", default)
+
+
+def not_modified(etag: str, cache_control: str):
+    response = make_response('', 304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def conditional(cache_control: str = 'no-cache',
+                generation: Optional[Callable[[], object]] = None,
+                when: Optional[Callable[[], bool]] = None,
+                window: float = 60.0):
+    """
+    為GET端點加上ETag、304與Cache-Control的裝飾器
+
+    Args:
+        cache_control: 預設的Cache-Control
+        generation: 返回目前寫入世代的函數；提供時ETag在執行端點前由世代與請求內容算出，
+            相符時直接返回304；未提供（或when()為False、讀取世代失敗）時改用回應內容的雜湊
+        when: 是否使用寫入世代（例如搜尋只有讀取資料庫時才適用）
+        window: 世代ETag另外依時間分段的秒數（「最近N天」這類查詢的結果會隨時間變動）
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            control = cache_control_for(view.__name__, cache_control)
+
+            etag = None
+            if generation is not None and (when is None or when()):
+                try:
+                    bucket = int(time.time() // window) if window else 0
+                    etag = generation_etag(generation(), request.full_path, bucket)
+                except Exception as e:
+                    logger.warning(f"讀取寫入世代時發生錯誤，改用回應內容產生ETag: {e}")
+                if etag is not None:
+                    matched = matching_etag(etag)
+                    if matched:
+                        return not_modified(matched, control)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+
+            if etag is None:
+                etag = body_etag(response.get_data())
+                matched = matching_etag(etag)
+                if matched:
+                    return not_modified(matched, control)
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = control
+            return response
+
+        return wrapped
+    return decorator
+
+
+def choose_encoding(accept_encodings: Iterable) -> Optional[str]:
+    """依Accept-Encoding選擇壓縮方式（br優先，其次gzip）"""
+    if brotli is not None and accept_encodings.quality('br') > 0:
+        return 'br'
+    if accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+
+def compress_response(response, min_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+    """
+    壓縮回應（after_request使用）
+
+    串流回應（SSE、匯出）、非200、已編碼或小於min_size位元組的回應不壓縮
+
+    Args:
+        response: Flask回應
+        min_size: 最小壓縮的位元組數
+        gzip_level: gzip壓縮等級
+        brotli_quality: brotli壓縮品質（0-11，越高越慢）
+    """
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    if encoding == 'br':
+        compressed = brotli.compress(data, quality=brotli_quality)
+    else:
+        compressed = gzip.compress(data, compresslevel=gzip_level)
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak=weak)
+    return response
@@ -0,0 +1,301 @@
+"""
+職缺近似重複偵測模組
+以MinHash簽章估計 job_name + cust_name + job_detail 的相似度，並以LSH分桶索引
+在寫入時只比對落在同一個桶的候選職缺（不必與全部職缺比較），
+把近似重複的職缺歸入同一群，每群記錄一個代表職缺（canonical_id），
+查詢與統計可據此合併重複職缺
+"""
+
+import hashlib
+import re
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# 簽章長度與LSH分桶方式：BANDS個桶，每桶ROWS_PER_BAND個雜湊值
+# 相似度約 (1/BANDS) ** (1/ROWS_PER_BAND) ≈ 0.7 以上的職缺會落入同一個桶成為候選
+NUM_PERM = 128
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+
+# 字元n-gram長度（中文職缺描述沒有空白分詞，以字元為單位）
+SHINGLE_SIZE = 3
+
+# 估計相似度達到此值才視為重複
+SIMILARITY_THRESHOLD = 0.8
+
+# 每次查詢候選的桶數上限（兩個參數一組，SQLite預設最多999個參數）
+_BUCKET_CHUNK = 400
+
+# MinHash使用的隨機雜湊函數 (a * x + b) mod p，固定種子讓簽章可重現
+_PRIME = np.uint64((1 << 31) - 1)
+_random = np.random.RandomState(104)
+_A = _random.randint(1, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+_B = _random.randint(0, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+
+
+def dedup_text(job: Dict) -> str:
+    """取得用於比對的文字（職缺名稱、公司名稱、工作內容，忽略大小寫與空白差異）"""
+    text = ' '.join(str(job.get(key) or '') for key in ('jobName', 'custName', 'jobDetail'))
+    return re.sub(r'\s+', ' ', text.lower()).strip()
+
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    """計算文字的MinHash簽章；沒有文字時返回None（不參與比對）"""
+    if not text:
+        return None
+
+    grams = {text[i:i + SHINGLE_SIZE] for i in range(max(len(text) - SHINGLE_SIZE + 1, 1))}
+    values = np.fromiter((zlib.crc32(gram.encode('utf-8')) for gram in grams),
+                         dtype=np.uint64, count=len(grams)) % _PRIME
+
+    return ((np.outer(_A, values) + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def encode_signature(signature: np.ndarray) -> str:
+    """簽章轉為十六進位字串保存"""
+    return signature.astype('>u4').tobytes().hex()
+
+
+def decode_signature(value: str) -> np.ndarray:
+    """十六進位字串轉回簽章"""
+    return np.frombuffer(bytes.fromhex(value), dtype='>u4').astype(np.uint64)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """以簽章相同位置的比例估計Jaccard相似度"""
+    return float(np.mean(a == b))
+
+
+def band_keys(signature: np.ndarray) -> List[Tuple[int, str]]:
+    """簽章的LSH分桶鍵 (band, bucket)"""
+    raw = signature.astype('>u4')
+    return [
+        (band, hashlib.md5(raw[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes()).hexdigest()[:16])
+        for band in range(BANDS)
+    ]
+
+
+class JobDedupTracker:
+    """
+    近似重複職缺追蹤器
+
+    - job_signatures：每筆職缺的簽章與所屬群的代表職缺（canonical_id），
+      代表職缺為群內最早出現的職缺，其canonical_id等於自己
+    - job_lsh_buckets：(band, bucket, job_id) 分桶索引，新職缺只與同桶的職缺比對
+    - 寫入與刪除時返回「重複職缺數」的增減量，由呼叫端記入job_stats
+    """
+
+    def __init__(self, db_type: str = "sqlite", threshold: float = SIMILARITY_THRESHOLD):
+        self.db_type = db_type
+        self.placeholder = '?' if db_type == "sqlite" else '%s'
+        self.threshold = threshold
+
+    def create_table(self, cursor):
+        """建立簽章與分桶索引表格"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS job_signatures (
+                job_id VARCHAR(255) PRIMARY KEY,
+                signature TEXT NOT NULL,
+                canonical_id VARCHAR(255) NOT NULL,
+                created_at TIMESTAMP NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_signatures_canonical ON job_signatures(canonical_id)')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS job_lsh_buckets (
+                band INTEGER NOT NULL,
+                bucket VARCHAR(16) NOT NULL,
+                job_id VARCHAR(255) NOT NULL,
+                PRIMARY KEY (band, bucket, job_id)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_lsh_job ON job_lsh_buckets(job_id)')
+
+    @staticmethod
+    def existing_sql(marks: List[str]) -> str:
+        """讀取既有簽章，並標記是否為其他職缺的代表"""
+        return f'''
+            SELECT s.job_id, s.signature, s.canonical_id,
+                   EXISTS (SELECT 1 FROM job_signatures m
+                           WHERE m.canonical_id = s.job_id AND m.job_id <> s.job_id)
+            FROM job_signatures s
+            WHERE s.job_id IN ({', '.join(marks)})
+        '''
+
+    @staticmethod
+    def candidates_sql(pair_marks: List[Tuple[str, str]]) -> str:
+        """讀取落在指定桶中的職缺"""
+        conditions = ' OR '.join(f"(b.band = {band} AND b.bucket = {bucket})" for band, bucket in pair_marks)
+        return f'''
+            SELECT b.band, b.bucket, s.job_id, s.signature, s.canonical_id
+            FROM job_lsh_buckets b
+            JOIN job_signatures s ON s.job_id = b.job_id
+            WHERE {conditions}
+        '''
+
+    @staticmethod
+    def upsert_sql(marks: List[str]) -> str:
+        """寫入簽章（保留首次出現時間）"""
+        return f'''
+            INSERT INTO job_signatures (job_id, signature, canonical_id, created_at)
+            VALUES ({', '.join(marks)})
+            ON CONFLICT (job_id) DO UPDATE SET
+                signature = excluded.signature,
+                canonical_id = excluded.canonical_id
+        '''
+
+    @staticmethod
+    def bucket_sql(marks: List[str]) -> str:
+        """寫入分桶索引"""
+        return f'''
+            INSERT INTO job_lsh_buckets (band, bucket, job_id) VALUES ({', '.join(marks)})
+            ON CONFLICT (band, bucket, job_id) DO NOTHING
+        '''
+
+    @staticmethod
+    def signatures(jobs: Iterable[Dict]) -> Dict[str, Optional[np.ndarray]]:
+        """計算一批職缺的簽章（同一個職缺ID以最後一筆為準）"""
+        return {job['jobId']: minhash(dedup_text(job)) for job in jobs if job.get('jobId')}
+
+    def assign(self, signatures: Dict[str, Optional[np.ndarray]], existing: Dict[str, tuple],
+               candidates: Dict[Tuple[int, str], List[tuple]], observed_at: datetime) -> Dict:
+        """
+        為一批職缺決定所屬的群
+
+        Args:
+            signatures: {job_id: 簽章}
+            existing: {job_id: (signature, canonical_id, 是否為其他職缺的代表)}
+            candidates: {(band, bucket): [(job_id, signature, canonical_id)]}
+            observed_at: 寫入時間
+
+        Returns:
+            Dict: canonical（{job_id: canonical_id}）、rows（簽章列）、buckets（分桶列）、
+                changed（簽章變動需清除舊分桶的職缺ID）、duplicate_delta（重複職缺數增減量）
+        """
+        plan = {'canonical': {}, 'rows': [], 'buckets': [], 'changed': [], 'duplicate_delta': 0}
+        batch_index = {}
+
+        for job_id, signature in signatures.items():
+            signature_hex = encode_signature(signature) if signature is not None else ''
+            keys = band_keys(signature) if signature is not None else []
+            old = existing.get(job_id)
+
+            if old is not None and old[0] == signature_hex:
+                # 內容沒有變動，維持原本的群
+                canonical_id = old[1]
+            else:
+                if old is not None:
+                    plan['changed'].append(job_id)
+
+                canonical_id = job_id
+                if old is None or not old[2]:
+                    # 已是其他職缺的代表時維持不變，避免群內職缺失去代表
+                    best = self.threshold
+                    seen = set()
+                    for key in keys:
+                        for other_id, other_hex, other_canonical in candidates.get(key, []) + batch_index.get(key, []):
+                            if other_id == job_id or other_id in seen:
+                                continue
+                            seen.add(other_id)
+                            score = similarity(signature, decode_signature(other_hex))
+                            if score >= best:
+                                best, canonical_id = score, other_canonical
+
+                was_duplicate = old is not None and old[1] != job_id
+                plan['duplicate_delta'] += int(canonical_id != job_id) - int(was_duplicate)
+                plan['rows'].append((job_id, signature_hex, canonical_id, observed_at))
+                plan['buckets'].extend((band, bucket, job_id) for band, bucket in keys)
+
+            plan['canonical'][job_id] = canonical_id
+            for key in keys:
+                batch_index.setdefault(key, []).append((job_id, signature_hex, canonical_id))
+
+        return plan
+
+    def record(self, cursor, jobs: List[Dict], observed_at: datetime) -> Dict:
+        """
+        將一批職缺加入分桶索引並歸群（與職缺寫入共用同一個交易）
+
+        Returns:
+            Dict: assign() 的結果
+        """
+        p = self.placeholder
+        signatures = self.signatures(jobs)
+        job_ids = list(signatures)
+
+        existing = {}
+        for start in range(0, len(job_ids), 500):
+            chunk = job_ids[start:start + 500]
+            cursor.execute(self.existing_sql([p] * len(chunk)), chunk)
+            for job_id, signature_hex, canonical_id, has_members in cursor.fetchall():
+                existing[job_id] = (signature_hex, canonical_id, bool(has_members))
+
+        keys = list(dict.fromkeys(
+            key for signature in signatures.values() if signature is not None for key in band_keys(signature)
+        ))
+        candidates = {}
+        for start in range(0, len(keys), _BUCKET_CHUNK):
+            chunk = keys[start:start + _BUCKET_CHUNK]
+            cursor.execute(self.candidates_sql([(p, p)] * len(chunk)), [value for key in chunk for value in key])
+            for band, bucket, job_id, signature_hex, canonical_id in cursor.fetchall():
+                candidates.setdefault((band, bucket), []).append((job_id, signature_hex, canonical_id))
+
+        plan = self.assign(signatures, existing, candidates, observed_at)
+
+        if plan['changed']:
+            cursor.executemany(f"DELETE FROM job_lsh_buckets WHERE job_id = {p}",
+                               [(job_id,) for job_id in plan['changed']])
+        if plan['rows']:
+            cursor.executemany(self.upsert_sql([p] * 4), plan['rows'])
+        if plan['buckets']:
+            cursor.executemany(self.bucket_sql([p] * 3), plan['buckets'])
+
+        return plan
+
+    def remove(self, cursor, job_ids: List[str]) -> int:
+        """
+        移除已刪除職缺的簽章；若刪除的是群的代表，改由群內最早出現的職缺接任
+
+        Returns:
+            int: 重複職缺數的增減量
+        """
+        p = self.placeholder
+        delta = 0
+
+        for start in range(0, len(job_ids), 500):
+            chunk = job_ids[start:start + 500]
+            marks = ', '.join([p] * len(chunk))
+
+            cursor.execute(f"SELECT job_id, canonical_id FROM job_signatures WHERE job_id IN ({marks})", chunk)
+            rows = cursor.fetchall()
+            delta -= sum(1 for job_id, canonical_id in rows if canonical_id != job_id)
+            orphaned = [job_id for job_id, canonical_id in rows if canonical_id == job_id]
+
+            cursor.execute(f"DELETE FROM job_lsh_buckets WHERE job_id IN ({marks})", chunk)
+            cursor.execute(f"DELETE FROM job_signatures WHERE job_id IN ({marks})", chunk)
+
+            for old_id in orphaned:
+                cursor.execute(f'''
+                    SELECT job_id FROM job_signatures WHERE canonical_id = {p}
+                    ORDER BY created_at, job_id
+                    LIMIT 1
+                ''', (old_id,))
+                row = cursor.fetchone()
+                if row:
+                    cursor.execute(f"UPDATE job_signatures SET canonical_id = {p} WHERE canonical_id = {p}",
+                                   (row[0], old_id))
+                    delta -= 1
+
+        return delta
+
+    @staticmethod
+    def collapse_condition(column: str = 'job_id') -> str:
+        """只保留每群代表職缺（以及尚未計算簽章的職缺）的WHERE條件"""
+        return f'''NOT EXISTS (
+            SELECT 1 FROM job_signatures s
+            WHERE s.job_id = {column} AND s.canonical_id <> s.job_id
+        )'''
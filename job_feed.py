@@ -0,0 +1,426 @@
+"""
+新職缺即時推送模組
+insert_jobs完成後將新增或內容有變動的職缺（以job_history的內容雜湊比對）發布到JobFeed，
+由記憶體中的訂閱者依關鍵字、地區與公司篩選後推送
+（Server-Sent Events），不論連線數多少都不必為每個用戶端查詢資料庫；
+每個訂閱者的緩衝區有上限，消費太慢時丟棄最舊的職缺並通知用戶端重新載入
+
+多行程（例如多個gunicorn worker與排程器）時設定 store_path，發布的職缺寫入共用的SQLite檔案，
+每個行程只以一個背景執行緒讀取新的紀錄後分送給自己的訂閱者；
+大量的SSE連線由feed_server.py（asyncio，不為每個連線佔用執行緒）讀取同一個共用檔案推送
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from job_fields import FIELD_COLUMNS, project_jobs
+from job_history import content_hash
+
+logger = logging.getLogger(__name__)
+
+FEED_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS feed (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        payload TEXT NOT NULL,
+        published_at REAL NOT NULL
+    )
+'''
+
+# 已發布職缺的內容雜湊（多個行程共用，重複爬到內容相同的職缺不再推送）
+FEED_HASHES_SQL = '''
+    CREATE TABLE IF NOT EXISTS feed_hashes (
+        job_id TEXT PRIMARY KEY,
+        content_hash TEXT NOT NULL,
+        seen_at REAL NOT NULL
+    )
+'''
+
+# 104的地區代碼（area=可使用代碼或地址中的文字，例如「台北市」）
+AREA_NAMES = {
+    '6001001000': '台北市',
+    '6001002000': '新北市',
+    '6001003000': '桃園市',
+    '6001004000': '台中市',
+    '6001005000': '台南市',
+    '6001006000': '高雄市'
+}
+
+
+def to_columns(job: Dict) -> Dict:
+    """將爬蟲結果的職缺欄位（jobName）轉成資料表欄位（job_name），與其他API的回應格式一致"""
+    return {FIELD_COLUMNS.get(key, key): value for key, value in job.items()}
+
+
+class FeedFilter:
+    """訂閱條件（與search_jobs相同：職缺名稱與公司名稱包含關鍵字，不分大小寫）"""
+
+    def __init__(self, keyword: Optional[str] = None, area: Optional[str] = None,
+                 company: Optional[str] = None):
+        self.keyword = keyword.casefold() if keyword else None
+        self.area = AREA_NAMES.get(area, area) if area else None
+        self.company = company.casefold() if company else None
+
+    def matches(self, job: Dict) -> bool:
+        if self.keyword and self.keyword not in (job.get('job_name') or '').casefold():
+            return False
+        if self.company and self.company not in (job.get('cust_name') or '').casefold():
+            return False
+        if self.area and self.area not in (job.get('job_addr_no_desc') or ''):
+            return False
+        return True
+
+
+class Subscription:
+    """一個用戶端的訂閱：最多保留buffer_size筆尚未送出的職缺"""
+
+    def __init__(self, feed_filter: FeedFilter, buffer_size: int):
+        self.filter = feed_filter
+        self.buffer = deque(maxlen=buffer_size)
+        self.dropped = 0
+        self.closed = False
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def push(self, jobs: List[Dict]):
+        """加入符合條件的職缺（緩衝區已滿時丟棄最舊的）"""
+        matched = [job for job in jobs if self.filter.matches(job)]
+        if not matched:
+            return
+        with self._lock:
+            overflow = len(self.buffer) + len(matched) - self.buffer.maxlen
+            if overflow > 0:
+                self.dropped += overflow
+            self.buffer.extend(matched)
+        self._ready.set()
+
+    def take(self, timeout: float):
+        """
+        等待並取出緩衝區的職缺
+
+        Returns:
+            tuple: (職缺列表, 自上次取出後丟棄的筆數)；timeout秒內沒有新職缺時為 ([], 0)
+        """
+        self._ready.wait(timeout)
+        return self._drain()
+
+    def _drain(self):
+        with self._lock:
+            self._ready.clear()
+            jobs = list(self.buffer)
+            self.buffer.clear()
+            dropped, self.dropped = self.dropped, 0
+        return jobs, dropped
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+
+def format_events(jobs: List[Dict], dropped: int, fields: Optional[Tuple[str, ...]] = None,
+                  truncate: Optional[int] = None) -> str:
+    """
+    將一次取出的職缺轉成SSE訊息
+
+    Returns:
+        str: 丟棄職缺時的lagged事件、jobs事件；兩者都沒有時為保持連線的註解
+    """
+    events = []
+    if dropped:
+        events.append(f"event: lagged\ndata: {json.dumps({'dropped': dropped})}\n\n")
+    if jobs:
+        jobs = project_jobs(jobs, fields, truncate)
+        payload = json.dumps({"count": len(jobs), "data": jobs}, ensure_ascii=False, default=str)
+        events.append(f"event: jobs\ndata: {payload}\n\n")
+    return ''.join(events) or ": keep-alive\n\n"
+
+
+class FeedFull(Exception):
+    """訂閱者已達上限"""
+
+
+class JobFeed:
+    """
+    新職缺的發布與訂閱
+
+    使用方式：
+        feed.publish(jobs)                         # insert_jobs完成後呼叫（只推送新增或內容有變動的職缺）
+        subscription = feed.subscribe(FeedFilter(keyword='Python'))
+        for jobs, dropped in feed.iter_batches(subscription):
+            ...
+    """
+
+    def __init__(self, buffer_size: int = 200, max_subscribers: int = 1000,
+                 store_path: Optional[str] = None, poll_interval: float = 1.0,
+                 retention: float = 600.0, hash_retention: float = 7 * 86400,
+                 subscription_class=Subscription):
+        """
+        Args:
+            buffer_size: 每個訂閱者最多保留的未送出職缺數
+            max_subscribers: 訂閱者上限
+            store_path: 多個行程共用的SQLite檔案（None代表只推送本行程寫入的職缺）
+            poll_interval: 讀取共用檔案新紀錄的間隔秒數（本行程發布時立即讀取）
+            retention: 共用檔案中紀錄保留的秒數
+            hash_retention: 職缺的內容雜湊保留秒數（超過這段時間沒有再寫入的職缺，再次寫入時視為新職缺）
+            subscription_class: 訂閱者類別（feed_server.py使用asyncio版本）
+        """
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self.store_path = store_path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.hash_retention = hash_retention
+        self.subscription_class = subscription_class
+
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._hashes = OrderedDict()
+        self.published = 0
+        self.unchanged = 0
+
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._cursor = None
+        if store_path:
+            self._init_store()
+
+    # 訂閱
+
+    def subscribe(self, feed_filter: FeedFilter) -> Subscription:
+        """
+        新增訂閱者
+
+        Raises:
+            FeedFull: 訂閱者已達max_subscribers
+        """
+        subscription = self.subscription_class(feed_filter, self.buffer_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise FeedFull(f"即時推送的連線數已達上限（{self.max_subscribers}）")
+            self._subscribers.add(subscription)
+            if self.store_path and self._thread is None:
+                self._start_tail()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscription.close()
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def iter_batches(self, subscription: Subscription, heartbeat: float = 15.0) -> Iterator:
+        """
+        依序產出訂閱者收到的職缺，直到訂閱關閉
+
+        Yields:
+            tuple: (職缺列表, 丟棄的筆數)；超過heartbeat秒沒有新職缺時為 ([], 0)
+        """
+        while not subscription.closed and not self._stopping.is_set():
+            yield subscription.take(heartbeat)
+
+    # 發布
+
+    def publish(self, jobs: List[Dict]):
+        """
+        發布寫入的職缺（沒有設定store_path時直接分送給本行程的訂閱者）
+
+        只推送新增或內容雜湊與上次發布不同的職缺，重複爬到的相同職缺不會再推送給訂閱者
+        """
+        if not jobs:
+            return
+
+        if not self.store_path:
+            with self._lock:
+                changed = self._changed_locked(jobs, time.time())
+            self._count(len(jobs), changed)
+            if changed:
+                self._deliver([to_columns(job) for job in changed])
+            return
+
+        try:
+            conn = self._connect()
+            try:
+                now = time.time()
+                # 比對與更新雜湊在同一個寫入交易中，多個行程同時寫入同一筆職缺時只推送一次
+                conn.execute('BEGIN IMMEDIATE')
+                changed = self._changed_in_store(conn, jobs, now)
+                if changed:
+                    rows = [to_columns(job) for job in changed]
+                    conn.execute('INSERT INTO feed (payload, published_at) VALUES (?, ?)',
+                                 (json.dumps(rows, ensure_ascii=False, default=str), now))
+                conn.execute('DELETE FROM feed WHERE published_at < ?', (now - self.retention,))
+                conn.execute('DELETE FROM feed_hashes WHERE seen_at < ?', (now - self.hash_retention,))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"寫入職缺推送紀錄時發生錯誤: {e}")
+            return
+        self._count(len(jobs), changed)
+        if changed:
+            self._wake.set()
+
+    def _count(self, total: int, changed: List[Dict]):
+        with self._lock:
+            self.published += len(changed)
+            self.unchanged += total - len(changed)
+
+    def _changed_locked(self, jobs: List[Dict], now: float) -> List[Dict]:
+        """以本行程記憶體中的雜湊找出新增或內容有變動的職缺（呼叫時需持有鎖）"""
+        cutoff = now - self.hash_retention
+        while self._hashes and next(iter(self._hashes.values()))[1] < cutoff:
+            self._hashes.popitem(last=False)
+
+        changed = []
+        for job in jobs:
+            job_id = job.get('jobId')
+            digest = content_hash(job)
+            if not job_id or self._hashes.get(job_id, (None,))[0] != digest:
+                changed.append(job)
+            if job_id:
+                self._hashes[job_id] = (digest, now)
+                self._hashes.move_to_end(job_id)
+        return changed
+
+    @staticmethod
+    def _changed_in_store(conn: sqlite3.Connection, jobs: List[Dict], now: float) -> List[Dict]:
+        """以共用檔案中的雜湊找出新增或內容有變動的職缺，並記錄這次的雜湊"""
+        ids = list({job['jobId'] for job in jobs if job.get('jobId')})
+        latest = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            latest.update(conn.execute(
+                f"SELECT job_id, content_hash FROM feed_hashes WHERE job_id IN ({', '.join(['?'] * len(chunk))})",
+                chunk
+            ).fetchall())
+
+        changed = []
+        for job in jobs:
+            job_id = job.get('jobId')
+            if not job_id:
+                changed.append(job)
+                continue
+            digest = content_hash(job)
+            if latest.get(job_id) != digest:
+                # 同一批次中重複且內容相同的職缺只推送一次
+                changed.append(job)
+                latest[job_id] = digest
+
+        conn.executemany('INSERT OR REPLACE INTO feed_hashes (job_id, content_hash, seen_at) VALUES (?, ?, ?)',
+                         [(job_id, latest[job_id], now) for job_id in ids])
+        return changed
+
+    def _deliver(self, rows: List[Dict]):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push(rows)
+
+    # 多行程共用的紀錄
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.store_path, timeout=30)
+
+    def _init_store(self):
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(FEED_TABLE_SQL)
+            conn.execute(FEED_HASHES_SQL)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_feed_hashes_seen_at ON feed_hashes(seen_at)')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _start_tail(self):
+        """從目前最後一筆紀錄之後開始讀取（第一個訂閱者出現時呼叫，呼叫時需持有鎖）"""
+        conn = self._connect()
+        try:
+            self._cursor = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM feed').fetchone()[0]
+        finally:
+            conn.close()
+        self._thread = threading.Thread(target=self._tail, name='job-feed', daemon=True)
+        self._thread.start()
+
+    def _tail(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            with self._lock:
+                idle = not self._subscribers
+            if idle:
+                continue
+            try:
+                self._read_new()
+            except sqlite3.Error as e:
+                logger.warning(f"讀取職缺推送紀錄時發生錯誤: {e}")
+
+    def _read_new(self):
+        conn = self._connect()
+        try:
+            records = conn.execute('SELECT seq, payload FROM feed WHERE seq > ? ORDER BY seq',
+                                   (self._cursor,)).fetchall()
+        finally:
+            conn.close()
+        for seq, payload in records:
+            self._cursor = seq
+            self._deliver(json.loads(payload))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            subscribers = len(self._subscribers)
+        return {
+            'subscribers': subscribers,
+            'published': self.published,
+            'unchanged': self.unchanged,
+            'shared': bool(self.store_path)
+        }
+
+    def close(self):
+        """關閉所有訂閱並停止讀取共用紀錄"""
+        self._stopping.set()
+        self._wake.set()
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self._subscribers.clear()
+        for subscription in subscribers:
+            subscription.close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+class FeedPublishingDatabase:
+    """insert_jobs成功後將新增或內容有變動的職缺發布到JobFeed的資料庫包裝，其他方法直接轉交"""
+
+    def __init__(self, db, feed: JobFeed):
+        self.db = db
+        self.feed = feed
+
+    def __getattr__(self, name: str):
+        return getattr(self.db, name)
+
+    def insert_jobs(self, jobs: List[Dict], *args, **kwargs):
+        result = self.db.insert_jobs(jobs, *args, **kwargs)
+        try:
+            self.feed.publish(self._written(jobs, result))
+        except Exception as e:  # 推送失敗不影響寫入
+            logger.warning(f"發布新職缺時發生錯誤: {e}")
+        return result
+
+    def _written(self, jobs: List[Dict], inserted) -> List[Dict]:
+        """
+        實際寫入的職缺
+
+        部分失敗時依資料庫的last_insert_report排除failed_rows中的職缺，
+        沒有成功寫入的職缺不會推送，也不會記錄內容雜湊而讓之後成功的寫入被視為沒有變動；
+        無法判斷哪些職缺失敗時不推送
+        """
+        if not isinstance(inserted, int) or inserted >= len(jobs):
+            return jobs
+        report = getattr(self.db, 'last_insert_report', None) or {}
+        failed = {row['job_id'] for row in report.get('failed_rows', [])}
+        return [job for job in jobs if job.get('jobId', '') not in failed] if failed else []
@@ -0,0 +1,127 @@
+"""
+職缺欄位投影模組
+將API的 fields= 參數轉成SELECT的欄位清單，只讀取需要的欄位；
+精簡模式在資料庫端截斷長文字欄位，減少讀取、序列化與傳輸的資料量
+"""
+
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 職缺欄位（爬蟲結果的鍵）與資料表欄位的對應
+FIELD_COLUMNS = {
+    'jobId': 'job_id',
+    'jobName': 'job_name',
+    'custName': 'cust_name',
+    'jobUrl': 'job_url',
+    'jobAddrNoDesc': 'job_addr_no_desc',
+    'salaryDesc': 'salary_desc',
+    'jobDetail': 'job_detail',
+    'appearDate': 'appear_date',
+    'jobCat': 'job_cat',
+    'jobType': 'job_type',
+    'workExp': 'work_exp',
+    'edu': 'edu',
+    'skill': 'skill',
+    'benefit': 'benefit',
+    'remoteWork': 'remote_work'
+}
+COLUMN_FIELDS = {column: field for field, column in FIELD_COLUMNS.items()}
+
+# 寫入jobs表格的欄位順序 (職缺欄位, 資料表欄位)，JobDatabase、非同步資料庫與D1共用
+JOB_FIELDS = list(FIELD_COLUMNS.items())
+
+# 可投影的jobs資料表欄位
+JOB_COLUMNS = ('id',) + tuple(FIELD_COLUMNS.values()) + ('created_at', 'updated_at')
+
+# 精簡模式截斷的長文字欄位
+LONG_TEXT_COLUMNS = ('job_detail', 'skill', 'benefit')
+
+# 精簡模式（compact=true）長文字欄位保留的字元數
+COMPACT_TEXT_LENGTH = int(os.getenv('COMPACT_TEXT_LENGTH', '200'))
+
+
+def parse_fields(value: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """
+    解析 fields= 參數
+
+    Args:
+        value: 逗號分隔的欄位名稱，可使用資料表欄位（job_name）或職缺欄位（jobName）
+
+    Returns:
+        Optional[Tuple[str, ...]]: 資料表欄位（依指定順序、去除重複）；未指定時為None
+
+    Raises:
+        ValueError: 包含不存在的欄位
+    """
+    if not value:
+        return None
+
+    columns = []
+    for name in value.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        column = FIELD_COLUMNS.get(name, name)
+        if column not in JOB_COLUMNS:
+            raise ValueError(f"不支援的欄位: {name}")
+        if column not in columns:
+            columns.append(column)
+    return tuple(columns) or None
+
+
+def select_list(fields: Optional[Iterable[str]] = None, truncate: Optional[int] = None) -> str:
+    """
+    SELECT子句的欄位清單
+
+    Args:
+        fields: 資料表欄位（None代表全部欄位）
+        truncate: 長文字欄位最多保留的字元數（None代表不截斷）
+
+    Returns:
+        str: 例如 "job_id, substr(job_detail, 1, 200) AS job_detail"；全部欄位且不截斷時為 "*"
+    """
+    if not fields and not truncate:
+        return '*'
+
+    parts = []
+    for column in fields or JOB_COLUMNS:
+        # 欄位名稱直接組進SQL，只接受白名單中的欄位
+        if column not in JOB_COLUMNS:
+            raise ValueError(f"不支援的欄位: {column}")
+        if truncate and column in LONG_TEXT_COLUMNS:
+            parts.append(f"substr({column}, 1, {int(truncate)}) AS {column}")
+        else:
+            parts.append(column)
+    return ', '.join(parts)
+
+
+def project_jobs(jobs: List[Dict], fields: Optional[Iterable[str]] = None,
+                 truncate: Optional[int] = None) -> List[Dict]:
+    """
+    對已在記憶體中的職缺（例如即時爬取的結果，鍵為職缺欄位）套用相同的投影與截斷
+
+    Args:
+        jobs: 職缺資料列表（鍵可為資料表欄位或職缺欄位）
+        fields: 資料表欄位（None代表全部欄位）
+        truncate: 長文字欄位最多保留的字元數
+
+    Returns:
+        List[Dict]: 新的職缺資料列表（不修改原本的職缺）
+    """
+    if not fields and not truncate:
+        return jobs
+
+    keys = None
+    if fields:
+        keys = [key for column in fields for key in (column, COLUMN_FIELDS.get(column)) if key]
+    long_keys = [key for column in LONG_TEXT_COLUMNS for key in (column, COLUMN_FIELDS[column])]
+
+    projected = []
+    for job in jobs:
+        row = {key: job[key] for key in keys if key in job} if keys is not None else dict(job)
+        if truncate:
+            for key in long_keys:
+                if isinstance(row.get(key), str):
+                    row[key] = row[key][:truncate]
+        projected.append(row)
+    return projected
@@ -0,0 +1,271 @@
+"""
+職缺觀測歷史模組
+每次爬取時為每筆職缺追加一筆觀測紀錄（只在內容變動時保存欄位值），
+並由壓縮任務把連續且內容相同的觀測合併為有效區間，供趨勢分析使用
+"""
+
+import hashlib
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+# 觀測紀錄追蹤的欄位（職缺欄位, 資料表欄位）
+TRACKED_FIELDS = [
+    ('jobName', 'job_name'),
+    ('custName', 'cust_name'),
+    ('salaryDesc', 'salary_desc'),
+    ('jobAddrNoDesc', 'job_addr_no_desc'),
+    ('jobCat', 'job_cat'),
+    ('remoteWork', 'remote_work')
+]
+
+
+def content_hash(job: Dict) -> str:
+    """計算追蹤欄位的內容雜湊"""
+    payload = '\x1f'.join(str(job.get(key) or '') for key, _ in TRACKED_FIELDS)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def as_datetime(value) -> datetime:
+    """將資料庫返回的時間值轉為datetime（SQLite為字串，PostgreSQL為datetime）"""
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+class JobHistoryTracker:
+    """
+    職缺觀測歷史追蹤器
+
+    job_observations 以 (job_id, keyword) 為一條觀測鏈：
+    - 每次爬取追加一列，valid_from = valid_to = 觀測時間
+    - 內容與該鏈上一筆相同時，追蹤欄位存為NULL，只保留雜湊
+    - compact() 把相鄰且雜湊相同的觀測合併為一列，valid_to延伸到最後一次觀測，
+      observation_count 累加被合併的觀測次數
+    """
+
+    def __init__(self, db_type: str = "sqlite"):
+        self.db_type = db_type
+        self.placeholder = '?' if db_type == "sqlite" else '%s'
+
+    def create_table(self, cursor):
+        """建立觀測歷史表格與索引"""
+        id_column = ("id INTEGER PRIMARY KEY AUTOINCREMENT" if self.db_type == "sqlite"
+                     else "id BIGSERIAL PRIMARY KEY")
+        columns = ',\n'.join(f"                {column} TEXT" for _, column in TRACKED_FIELDS)
+
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS job_observations (
+                {id_column},
+                job_id VARCHAR(255) NOT NULL,
+                keyword VARCHAR(255) NOT NULL DEFAULT '',
+                content_hash CHAR(40) NOT NULL,
+{columns},
+                valid_from TIMESTAMP NOT NULL,
+                valid_to TIMESTAMP NOT NULL,
+                observation_count INTEGER NOT NULL DEFAULT 1,
+                compacted INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+
+        # 觀測鏈查詢、區間查詢與待壓縮列查詢
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_obs_chain ON job_observations(job_id, keyword, valid_from)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_obs_keyword_interval ON job_observations(keyword, valid_to, valid_from)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_obs_interval ON job_observations(valid_to, valid_from)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_obs_compacted ON job_observations(compacted)')
+
+    def _latest_hashes(self, cursor, job_ids: List[str], keyword: str) -> Dict[str, str]:
+        """取得每條觀測鏈最後一筆的內容雜湊"""
+        latest = {}
+        p = self.placeholder
+
+        for start in range(0, len(job_ids), 500):
+            chunk = job_ids[start:start + 500]
+            marks = ', '.join([p] * len(chunk))
+            cursor.execute(f'''
+                SELECT job_id, content_hash, valid_to FROM job_observations
+                WHERE keyword = {p} AND job_id IN ({marks})
+            ''', [keyword] + chunk)
+
+            newest = {}
+            for job_id, digest, valid_to in cursor.fetchall():
+                valid_to = as_datetime(valid_to)
+                if job_id not in newest or valid_to >= newest[job_id]:
+                    newest[job_id] = valid_to
+                    latest[job_id] = digest
+
+        return latest
+
+    def record(self, cursor, jobs: List[Dict], keyword: Optional[str], observed_at: datetime) -> int:
+        """
+        追加一次爬取的觀測紀錄
+
+        Args:
+            cursor: 資料庫游標（與職缺寫入共用同一個交易）
+            jobs: 職缺資料列表
+            keyword: 爬取時使用的搜尋關鍵字
+            observed_at: 觀測時間
+
+        Returns:
+            int: 追加的觀測筆數
+        """
+        keyword = keyword or ''
+        by_id = {}
+        for job in jobs:
+            if job.get('jobId'):
+                by_id[job['jobId']] = job
+
+        if not by_id:
+            return 0
+
+        latest = self._latest_hashes(cursor, list(by_id), keyword)
+        rows = self.build_rows(by_id, keyword, latest, observed_at)
+
+        cursor.executemany(self.insert_sql([self.placeholder] * (len(TRACKED_FIELDS) + 5)), rows)
+        return len(rows)
+
+    @staticmethod
+    def build_rows(by_id: Dict[str, Dict], keyword: str, latest: Dict[str, str],
+                   observed_at: datetime) -> List[list]:
+        """依上一筆雜湊產生觀測列（內容未變動時追蹤欄位為NULL）"""
+        rows = []
+        for job_id, job in by_id.items():
+            digest = content_hash(job)
+            if latest.get(job_id) == digest:
+                # 內容沒有變動，只記錄這次觀測
+                values = [None] * len(TRACKED_FIELDS)
+            else:
+                values = [job.get(key, '') for key, _ in TRACKED_FIELDS]
+            rows.append([job_id, keyword, digest] + values + [observed_at, observed_at])
+        return rows
+
+    @staticmethod
+    def insert_sql(placeholders: List[str]) -> str:
+        """追加觀測列的SQL"""
+        field_columns = ', '.join(column for _, column in TRACKED_FIELDS)
+        return f'''
+            INSERT INTO job_observations (
+                job_id, keyword, content_hash, {field_columns}, valid_from, valid_to
+            ) VALUES ({', '.join(placeholders)})
+        '''
+
+    def compact(self, cursor, max_gap: timedelta = timedelta(days=2)) -> Dict:
+        """
+        把相鄰且內容相同的觀測合併為有效區間
+
+        Args:
+            cursor: 資料庫游標
+            max_gap: 兩次觀測間隔超過此值時視為職缺曾下架，不合併
+
+        Returns:
+            Dict: chains（處理的觀測鏈數）、merged（被合併刪除的列數）
+        """
+        cursor.execute('''
+            SELECT id, job_id, keyword, content_hash, valid_from, valid_to, observation_count
+            FROM job_observations
+            WHERE (job_id, keyword) IN (
+                SELECT job_id, keyword FROM job_observations WHERE compacted = 0
+            )
+            ORDER BY job_id, keyword, valid_from, id
+        ''')
+        rows = cursor.fetchall()
+
+        updates = []
+        deleted_ids = []
+        processed_ids = []
+        chains = set()
+        current = None
+
+        for row_id, job_id, keyword, digest, valid_from, valid_to, count in rows:
+            processed_ids.append(row_id)
+            chains.add((job_id, keyword))
+            valid_from, valid_to = as_datetime(valid_from), as_datetime(valid_to)
+
+            if (current is not None
+                    and current['chain'] == (job_id, keyword)
+                    and current['hash'] == digest
+                    and valid_from - current['valid_to'] <= max_gap):
+                current['valid_to'] = max(current['valid_to'], valid_to)
+                current['count'] += count
+                current['changed'] = True
+                deleted_ids.append(row_id)
+                continue
+
+            if current is not None and current['changed']:
+                updates.append((current['valid_to'], current['count'], current['id']))
+
+            current = {
+                'id': row_id, 'chain': (job_id, keyword), 'hash': digest,
+                'valid_to': valid_to, 'count': count, 'changed': False
+            }
+
+        if current is not None and current['changed']:
+            updates.append((current['valid_to'], current['count'], current['id']))
+
+        p = self.placeholder
+        if updates:
+            cursor.executemany(
+                f"UPDATE job_observations SET valid_to = {p}, observation_count = {p} WHERE id = {p}",
+                updates
+            )
+        if deleted_ids:
+            cursor.executemany(f"DELETE FROM job_observations WHERE id = {p}", [(i,) for i in deleted_ids])
+        if processed_ids:
+            cursor.executemany(
+                f"UPDATE job_observations SET compacted = 1 WHERE id = {p}",
+                [(i,) for i in processed_ids]
+            )
+
+        return {'chains': len(chains), 'merged': len(deleted_ids)}
+
+    def alive_per_day(self, cursor, keyword: Optional[str] = None, days: int = 30,
+                      end_date: Optional[date] = None) -> List[Dict]:
+        """
+        每日仍在架上的職缺數（依有效區間計算，使用區間索引）
+
+        Args:
+            keyword: 搜尋關鍵字；None 代表全部關鍵字
+            days: 天數
+            end_date: 最後一天（預設今天）
+
+        Returns:
+            List[Dict]: [{"date": "YYYY-MM-DD", "alive": 數量}]
+        """
+        end_date = end_date or date.today()
+        p = self.placeholder
+
+        if keyword is None:
+            sql = f'''
+                SELECT COUNT(DISTINCT job_id) FROM job_observations
+                WHERE valid_to >= {p} AND valid_from < {p}
+            '''
+        else:
+            sql = f'''
+                SELECT COUNT(DISTINCT job_id) FROM job_observations
+                WHERE keyword = {p} AND valid_to >= {p} AND valid_from < {p}
+            '''
+
+        series = []
+        for offset in range(days - 1, -1, -1):
+            day = end_date - timedelta(days=offset)
+            day_start = datetime.combine(day, datetime.min.time())
+            day_end = day_start + timedelta(days=1)
+
+            params = (day_start, day_end) if keyword is None else (keyword, day_start, day_end)
+            cursor.execute(sql, params)
+            series.append({'date': day.isoformat(), 'alive': cursor.fetchone()[0]})
+
+        return series
+
+    def timeline(self, cursor, job_id: str) -> List[Dict]:
+        """列出單一職缺的觀測區間（追蹤欄位為NULL代表與前一筆相同）"""
+        field_columns = ', '.join(column for _, column in TRACKED_FIELDS)
+        cursor.execute(f'''
+            SELECT keyword, {field_columns}, valid_from, valid_to, observation_count
+            FROM job_observations
+            WHERE job_id = {self.placeholder}
+            ORDER BY valid_from, id
+        ''', (job_id,))
+
+        columns = ['keyword'] + [column for _, column in TRACKED_FIELDS] + \
+            ['valid_from', 'valid_to', 'observation_count']
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
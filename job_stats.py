@@ -0,0 +1,374 @@
+"""
+職缺統計彙總模組
+在寫入與刪除職缺時增量維護每日、每關鍵字、每地區的計數，以及
+職類、公司、遠端工作的全期分面計數，
+讓統計查詢只需讀取預先計算好的數字，不必掃描整個jobs表格
+"""
+
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 全期總計使用的日期鍵
+ALL_TIME = ''
+
+# 統計維度
+DIM_TOTAL = 'total'
+DIM_AREA = 'area'
+DIM_KEYWORD = 'keyword'
+DIM_CATEGORY = 'category'
+DIM_COMPANY = 'company'
+DIM_REMOTE = 'remote'
+
+# 近似重複職缺數（非代表職缺的數量，只有全期總計），由job_dedup在寫入與刪除時提供增減量
+DIM_DUPLICATE = 'duplicate'
+
+# 只維護全期總計的分面維度與對應的jobs欄位（每日列的數量會隨公司數膨脹）
+FACET_COLUMNS = [
+    (DIM_CATEGORY, 'job_cat'),
+    (DIM_COMPANY, 'cust_name'),
+    (DIM_REMOTE, 'remote_work')
+]
+
+# 依地區細分的分面維度（dim_value為「地區 + SCOPE_SEPARATOR + 值」），讓選定地區後的分面也不必GROUP BY
+SCOPE_SEPARATOR = '\x1f'
+
+
+def area_scoped(dimension: str) -> str:
+    """依地區細分的分面維度名稱"""
+    return f"{dimension}_by_area"
+
+
+# 計算單筆職缺統計貢獻所需的欄位（count_row的row參數依此順序）
+STAT_COLUMNS = ', '.join(['created_at', 'job_addr_no_desc'] + [column for _, column in FACET_COLUMNS])
+
+# 統計結構版本，新增維度時遞增，舊資料庫會在初始化時重建
+STATS_VERSION = '2'
+DIM_VERSION = 'version'
+
+
+# 分面查詢的分組運算式（篩選時依此GROUP BY，欄位與地區運算式皆有索引）
+FACET_EXPRESSIONS = {
+    DIM_AREA: "substr(trim(job_addr_no_desc), 1, 3)",
+    DIM_CATEGORY: 'job_cat',
+    DIM_COMPANY: 'cust_name',
+    DIM_REMOTE: 'remote_work'
+}
+
+
+def facet_conditions(filters: Dict, placeholder: str, like: str = 'LIKE') -> Tuple[List[str], List]:
+    """
+    將分面篩選條件轉成WHERE條件
+
+    Args:
+        filters: 可包含 keyword（職缺名稱部分比對）、area（縣市，與統計相同取去除空白後的前三個字）、
+            category / company / remote（完全相同）
+        placeholder: 參數佔位符
+        like: 部分比對運算子（PostgreSQL使用ILIKE）
+
+    Returns:
+        Tuple[List[str], List]: 條件列表與參數
+    """
+    conditions = []
+    params = []
+    for key, value in filters.items():
+        if key == 'keyword':
+            conditions.append(f"job_name {like} {placeholder}")
+            params.append(f"%{value}%")
+        elif key == DIM_AREA:
+            # 與area_of及預先計算的地區計數使用相同的運算式（有運算式索引）
+            conditions.append(f"{FACET_EXPRESSIONS[DIM_AREA]} = {placeholder}")
+            params.append(area_of(value))
+        elif key in FACET_EXPRESSIONS:
+            conditions.append(f"{FACET_EXPRESSIONS[key]} = {placeholder}")
+            params.append(str(value))
+    return conditions, params
+
+
+def facet_group_sql(dimension: str, conditions: List[str], limit: int) -> str:
+    """依單一分面分組計數的SQL"""
+    expression = FACET_EXPRESSIONS[dimension]
+    where_clause = " AND ".join(conditions + [f"{expression} <> ''"])
+    return f'''
+        SELECT {expression} AS value, COUNT(*) AS count FROM jobs
+        WHERE {where_clause}
+        GROUP BY {expression}
+        ORDER BY count DESC
+        LIMIT {int(limit)}
+    '''
+
+
+def area_of(addr: Optional[str]) -> str:
+    """從工作地址取出縣市（例如「台北市信義區」→「台北市」）"""
+    return (addr or '').strip()[:3]
+
+
+def stat_day(value) -> str:
+    """將created_at/updated_at轉成YYYY-MM-DD字串"""
+    return str(value)[:10] if value else ''
+
+
+class JobStatsTracker:
+    """
+    職缺統計追蹤器
+
+    統計表格以 (stat_date, dimension, dim_value) 為主鍵：
+    - total / area 維度為「目前仍存在」的職缺數，依created_at的日期分組，
+      寫入與刪除時同步加減
+    - keyword 維度為每日依搜尋關鍵字存入的職缺數（寫入計數，刪除時不扣除，
+      因為jobs表格未記錄職缺是由哪個關鍵字爬取）
+    - category / company / remote 維度為目前仍存在的職缺數，只保存全期總計；
+      另以 *_by_area 維度保存各地區內的分面計數
+    stat_date 為空字串的列是該維度的全期總計
+    """
+
+    def __init__(self, db_type: str = "sqlite"):
+        self.db_type = db_type
+        self.placeholder = '?' if db_type == "sqlite" else '%s'
+
+    def create_table(self, cursor):
+        """建立統計表格"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS job_stats (
+                stat_date VARCHAR(10) NOT NULL,
+                dimension VARCHAR(20) NOT NULL,
+                dim_value TEXT NOT NULL,
+                job_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (stat_date, dimension, dim_value)
+            )
+        ''')
+        if self.db_type == "postgresql":
+            # 依地區細分的分面值（地區 + 分隔字元 + 公司名稱）可能超過原本的VARCHAR(255)；
+            # VARCHAR轉TEXT不需要重寫資料表，已是TEXT時沒有作用
+            cursor.execute("ALTER TABLE job_stats ALTER COLUMN dim_value TYPE TEXT")
+
+    def is_initialized(self, cursor) -> bool:
+        """檢查目前版本的標記列是否存在（不存在代表需要重建）"""
+        p = self.placeholder
+        cursor.execute(
+            f"SELECT 1 FROM job_stats WHERE stat_date = {p} AND dimension = {p} AND dim_value = {p}",
+            (ALL_TIME, DIM_VERSION, STATS_VERSION)
+        )
+        return cursor.fetchone() is not None
+
+    def snapshot(self, cursor, job_ids: Iterable[str]) -> Counter:
+        """
+        取得指定職缺目前對統計的貢獻
+
+        Args:
+            cursor: 資料庫游標
+            job_ids: 職缺ID列表
+
+        Returns:
+            Counter: {(stat_date, dimension, dim_value): 數量}
+        """
+        contribution = Counter()
+        ids = list(dict.fromkeys(job_ids))
+
+        # SQLite 預設最多 999 個參數，分批查詢
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            marks = ', '.join([self.placeholder] * len(chunk))
+            cursor.execute(
+                f"SELECT {STAT_COLUMNS} FROM jobs WHERE job_id IN ({marks})",
+                chunk
+            )
+            for row in cursor.fetchall():
+                self.count_row(contribution, row)
+
+        return contribution
+
+    def snapshot_where(self, cursor, where_clause: str, params: List = None,
+                       table: str = 'jobs') -> Counter:
+        """取得符合條件的職缺目前對統計的貢獻（在資料庫端依日期與統計欄位彙總）"""
+        day_expr = "date(created_at)" if self.db_type == "sqlite" else "CAST(created_at AS DATE)"
+        group_columns = STAT_COLUMNS.replace('created_at', day_expr, 1)
+        contribution = Counter()
+        cursor.execute(f'''
+            SELECT {group_columns}, COUNT(*) FROM {table}
+            WHERE {where_clause}
+            GROUP BY {group_columns}
+        ''', params or [])
+        for row in cursor.fetchall():
+            self.count_row(contribution, row[:-1], weight=row[-1])
+        return contribution
+
+    @staticmethod
+    def count_row(contribution: Counter, row, weight: int = 1):
+        """
+        將單筆職缺計入統計
+
+        Args:
+            contribution: 累加的計數
+            row: 依STAT_COLUMNS順序的欄位值
+            weight: 權重（刪除時為負數）
+        """
+        day = stat_day(row[0])
+        area = area_of(row[1])
+        contribution[(day, DIM_TOTAL, '')] += weight
+        contribution[(day, DIM_AREA, area)] += weight
+
+        for (dimension, _), value in zip(FACET_COLUMNS, row[2:]):
+            if value:
+                contribution[(ALL_TIME, dimension, str(value))] += weight
+                contribution[(ALL_TIME, area_scoped(dimension), f"{area}{SCOPE_SEPARATOR}{value}")] += weight
+
+    @staticmethod
+    def keyword_delta(keyword: Optional[str], day: str, count: int) -> Counter:
+        """產生關鍵字寫入計數"""
+        delta = Counter()
+        if keyword and count:
+            delta[(day, DIM_KEYWORD, keyword)] += count
+        return delta
+
+    @classmethod
+    def write_delta(cls, before: Counter, after: Counter, keyword: Optional[str], written_at,
+                    written: int, duplicate_delta: int) -> Counter:
+        """
+        一批寫入對統計的增量（同步與非同步的insert_jobs共用）
+
+        Args:
+            before: 寫入前這批職缺對統計的貢獻（snapshot）
+            after: 寫入後的貢獻
+            keyword: 爬取時使用的搜尋關鍵字
+            written_at: 寫入時間
+            written: 成功寫入的筆數（關鍵字寫入計數）
+            duplicate_delta: 近似重複歸群產生的重複職缺數增減量
+
+        Returns:
+            Counter: {(stat_date, dimension, dim_value): 增減量}
+        """
+        delta = Counter(after)
+        delta.subtract(before)
+        delta.update(cls.keyword_delta(keyword, stat_day(written_at), written))
+        delta[(ALL_TIME, DIM_DUPLICATE, '')] += duplicate_delta
+        return delta
+
+    @staticmethod
+    def merge(delta: Counter) -> List[tuple]:
+        """將增量展開為每日列與全期總計列的 (stat_date, dimension, dim_value, 增減量)"""
+        merged = Counter()
+        for (day, dimension, value), amount in delta.items():
+            if not amount:
+                continue
+            merged[(day, dimension, value)] += amount
+            if day != ALL_TIME:
+                merged[(ALL_TIME, dimension, value)] += amount
+
+        return [key + (amount,) for key, amount in merged.items() if amount]
+
+    @staticmethod
+    def upsert_sql(placeholders: List[str]) -> str:
+        """累加統計列的SQL（placeholders為四個參數佔位符）"""
+        return f'''
+            INSERT INTO job_stats (stat_date, dimension, dim_value, job_count)
+            VALUES ({', '.join(placeholders)})
+            ON CONFLICT (stat_date, dimension, dim_value)
+            DO UPDATE SET job_count = job_stats.job_count + excluded.job_count
+        '''
+
+    def apply(self, cursor, delta: Counter):
+        """
+        將增量套用到統計表格（同時更新每日列與全期總計列）
+
+        Args:
+            cursor: 資料庫游標（與職缺寫入共用同一個交易）
+            delta: {(stat_date, dimension, dim_value): 增減量}
+        """
+        rows = self.merge(delta)
+        if rows:
+            cursor.executemany(self.upsert_sql([self.placeholder] * 4), rows)
+
+    def rebuild(self, cursor):
+        """從jobs表格重建 total / area / 分面統計（關鍵字寫入計數無法重建，予以保留）"""
+        p = self.placeholder
+        rebuilt = [DIM_TOTAL, DIM_AREA, DIM_VERSION]
+        for dimension, _ in FACET_COLUMNS:
+            rebuilt += [dimension, area_scoped(dimension)]
+        cursor.execute(
+            f"DELETE FROM job_stats WHERE dimension IN ({', '.join([p] * len(rebuilt))})",
+            rebuilt
+        )
+
+        contribution = self.snapshot_where(cursor, "1=1")
+        self.apply(cursor, contribution)
+
+        # 即使沒有任何職缺，也寫入全期總計列與版本標記列
+        cursor.executemany(f'''
+            INSERT INTO job_stats (stat_date, dimension, dim_value, job_count)
+            VALUES ({p}, {p}, {p}, 0)
+            ON CONFLICT (stat_date, dimension, dim_value) DO NOTHING
+        ''', [(ALL_TIME, DIM_TOTAL, ''), (ALL_TIME, DIM_VERSION, STATS_VERSION)])
+
+    def _cutoff_expr(self) -> str:
+        """最近N天的起始日期（與created_at使用相同時區）"""
+        if self.db_type == "sqlite":
+            return f"date('now', '-' || {self.placeholder} || ' days')"
+        return f"to_char(CURRENT_DATE - {self.placeholder}::integer, 'YYYY-MM-DD')"
+
+    def get_count(self, cursor, dimension: str = DIM_TOTAL, dim_value: str = '',
+                  stat_date: str = ALL_TIME) -> int:
+        """讀取單一預先計算的計數"""
+        p = self.placeholder
+        cursor.execute(
+            f"SELECT job_count FROM job_stats WHERE stat_date = {p} AND dimension = {p} AND dim_value = {p}",
+            (stat_date, dimension, dim_value)
+        )
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def get_recent_count(self, cursor, days: int) -> int:
+        """最近N天（以日為粒度）新增且仍存在的職缺數"""
+        p = self.placeholder
+        cursor.execute(f'''
+            SELECT COALESCE(SUM(job_count), 0) FROM job_stats
+            WHERE dimension = {p} AND dim_value = {p}
+              AND stat_date <> {p} AND stat_date >= {self._cutoff_expr()}
+        ''', (DIM_TOTAL, '', ALL_TIME, days))
+        return int(cursor.fetchone()[0])
+
+    def get_breakdown(self, cursor, dimension: str, days: Optional[int] = None,
+                      limit: int = 50) -> List[Dict]:
+        """
+        依維度列出計數
+
+        Args:
+            dimension: "area"、"keyword"，或分面維度 "category"、"company"、"remote"
+            days: 只統計最近N天；None 代表全期總計（分面維度只有全期總計）
+            limit: 最多返回幾項
+
+        Returns:
+            List[Dict]: [{"value": ..., "count": ...}]，依數量遞減排序
+        """
+        p = self.placeholder
+        if days is None:
+            cursor.execute(f'''
+                SELECT dim_value, job_count FROM job_stats
+                WHERE dimension = {p} AND stat_date = {p} AND job_count > 0
+                ORDER BY job_count DESC
+                LIMIT {int(limit)}
+            ''', (dimension, ALL_TIME))
+        else:
+            cursor.execute(f'''
+                SELECT dim_value, SUM(job_count) AS total FROM job_stats
+                WHERE dimension = {p} AND stat_date <> {p} AND stat_date >= {self._cutoff_expr()}
+                GROUP BY dim_value
+                HAVING SUM(job_count) > 0
+                ORDER BY total DESC
+                LIMIT {int(limit)}
+            ''', (dimension, ALL_TIME, days))
+
+        return [{'value': value, 'count': int(count)} for value, count in cursor.fetchall()]
+
+    def get_area_breakdown(self, cursor, dimension: str, area: str, limit: int = 50) -> List[Dict]:
+        """列出單一地區內的分面計數（讀取該維度的全期總計列，以前綴比對地區，不受定序影響）"""
+        p = self.placeholder
+        prefix = f"{area}{SCOPE_SEPARATOR}"
+        cursor.execute(f'''
+            SELECT dim_value, job_count FROM job_stats
+            WHERE stat_date = {p} AND dimension = {p}
+              AND substr(dim_value, 1, {len(prefix)}) = {p} AND job_count > 0
+            ORDER BY job_count DESC
+            LIMIT {int(limit)}
+        ''', (ALL_TIME, area_scoped(dimension), prefix))
+
+        return [{'value': value[len(prefix):], 'count': int(count)} for value, count in cursor.fetchall()]
@@ -0,0 +1,147 @@
+"""
+本機D1 HTTP API替身
+以SQLite實作Cloudflare D1的 POST .../query 端點，回應格式與CloudflareD1Database解析的格式相同，
+並可設定每個請求的延遲來模擬到Cloudflare的往返時間。
+用於測試與效能比較，不需要Cloudflare帳號：
+
+    python local_d1.py --port 8787 --latency 0.05
+    D1_API_BASE_URL=http://127.0.0.1:8787 DB_TYPE=d1 python app.py
+"""
+
+import argparse
+import json
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# D1每個查詢最多可綁定的參數數量
+D1_MAX_PARAMS = 100
+
+
+class LocalD1Server:
+    """在背景執行緒中執行的D1 HTTP API替身"""
+
+    def __init__(self, db_path: str = ':memory:', latency: float = 0.0,
+                 host: str = '127.0.0.1', port: int = 0, max_params: int = D1_MAX_PARAMS):
+        """
+        初始化替身伺服器
+
+        Args:
+            db_path: SQLite資料庫檔案路徑
+            latency: 每個請求額外等待的秒數（模擬網路往返時間）
+            host: 監聽位址
+            port: 監聽埠號（0代表自動選擇）
+            max_params: 每個查詢的參數上限，超過時與D1一樣返回錯誤
+        """
+        self.latency = latency
+        self.max_params = max_params
+        self.request_count = 0
+        # 接下來fail_next個請求以fail_status回應（429時附上Retry-After: retry_after）
+        self.fail_next = 0
+        self.fail_status = 503
+        self.retry_after = None
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._count_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """CloudflareD1Database可使用的base_url"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'LocalD1Server':
+        """在背景執行緒啟動伺服器"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止伺服器並關閉資料庫"""
+        self._server.shutdown()
+        self._server.server_close()
+        self._conn.close()
+
+    def execute(self, sql: str, params: list) -> dict:
+        """執行單一SQL語句，返回D1格式的結果"""
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            columns = [description[0] for description in cursor.description or []]
+            rows = cursor.fetchall()
+            self._conn.commit()
+
+        return {
+            'columns': columns,
+            'results': [{'values': list(row)} for row in rows],
+            'meta': {'changes': cursor.rowcount}
+        }
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                with server._count_lock:
+                    server.request_count += 1
+                if server.latency:
+                    time.sleep(server.latency)
+
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                params = payload.get('params') or []
+
+                with server._count_lock:
+                    failing = server.fail_next > 0
+                    if failing:
+                        server.fail_next -= 1
+
+                if failing:
+                    # 模擬D1暫時無法使用或速率限制
+                    headers = {}
+                    if server.fail_status == 429 and server.retry_after is not None:
+                        headers['Retry-After'] = str(server.retry_after)
+                    self._reply(server.fail_status,
+                                {'success': False, 'errors': [{'message': 'temporarily unavailable'}]},
+                                headers)
+                elif len(params) > server.max_params:
+                    self._reply(400, {'success': False, 'errors': [{'message': 'too many SQL variables'}]})
+                else:
+                    try:
+                        result = server.execute(payload.get('sql', ''), params)
+                        self._reply(200, {'success': True, 'result': result})
+                    except sqlite3.Error as e:
+                        self._reply(400, {'success': False, 'errors': [{'message': str(e)}]})
+
+            def _reply(self, status: int, body: dict, headers: dict = None):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本機D1 HTTP API替身')
+    parser.add_argument('--db', default='local_d1.db', help='SQLite資料庫檔案路徑')
+    parser.add_argument('--port', type=int, default=8787, help='監聽埠號')
+    parser.add_argument('--latency', type=float, default=0.0, help='每個請求的模擬延遲秒數')
+    args = parser.parse_args()
+
+    local = LocalD1Server(args.db, latency=args.latency, port=args.port)
+    print(f"D1替身伺服器啟動於 {local.url}")
+    try:
+        local._server.serve_forever()
+    except KeyboardInterrupt:
+        local.stop()
@@ -0,0 +1,426 @@
+"""
+行程內指標模組
+以Prometheus文字格式匯出計數器、量測值與延遲直方圖（不需要prometheus_client）：
+API端點延遲、爬蟲每頁延遲與錯誤、爬蟲排隊數、爬取/寫入職缺數、資料庫方法耗時、D1往返時間、排程任務耗時
+
+多行程（例如多個gunicorn worker）時設定 METRICS_DIR，每個行程定期將指標寫入該目錄，
+/metrics 合併所有行程的數值後輸出
+"""
+
+import glob
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from profiling import record_phase
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+INF_LABEL = 'le="+Inf"'
+
+# 延遲直方圖的預設區間（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    """指標的共同部分：名稱、說明與標籤"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 的標籤必須是 {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self) -> Dict:
+        """可序列化的指標內容（多行程合併使用）"""
+        with self._lock:
+            values = [[list(key), value] for key, value in self._values.items()]
+        return {'kind': self.kind, 'help': self.help, 'labelnames': list(self.labelnames), 'values': values}
+
+
+class Counter(Metric):
+    """只增不減的計數器"""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(Metric):
+    """可增可減的量測值（例如佇列長度）"""
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+
+class Histogram(Metric):
+    """延遲直方圖（各區間的累計次數、總和與次數）"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """記錄區塊的執行秒數（發生例外時也記錄）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry[2] if entry else 0
+
+    def snapshot(self) -> Dict:
+        report = super().snapshot()
+        report['buckets'] = list(self.buckets)
+        report['values'] = [[key, [list(entry[0]), entry[1], entry[2]]] for key, entry in report['values']]
+        return report
+
+
+def _pid_alive(pid: int) -> bool:
+    """行程是否仍在執行（以signal 0確認，不會送出訊號）"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(snapshots: List[Dict]) -> Dict:
+    """合併多個行程的指標（計數器、直方圖與量測值都相加）"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, dict(metric, values={}))
+            for labels, value in metric['values']:
+                key = tuple(labels)
+                current = target['values'].get(key)
+                if metric['kind'] == 'histogram':
+                    if current is None or len(current[0]) != len(value[0]):
+                        target['values'][key] = [list(value[0]), value[1], value[2]]
+                    else:
+                        current[0] = [a + b for a, b in zip(current[0], value[0])]
+                        current[1] += value[1]
+                        current[2] += value[2]
+                else:
+                    target['values'][key] = (current or 0.0) + value
+    return merged
+
+
+def _render(metrics: Dict) -> str:
+    lines = []
+    for name in sorted(metrics):
+        metric = metrics[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        labelnames = metric['labelnames']
+
+        for labels, value in sorted(metric['values'].items()):
+            if metric['kind'] != 'histogram':
+                lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_number(value)}")
+                continue
+
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(metric['buckets'], counts):
+                cumulative += bucket_count
+                le = f'le="{_format_number(bound)}"'
+                lines.append(f"{name}_bucket{_format_labels(labelnames, labels, le)} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labelnames, labels, INF_LABEL)} {count}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {_format_number(total)}")
+            lines.append(f"{name}_count{_format_labels(labelnames, labels)} {count}")
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsRegistry:
+    """指標登錄表"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.directory = None
+        self._dump_thread = None
+        self._stopping = threading.Event()
+
+    def _register(self, cls, name: str, help_text: str, labelnames: Sequence[str], **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"指標 {name} 已以不同的類型或標籤登錄")
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, help_text, labelnames)
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def enable_multiprocess(self, directory: str, interval: float = 5.0):
+        """
+        每interval秒將本行程的指標寫入 directory/<pid>.json，render()合併目錄中所有行程的指標
+        （已結束的行程只合併計數器與直方圖，不合併量測值）
+
+        Args:
+            directory: 共用的指標目錄（伺服器啟動時應清空）
+            interval: 寫入間隔秒數
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._stopping.clear()
+        self._dump_thread = threading.Thread(target=self._dump_loop, args=(interval,),
+                                             name='metrics-dump', daemon=True)
+        self._dump_thread.start()
+
+    def _dump_loop(self, interval: float):
+        while not self._stopping.wait(interval):
+            self.dump()
+
+    def dump(self):
+        """將本行程的指標寫入共用目錄"""
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        temp_path = f"{path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"寫入指標檔案時發生錯誤: {e}")
+
+    def _load_all(self) -> List[Dict]:
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            pid = os.path.splitext(os.path.basename(path))[0]
+            if pid.isdigit() and not _pid_alive(int(pid)):
+                # 已結束的worker：計數器與直方圖保留（合計不會倒退），量測值已不代表目前狀態
+                snapshot = {name: metric for name, metric in snapshot.items() if metric['kind'] != 'gauge'}
+            snapshots.append(snapshot)
+        return snapshots
+
+    def render(self) -> str:
+        """Prometheus文字格式（多行程模式時合併所有行程）"""
+        if self.directory:
+            self.dump()
+            return _render(_merge(self._load_all()))
+        return _render(_merge([self.snapshot()]))
+
+    def close(self):
+        """停止定期寫入並寫入最後一次"""
+        self._stopping.set()
+        self.dump()
+
+
+REGISTRY = MetricsRegistry()
+
+# API
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'http_request_duration_seconds', 'API請求處理時間', ('endpoint', 'method', 'status'))
+
+# 爬蟲
+SCRAPE_PAGE_SECONDS = REGISTRY.histogram(
+    'scrape_page_duration_seconds', '爬取一頁職缺（請求與解析）的時間', ('status',))
+SCRAPE_PAGE_ERRORS = REGISTRY.counter(
+    'scrape_page_errors_total', '爬取失敗的頁數', ('reason',))
+JOBS_SCRAPED = REGISTRY.counter(
+    'jobs_scraped_total', '爬取到的職缺數')
+JOBS_INSERTED = REGISTRY.counter(
+    'jobs_inserted_total', '寫入資料庫的職缺數', ('backend',))
+SCRAPE_QUEUE_DEPTH = REGISTRY.gauge(
+    'scrape_queue_depth', '已受理、等待執行名額的爬蟲任務數')
+SCRAPES_RUNNING = REGISTRY.gauge(
+    'scrapes_running', '執行中的爬蟲任務數')
+SCRAPE_ADMISSION_REJECTED = REGISTRY.counter(
+    'scrape_admission_rejected_total', '被拒絕的爬蟲請求數', ('reason',))
+
+# 資料庫
+DB_METHOD_SECONDS = REGISTRY.histogram(
+    'db_method_duration_seconds', '資料庫方法的執行時間', ('backend', 'method'))
+DB_METHOD_ERRORS = REGISTRY.counter(
+    'db_method_errors_total', '資料庫方法拋出例外的次數', ('backend', 'method'))
+D1_REQUEST_SECONDS = REGISTRY.histogram(
+    'd1_request_duration_seconds', 'D1 HTTP API往返時間（含重試）', ('kind', 'outcome'))
+D1_RETRIES = REGISTRY.counter(
+    'd1_retries_total', 'D1請求的重試次數', ('kind',))
+
+# 排程器
+SCHEDULER_TASK_SECONDS = REGISTRY.histogram(
+    'scheduler_task_duration_seconds', '排程任務的執行時間', ('task',),
+    buckets=(1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0))
+
+# 資料庫包裝不計時的方法（連線取得、串流生成器、關閉）
+UNTIMED_METHODS = ('get_connection', 'get_read_connection', 'iter_jobs', 'close')
+
+
+class InstrumentedDatabase:
+    """
+    記錄每個資料庫方法執行時間的包裝
+
+    - 公開方法的耗時記錄在 db_method_duration_seconds{backend, method}，例外記錄在 db_method_errors_total
+    - insert_jobs的返回值累加到 jobs_inserted_total
+    - 耗時同時累加到目前請求的db階段（慢請求記錄使用）
+    - 生成器方法與UNTIMED_METHODS直接轉交（只會量到建立生成器的時間）
+    """
+
+    def __init__(self, db, backend: str):
+        """
+        Args:
+            db: JobDatabase、CloudflareD1Database或其包裝
+            backend: 標籤中的資料庫類型（sqlite、postgresql、d1）
+        """
+        self.db = db
+        self.backend = backend
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.db, name)
+        if (name.startswith('_') or name in UNTIMED_METHODS or not callable(attr)
+                or inspect.isgeneratorfunction(attr)):
+            return attr
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                DB_METHOD_ERRORS.inc(backend=self.backend, method=name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                DB_METHOD_SECONDS.observe(elapsed, backend=self.backend, method=name)
+                record_phase('db', elapsed)
+            if name == 'insert_jobs' and isinstance(result, int):
+                JOBS_INSERTED.inc(result, backend=self.backend)
+            return result
+
+        return timed
+
+
+def start_http_server(port: int, host: str = '0.0.0.0',
+                      registry: Optional[MetricsRegistry] = None) -> ThreadingHTTPServer:
+    """
+    在背景執行緒提供 GET /metrics（沒有Web伺服器的行程使用，例如排程器）
+
+    Args:
+        port: 監聽埠號
+        host: 監聽位址
+        registry: 指標登錄表（預設為REGISTRY）
+
+    Returns:
+        ThreadingHTTPServer: 伺服器（shutdown()停止）
+    """
+    registry = registry or REGISTRY
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
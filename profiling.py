@@ -0,0 +1,280 @@
+"""
+請求剖析模組
+- 每個請求依階段（資料庫、即時爬蟲、JSON序列化、壓縮）累計耗時，超過門檻的慢請求記錄各階段的分解
+- 設定 PROFILE_TOKEN 後，帶有正確權杖與剖析旗標的請求以cProfile或取樣方式剖析，
+  結果存成可下載的檔案（cProfile為pstats格式，可用snakeviz開啟；取樣為flamegraph.pl的collapsed格式）
+"""
+
+import contextvars
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 剖析方式與對應的檔案副檔名
+PROFILE_MODES = {
+    'cprofile': '.prof',
+    'sample': '.collapsed'
+}
+
+_current = contextvars.ContextVar('request_phases', default=None)
+
+
+def record_phase(name: str, seconds: float):
+    """將耗時累加到目前請求的階段（不在請求中時不做任何事）"""
+    phases = _current.get()
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name: str):
+    """計算區塊的耗時並累加到目前請求的階段"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - started)
+
+
+class StackSampler:
+    """
+    取樣剖析器：背景執行緒每隔interval秒記錄目標執行緒的呼叫堆疊
+
+    開銷與被剖析的程式碼無關（cProfile會拖慢函數呼叫密集的程式碼），適合看時間花在哪裡
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """flamegraph.pl / speedscope可讀取的collapsed格式（每行「堆疊 次數」）"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class RequestProfiler:
+    """
+    請求剖析與慢請求記錄（由Flask的before_request / after_request呼叫）
+
+    使用方式：
+        start(token, mode)：請求開始，token/mode為請求帶的剖析權杖與方式（沒有時為None）
+        finish(method, path, status)：請求結束，返回剖析結果的ID（沒有剖析時為None）
+        discard()：請求因例外中止時停止剖析
+    """
+
+    def __init__(self, directory: str = 'profiles', token: Optional[str] = None,
+                 slow_threshold: float = 1.0, max_files: int = 50,
+                 sample_interval: float = 0.005):
+        """
+        Args:
+            directory: 剖析結果的儲存目錄
+            token: 允許剖析的權杖（None代表停用剖析，只記錄慢請求）
+            slow_threshold: 慢請求的秒數門檻（0代表不記錄）
+            max_files: 最多保留的剖析結果數量（超過時刪除最舊的）
+            sample_interval: 取樣剖析的間隔秒數
+        """
+        self.directory = directory
+        self.token = token
+        self.slow_threshold = slow_threshold
+        self.max_files = max_files
+        self.sample_interval = sample_interval
+        # cProfile同一時間只能剖析一個請求（Python 3.12起同時啟用會拋出例外），忙碌時略過
+        self._profile_lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token)
+
+    def authorized(self, token: Optional[str]) -> bool:
+        """權杖是否正確（未設定PROFILE_TOKEN時一律拒絕）"""
+        if not self.token or not token:
+            return False
+        return hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8'))
+
+    def start(self, token: Optional[str] = None, mode: Optional[str] = None) -> Optional[str]:
+        """
+        開始記錄請求的階段耗時，權杖正確時同時開始剖析
+
+        Returns:
+            Optional[str]: 剖析狀態（started、busy、unauthorized、invalid_mode）；沒有要求剖析時為None
+        """
+        local = self._local
+        local.started = time.perf_counter()
+        local.phases = {}
+        local.context_token = _current.set(local.phases)
+        local.profiler = local.sampler = None
+        local.mode = None
+
+        if mode is None:
+            return None
+        if not self.authorized(token):
+            return 'unauthorized'
+        if mode not in PROFILE_MODES:
+            return 'invalid_mode'
+        if not self._profile_lock.acquire(blocking=False):
+            return 'busy'
+
+        local.mode = mode
+        if mode == 'cprofile':
+            local.profiler = cProfile.Profile()
+            local.profiler.enable()
+        else:
+            local.sampler = StackSampler(threading.get_ident(), self.sample_interval)
+            local.sampler.start()
+        return 'started'
+
+    def _stop_profiling(self):
+        local = self._local
+        if local.profiler is not None:
+            local.profiler.disable()
+        if local.sampler is not None:
+            local.sampler.stop()
+        if local.mode is not None:
+            self._profile_lock.release()
+
+    def finish(self, method: str, path: str, status: int) -> Optional[str]:
+        """
+        結束請求：停止剖析並儲存結果，超過門檻時記錄慢請求
+
+        Returns:
+            Optional[str]: 剖析結果的ID（沒有剖析時為None）
+        """
+        local = self._local
+        if getattr(local, 'phases', None) is None:
+            return None
+
+        self._stop_profiling()
+        elapsed = time.perf_counter() - local.started
+        phases = local.phases
+        _current.reset(local.context_token)
+        local.phases = None
+
+        profile_id = None
+        if local.mode is not None:
+            try:
+                profile_id = self._save(local)
+            except Exception as e:
+                logger.error(f"儲存剖析結果時發生錯誤: {e}")
+
+        if self.slow_threshold and elapsed >= self.slow_threshold:
+            logger.warning(f"慢請求 {method} {path} {status} {elapsed * 1000:.1f}ms "
+                           f"{format_phases(phases, elapsed)}")
+        return profile_id
+
+    def discard(self):
+        """請求因例外中止、沒有經過finish時停止剖析（可重複呼叫）"""
+        local = self._local
+        if getattr(local, 'phases', None) is None:
+            return
+        self._stop_profiling()
+        _current.reset(local.context_token)
+        local.phases = None
+
+    def _save(self, local) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        path = os.path.join(self.directory, profile_id + PROFILE_MODES[local.mode])
+        if local.profiler is not None:
+            local.profiler.dump_stats(path)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(local.sampler.collapsed())
+        self._prune()
+        return profile_id
+
+    def _prune(self):
+        profiles = self.list_profiles()
+        for info in profiles[self.max_files:]:
+            try:
+                os.remove(info['path'])
+            except OSError:
+                pass
+
+    def list_profiles(self) -> List[Dict]:
+        """已儲存的剖析結果（新的在前）"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            profile_id, ext = os.path.splitext(name)
+            if ext not in PROFILE_MODES.values():
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            profiles.append({
+                "id": profile_id,
+                "format": ext[1:],
+                "size": stat.st_size,
+                "created_at": stat.st_mtime,
+                "path": path
+            })
+        profiles.sort(key=lambda info: info['created_at'], reverse=True)
+        return profiles
+
+    def find(self, profile_id: str) -> Optional[str]:
+        """剖析結果的檔案路徑（ID不存在或不合法時為None）"""
+        if not profile_id or os.path.basename(profile_id) != profile_id or profile_id.startswith('.'):
+            return None
+        for ext in PROFILE_MODES.values():
+            path = os.path.join(self.directory, profile_id + ext)
+            if os.path.isfile(path):
+                return path
+        return None
+
+
+def format_phases(phases: Dict[str, float], elapsed: float) -> str:
+    """階段耗時的文字（依耗時排序，未歸入任何階段的時間列為other）"""
+    parts = [f"{name}={seconds * 1000:.1f}ms"
+             for name, seconds in sorted(phases.items(), key=lambda item: -item[1])]
+    other = elapsed - sum(phases.values())
+    if other > 0:
+        parts.append(f"other={other * 1000:.1f}ms")
+    return ' '.join(parts)
+
+
+def pstats_text(path: str, limit: int = 40, sort: str = 'cumulative') -> str:
+    """cProfile結果的文字摘要（依sort排序的前limit個函數）"""
+    stream = io.StringIO()
+    stats = pstats.Stats(path, stream=stream)
+    stats.sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
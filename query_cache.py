@@ -0,0 +1,217 @@
+"""
+查詢結果快取模組
+在JobDatabase / CloudflareD1Database前面加上有容量上限的LRU+TTL快取，
+以資料庫中的寫入世代判斷失效，因此其他行程（例如排程器）寫入後也會失效
+"""
+
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 會被快取的讀取方法
+CACHED_METHODS = (
+    'search_jobs',
+    'get_recent_jobs',
+    'get_job_count',
+    'get_stats_summary',
+    'get_stats_breakdown',
+    'get_alive_per_day',
+    'facet_counts'
+)
+
+# 寫入後需要遞增本地世代的方法
+WRITE_METHODS = (
+    'insert_jobs',
+    'delete_old_jobs',
+    'rebuild_stats',
+    'compact_history'
+)
+
+
+def freeze(value: Any):
+    """將參數轉成可雜湊的快取鍵（dict / list 參數，例如分面篩選條件）"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def estimate_size(value: Any) -> int:
+    """估算快取值佔用的記憶體位元組數"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(estimate_size(item) for item in value)
+    return size
+
+
+class CachedJobDatabase:
+    """
+    帶查詢快取的資料庫包裝
+
+    - 讀取方法的結果依 (方法, 參數) 快取，超過max_entries或max_bytes時淘汰最久未使用的項目
+    - 每個項目在ttl秒後過期（處理「最近N天」這類隨時間變動的查詢）
+    - 寫入世代存放在資料庫的write_generation表格，insert_jobs/delete_old_jobs會在交易中遞增；
+      快取最多每check_interval秒讀取一次世代，世代改變時清空所有項目
+    - 其他屬性與方法直接轉交給底層資料庫
+
+    快取的結果會被多個呼叫端共用，呼叫端不可修改返回的物件
+    """
+
+    def __init__(self, db, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024,
+                 ttl: float = 60.0, check_interval: float = 1.0):
+        """
+        初始化查詢快取
+
+        Args:
+            db: JobDatabase或CloudflareD1Database實例
+            max_entries: 最多快取幾個查詢結果
+            max_bytes: 快取結果的估計記憶體上限
+            ttl: 每個項目的存活秒數
+            check_interval: 讀取資料庫寫入世代的最短間隔秒數
+        """
+        self.db = db
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.check_interval = check_interval
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._generation = None
+        self._checked_at = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.db, name)
+
+        if name in CACHED_METHODS:
+            return lambda *args, **kwargs: self._cached_call(name, attr, args, kwargs)
+        if name in WRITE_METHODS:
+            return lambda *args, **kwargs: self._write_call(attr, args, kwargs)
+        return attr
+
+    def _current_generation(self):
+        """讀取寫入世代（每check_interval秒最多一次）"""
+        now = time.monotonic()
+        if self._generation is not None and now - self._checked_at < self.check_interval:
+            return self._generation
+
+        try:
+            generation = self.db.get_write_generation()
+        except Exception as e:
+            # 無法確認世代時不使用快取內容
+            logger.warning(f"讀取寫入世代時發生錯誤: {e}")
+            self.clear()
+            return None
+
+        with self._lock:
+            if generation != self._generation:
+                if self._generation is not None:
+                    self.invalidations += 1
+                self._clear_locked()
+                self._generation = generation
+            self._checked_at = now
+        return generation
+
+    def get_write_generation(self):
+        """目前的寫入世代（最多每check_interval秒讀取一次資料庫，HTTP的ETag也使用這個值）"""
+        generation = self._current_generation()
+        if generation is None:
+            raise RuntimeError("無法讀取寫入世代")
+        return generation
+
+    def _cached_call(self, name: str, func, args: Tuple, kwargs: Dict):
+        generation = self._current_generation()
+        key = (name, freeze(args), freeze(kwargs))
+
+        if generation is not None:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    value, size, expires_at = entry
+                    if expires_at > time.monotonic():
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        return value
+                    self._remove_locked(key)
+
+        with self._lock:
+            self.misses += 1
+
+        value = func(*args, **kwargs)
+
+        if generation is not None:
+            size = estimate_size(value)
+            with self._lock:
+                # 查詢期間若世代已改變，結果可能已過時，不寫入快取
+                if generation == self._generation and size <= self.max_bytes:
+                    if key in self._entries:
+                        self._remove_locked(key)
+                    self._entries[key] = (value, size, time.monotonic() + self.ttl)
+                    self._bytes += size
+                    self._evict_locked()
+
+        return value
+
+    def _write_call(self, func, args: Tuple, kwargs: Dict):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # 本行程的寫入立即失效，不等待下一次讀取世代
+            self.invalidate()
+
+    def _remove_locked(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _evict_locked(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def _clear_locked(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def invalidate(self):
+        """清空快取並在下一次讀取時重新確認寫入世代"""
+        with self._lock:
+            self._clear_locked()
+            self._generation = None
+            self.invalidations += 1
+
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self._clear_locked()
+
+    def cache_stats(self) -> Dict:
+        """快取命中率與記憶體用量"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'generation': self._generation
+            }
@@ -5,12 +5,21 @@
 """
 
 import schedule
+import os
 import time
+import asyncio
 import logging
 import json
 from datetime import datetime
+from typing import Dict, List
 from scrape_104 import Job104Scraper
 from database import JobDatabase
+from async_database import AsyncSQLiteJobDatabase
+from scrape_pipeline import run_scrape_pipeline
+from cloudflare_d1 import create_d1_database
+from d1_sync import D1Sync
+from metrics import SCHEDULER_TASK_SECONDS, InstrumentedDatabase, start_http_server
+from job_feed import FeedPublishingDatabase, JobFeed
 
 # 配置日誌
 logging.basicConfig(
@@ -26,7 +35,20 @@ logger = logging.getLogger(__name__)
 class JobScheduler:
     def __init__(self):
         self.scraper = Job104Scraper()
-        self.db = JobDatabase(db_type="sqlite", db_path="jobs.db")
+        self.db = InstrumentedDatabase(JobDatabase(db_type="sqlite", db_path="jobs.db"), backend='sqlite')
+        # FEED_STORE_PATH: 與API共用的推送紀錄，排程爬到的職缺也會推送給 /api/jobs/feed 的訂閱者
+        feed_store_path = os.getenv('FEED_STORE_PATH')
+        if feed_store_path:
+            self.db = FeedPublishingDatabase(self.db, JobFeed(store_path=feed_store_path))
+        
+        # D1_SYNC_INTERVAL（分鐘）: 設定後定期與D1雙向同步
+        self.d1_sync = None
+        self.d1_sync_interval = int(os.getenv('D1_SYNC_INTERVAL', '0'))
+        if self.d1_sync_interval > 0:
+            try:
+                self.d1_sync = D1Sync(self.db, create_d1_database())
+            except Exception as e:
+                logger.error(f"D1同步初始化失敗: {e}")
         
         # 預設搜尋關鍵字列表
         self.default_keywords = [
@@ -57,7 +79,7 @@ class JobScheduler:
             )
             
             if jobs:
-                inserted_count = self.db.insert_jobs(jobs)
+                inserted_count = self.db.insert_jobs(jobs, keyword=keyword)
                 logger.info(f"成功爬取 {len(jobs)} 筆職缺，存入 {inserted_count} 筆")
                 
                 # 記錄統計資訊
@@ -68,14 +90,40 @@ class JobScheduler:
         except Exception as e:
             logger.error(f"爬取職缺時發生錯誤: {e}")
     
+    def run_pipeline(self, searches: List[Dict], search_delay: float):
+        """以管線方式爬取多組搜尋條件，爬取下一頁的同時寫入上一頁"""
+        async def run():
+            async_db = AsyncSQLiteJobDatabase(self.db)
+            try:
+                return await run_scrape_pipeline(
+                    self.scraper, async_db, searches, search_delay=search_delay
+                )
+            finally:
+                await async_db.close()
+        
+        try:
+            results = asyncio.run(run())
+        except Exception as e:
+            logger.error(f"爬取職缺時發生錯誤: {e}")
+            return
+        
+        for result in results:
+            if result['scraped']:
+                logger.info(f"關鍵字 '{result['keyword']}' ({result['area']}) 爬取 {result['scraped']} 筆職缺，存入 {result['inserted']} 筆")
+                self.log_statistics(result['keyword'], result['scraped'], result['inserted'])
+            else:
+                logger.warning(f"關鍵字 '{result['keyword']}' 沒有找到職缺")
+    
     def scrape_all_keywords(self):
         """爬取所有預設關鍵字"""
         logger.info("開始執行定期爬蟲任務")
         
-        for keyword in self.default_keywords:
-            # 為每個關鍵字爬取主要地區（台北市）
-            self.scrape_jobs(keyword, "6001001000", 2)
-            time.sleep(5)  # 避免請求過於頻繁
+        # 為每個關鍵字爬取主要地區（台北市），每組之間間隔5秒避免請求過於頻繁
+        searches = [
+            {'keyword': keyword, 'area': "6001001000", 'pages': 2}
+            for keyword in self.default_keywords
+        ]
+        self.run_pipeline(searches, search_delay=5)
         
         logger.info("定期爬蟲任務完成")
     
@@ -85,10 +133,12 @@ class JobScheduler:
         
         hot_keywords = ["Python", "JavaScript", "前端工程師", "後端工程師"]
         
-        for area in self.areas:
-            for keyword in hot_keywords:
-                self.scrape_jobs(keyword, area, 1)
-                time.sleep(3)
+        searches = [
+            {'keyword': keyword, 'area': area, 'pages': 1}
+            for area in self.areas
+            for keyword in hot_keywords
+        ]
+        self.run_pipeline(searches, search_delay=3)
         
         logger.info("熱門地區爬蟲任務完成")
     
@@ -101,6 +151,24 @@ class JobScheduler:
         except Exception as e:
             logger.error(f"清理舊職缺時發生錯誤: {e}")
     
+    def compact_history(self):
+        """壓縮職缺觀測歷史"""
+        try:
+            logger.info("開始壓縮職缺觀測歷史")
+            result = self.db.compact_history()
+            logger.info(f"觀測歷史壓縮完成: 處理 {result['chains']} 條觀測鏈，合併 {result['merged']} 筆觀測")
+        except Exception as e:
+            logger.error(f"壓縮觀測歷史時發生錯誤: {e}")
+    
+    def sync_d1(self):
+        """與D1雙向同步變更的職缺"""
+        try:
+            result = self.d1_sync.sync()
+            logger.info(f"D1同步完成: 拉回 {result['pull']['applied']} 筆、推送 {result['push']['applied']} 筆，"
+                        f"讀取 {result['rows']} 筆（{result['rows_per_sec']} 筆/秒）")
+        except Exception as e:
+            logger.error(f"D1同步時發生錯誤: {e}")
+    
     def log_statistics(self, keyword: str, scraped_count: int, inserted_count: int):
         """記錄統計資訊"""
         stats = {
@@ -119,13 +187,14 @@ class JobScheduler:
     def get_daily_report(self):
         """生成每日報告"""
         try:
-            total_jobs = self.db.get_job_count()
-            recent_jobs = self.db.get_recent_jobs(days=1)
+            # 讀取預先計算的統計數字
+            summary = self.db.get_stats_summary(days=1)
             
             report = {
                 "date": datetime.now().strftime("%Y-%m-%d"),
-                "total_jobs": total_jobs,
-                "new_jobs_today": len(recent_jobs),
+                "total_jobs": summary['total_jobs'],
+                "new_jobs_today": summary['new_jobs_today'],
+                "keywords_today": self.db.get_stats_breakdown('keyword', days=0),
                 "timestamp": datetime.now().isoformat()
             }
             
@@ -138,41 +207,64 @@ class JobScheduler:
         except Exception as e:
             logger.error(f"生成每日報告時發生錯誤: {e}")
     
+    def timed(self, task: str, func):
+        """記錄排程任務的執行時間（scheduler_task_duration_seconds）"""
+        def run():
+            with SCHEDULER_TASK_SECONDS.time(task=task):
+                return func()
+        return run
+    
     def setup_schedule(self):
         """設置排程任務"""
         # 每天早上9點執行主要爬蟲任務
-        schedule.every().day.at("09:00").do(self.scrape_all_keywords)
+        schedule.every().day.at("09:00").do(self.timed('scrape_all_keywords', self.scrape_all_keywords))
         
         # 每天下午3點執行熱門地區爬蟲
-        schedule.every().day.at("15:00").do(self.scrape_hot_areas)
+        schedule.every().day.at("15:00").do(self.timed('scrape_hot_areas', self.scrape_hot_areas))
         
         # 每週日凌晨2點清理舊資料
-        schedule.every().sunday.at("02:00").do(self.cleanup_old_jobs)
+        schedule.every().sunday.at("02:00").do(self.timed('cleanup_old_jobs', self.cleanup_old_jobs))
+        
+        # 每天凌晨3點壓縮觀測歷史
+        schedule.every().day.at("03:00").do(self.timed('compact_history', self.compact_history))
         
         # 每天晚上11點生成每日報告
-        schedule.every().day.at("23:00").do(self.get_daily_report)
+        schedule.every().day.at("23:00").do(self.timed('daily_report', self.get_daily_report))
         
         # 每小時執行一次輕量級爬蟲（只爬取熱門關鍵字）
-        schedule.every().hour.do(lambda: self.scrape_jobs("Python", "6001001000", 1))
+        schedule.every().hour.do(self.timed('hourly_scrape', lambda: self.scrape_jobs("Python", "6001001000", 1)))
+        
+        # 定期與D1雙向同步
+        if self.d1_sync:
+            schedule.every(self.d1_sync_interval).minutes.do(self.timed('sync_d1', self.sync_d1))
         
         logger.info("排程任務已設置完成")
         logger.info("排程時間:")
         logger.info("  - 每天 09:00: 主要爬蟲任務")
         logger.info("  - 每天 15:00: 熱門地區爬蟲")
         logger.info("  - 每週日 02:00: 清理舊資料")
+        logger.info("  - 每天 03:00: 壓縮觀測歷史")
         logger.info("  - 每天 23:00: 生成每日報告")
         logger.info("  - 每小時: 輕量級爬蟲")
+        if self.d1_sync:
+            logger.info(f"  - 每 {self.d1_sync_interval} 分鐘: 與D1雙向同步")
     
     def run(self):
         """運行排程器"""
         logger.info("啟動104職缺爬蟲排程器...")
         
+        # SCHEDULER_METRICS_PORT: 提供 /metrics 的埠號（0 停用）
+        metrics_port = int(os.getenv('SCHEDULER_METRICS_PORT', '9101'))
+        if metrics_port:
+            start_http_server(metrics_port)
+            logger.info(f"指標端點: http://0.0.0.0:{metrics_port}/metrics")
+        
         # 設置排程
         self.setup_schedule()
         
         # 立即執行一次主要爬蟲任務
         logger.info("執行初始爬蟲任務...")
-        self.scrape_all_keywords()
+        self.timed('scrape_all_keywords', self.scrape_all_keywords)()
         
         # 運行排程
         try:
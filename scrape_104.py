@@ -4,8 +4,9 @@ import time
 import random
 import argparse
 import json
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 from urllib.parse import urlencode
+from metrics import JOBS_SCRAPED, SCRAPE_PAGE_ERRORS, SCRAPE_PAGE_SECONDS
 
 class Job104Scraper:
     def __init__(self):
@@ -45,8 +46,42 @@ class Job104Scraper:
         """
         all_jobs = []
         
+        for page, jobs in self.iter_pages(
+            keyword=keyword,
+            area=area,
+            pages=pages,
+            jobcat=jobcat,
+            salary_min=salary_min,
+            salary_max=salary_max,
+            experience=experience,
+            remote_work=remote_work
+        ):
+            all_jobs.extend(jobs)
+        
+        print(f"總共爬取到 {len(all_jobs)} 筆職缺")
+        return all_jobs
+    
+    def iter_pages(self, 
+                   keyword: str = "Python", 
+                   area: str = "6001001000", 
+                   pages: int = 5,
+                   jobcat: Optional[str] = None,
+                   salary_min: Optional[int] = None,
+                   salary_max: Optional[int] = None,
+                   experience: Optional[str] = None,
+                   remote_work: Optional[bool] = None) -> Iterator[Tuple[int, List[Dict]]]:
+        """
+        逐頁爬取職缺，每完成一頁就產出該頁結果
+        
+        參數與scrape_104相同；爬取失敗的頁面會產出空列表，
+        讓呼叫端可以在爬取進行中同時處理已取得的資料
+        
+        Yields:
+            Tuple[int, List[Dict]]: (頁碼, 該頁職缺資料列表)
+        """
         for page in range(1, pages + 1):
             print(f"正在爬取第 {page} 頁...")
+            page_jobs = []
             
             # 構建搜尋參數
             params = {
@@ -86,6 +121,7 @@ class Job104Scraper:
             if remote_work:
                 params['remoteWork'] = '1'
             
+            started = time.perf_counter()
             try:
                 response = requests.get(self.base_url, params=params, headers=self.headers)
                 response.raise_for_status()
@@ -113,7 +149,7 @@ class Job104Scraper:
                             'remoteWork': job.get('remoteWork', ''),
                             'jobId': job.get('jobId', '')
                         }
-                        all_jobs.append(job_info)
+                        page_jobs.append(job_info)
                     
                     print(f"第 {page} 頁成功爬取 {len(jobs)} 筆職缺")
                 else:
@@ -121,16 +157,24 @@ class Job104Scraper:
                     
             except requests.exceptions.RequestException as e:
                 print(f"爬取第 {page} 頁時發生錯誤: {e}")
+                SCRAPE_PAGE_SECONDS.observe(time.perf_counter() - started, status='error')
+                SCRAPE_PAGE_ERRORS.inc(reason='request')
+                yield page, page_jobs
                 continue
             except json.JSONDecodeError as e:
                 print(f"解析第 {page} 頁JSON資料時發生錯誤: {e}")
+                SCRAPE_PAGE_SECONDS.observe(time.perf_counter() - started, status='error')
+                SCRAPE_PAGE_ERRORS.inc(reason='json')
+                yield page, page_jobs
                 continue
             
-            # 隨機延遲，避免被反爬蟲
-            time.sleep(random.uniform(1, 3))
-        
-        print(f"總共爬取到 {len(all_jobs)} 筆職缺")
-        return all_jobs
+            SCRAPE_PAGE_SECONDS.observe(time.perf_counter() - started, status='ok')
+            JOBS_SCRAPED.inc(len(page_jobs))
+            yield page, page_jobs
+            
+            # 隨機延遲，避免被反爬蟲（最後一頁之後不需等待）
+            if page < pages:
+                time.sleep(random.uniform(1, 3))
     
     def save_to_csv(self, jobs: List[Dict], filename: str = None) -> str:
         """將職缺資料儲存為CSV檔案"""
@@ -0,0 +1,158 @@
+"""
+即時爬蟲請求合併模組
+相同條件的即時爬蟲同一時間只執行一次（single-flight），完成後的結果短暫快取，
+過期但仍在容許範圍內時先返回舊結果並在背景重新爬取（stale-while-revalidate）
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+from admission import AdmissionRejected
+from tasks import ACTIVE_STATUSES
+
+
+def normalize_params(params: Dict) -> Tuple:
+    """將爬蟲參數轉成快取鍵（關鍵字忽略大小寫與多餘空白，未設定的條件視為相同）"""
+    key = []
+    for name, value in sorted(params.items()):
+        if isinstance(value, str):
+            value = re.sub(r'\s+', ' ', value).strip().casefold()
+        if value in (None, '', False):
+            value = None
+        key.append((name, value))
+    return tuple(key)
+
+
+class ScrapeCoalescer:
+    """
+    合併相同條件的背景爬蟲任務
+
+    lookup() 的結果：
+    - fresh: 快取結果未超過fresh_ttl秒，直接返回
+    - stale: 快取結果超過fresh_ttl但未超過stale_ttl秒，返回舊結果，同時確保有一個重新爬取的任務
+    - inflight: 已有相同條件的任務在執行，共用該任務
+    - new: 提交新的任務
+
+    make_task() 拋出AdmissionRejected（准入控制拒絕）時，有舊結果則返回stale但不重新爬取（task_id為None），
+    否則拋出給呼叫端
+    """
+
+    def __init__(self, task_manager, kind: str, fresh_ttl: float = 60.0,
+                 stale_ttl: float = 300.0, max_entries: int = 128):
+        """
+        初始化請求合併
+
+        Args:
+            task_manager: BackgroundTaskManager
+            kind: 任務類型
+            fresh_ttl: 結果直接使用的秒數（0代表不快取，只合併執行中的任務）
+            stale_ttl: 結果可先返回再背景更新的秒數
+            max_entries: 最多快取幾組條件的結果
+        """
+        self.task_manager = task_manager
+        self.kind = kind
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = max(stale_ttl, fresh_ttl)
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self._inflight = {}
+
+        self.counts = {'fresh': 0, 'stale': 0, 'inflight': 0, 'new': 0}
+
+    def lookup(self, params: Dict, make_task: Callable) -> Dict:
+        """
+        依爬蟲參數取得快取結果或任務
+
+        Args:
+            params: 爬蟲參數
+            make_task: 建立任務函數的函數（只在需要提交新任務時呼叫）
+
+        Returns:
+            Dict: state（fresh / stale / inflight / new）、task_id（沒有任務時為None）、
+                result（快取的任務結果，沒有時為None）、cached_at（結果完成的時間）
+        """
+        key = normalize_params(params)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._results.get(key)
+            age = now - entry['finished'] if entry else None
+            if entry and age > self.stale_ttl:
+                del self._results[key]
+                entry = None
+
+            if entry:
+                self._results.move_to_end(key)
+                if age <= self.fresh_ttl:
+                    return self._answer('fresh', None, entry)
+
+            task_id = self._active_task(key)
+            if task_id is None:
+                try:
+                    run = make_task()
+                except AdmissionRejected:
+                    if entry:
+                        return self._answer('stale', None, entry)
+                    raise
+                task_id = self.task_manager.submit(self.kind, self._wrap(key, run), **params)
+                self._inflight[key] = task_id
+                state = 'stale' if entry else 'new'
+            else:
+                state = 'stale' if entry else 'inflight'
+            return self._answer(state, task_id, entry)
+
+    def _answer(self, state: str, task_id: Optional[str], entry: Optional[Dict]) -> Dict:
+        self.counts[state] += 1
+        return {
+            'state': state,
+            'task_id': task_id,
+            'result': entry['result'] if entry else None,
+            'cached_at': entry['cached_at'] if entry else None
+        }
+
+    def _active_task(self, key) -> Optional[str]:
+        """相同條件且尚未結束的任務（呼叫時需持有鎖）"""
+        task_id = self._inflight.get(key)
+        if task_id is None:
+            return None
+        task = self.task_manager.get(task_id)
+        if task is None or task['status'] not in ACTIVE_STATUSES:
+            del self._inflight[key]
+            return None
+        return task_id
+
+    def _wrap(self, key, run: Callable) -> Callable:
+        """任務完成後保存結果並移出執行中列表"""
+        def wrapped(progress):
+            try:
+                result = run(progress)
+            except Exception:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                raise
+
+            with self._lock:
+                self._inflight.pop(key, None)
+                if self.fresh_ttl > 0:
+                    self._results[key] = {
+                        'result': result,
+                        'finished': time.monotonic(),
+                        'cached_at': datetime.now().isoformat()
+                    }
+                    self._results.move_to_end(key)
+                    while len(self._results) > self.max_entries:
+                        self._results.popitem(last=False)
+            return result
+
+        return wrapped
+
+    def stats(self) -> Dict:
+        """各種結果的次數與快取數量"""
+        with self._lock:
+            return dict(self.counts, entries=len(self._results), inflight=len(self._inflight))
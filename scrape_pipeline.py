@@ -0,0 +1,82 @@
+"""
+爬取與寫入管線
+爬蟲逐頁產出職缺後立即交給寫入端，兩者重疊進行；
+中間的佇列有容量上限，寫入跟不上時爬蟲會暫停（背壓）
+"""
+
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+async def run_scrape_pipeline(scraper, db, searches: List[Dict], queue_size: int = 4,
+                              writers: int = 1, search_delay: float = 0.0,
+                              on_batch: Optional[Callable[[Dict, int, int], None]] = None) -> List[Dict]:
+    """
+    執行爬取與寫入管線
+
+    Args:
+        scraper: Job104Scraper實例（同步爬蟲在背景執行緒中逐頁執行）
+        db: 非同步資料庫（AsyncSQLiteJobDatabase或AsyncPostgresJobDatabase）
+        searches: 搜尋條件列表，每項為scrape_104的參數，例如 {"keyword": "Python", "pages": 2}
+        queue_size: 等待寫入的頁數上限
+        writers: 同時寫入的協程數
+        search_delay: 每組搜尋條件之間的間隔秒數
+        on_batch: 每頁寫入後以 (搜尋條件, 爬取筆數, 寫入筆數) 呼叫
+
+    Returns:
+        List[Dict]: 與searches對應的結果，另外包含 pages_done、scraped、inserted
+    """
+    queue = asyncio.Queue(maxsize=queue_size)
+    results = [dict(search, pages_done=0, scraped=0, inserted=0) for search in searches]
+
+    async def produce():
+        for index, search in enumerate(searches):
+            if index and search_delay:
+                await asyncio.sleep(search_delay)
+
+            pages = scraper.iter_pages(**search)
+            while True:
+                item = await asyncio.to_thread(next, pages, None)
+                if item is None:
+                    break
+
+                _, jobs = item
+                results[index]['pages_done'] += 1
+                if jobs:
+                    # 佇列已滿時在此等待，避免爬取速度遠超過寫入速度
+                    await queue.put((index, jobs))
+
+    async def consume():
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+
+                index, jobs = item
+                search = searches[index]
+                try:
+                    inserted = await db.insert_jobs(jobs, keyword=search.get('keyword'))
+                except Exception as e:
+                    logger.error(f"寫入職缺時發生錯誤: {e}")
+                    inserted = 0
+
+                results[index]['scraped'] += len(jobs)
+                results[index]['inserted'] += inserted
+                if on_batch:
+                    on_batch(search, len(jobs), inserted)
+            finally:
+                queue.task_done()
+
+    consumers = [asyncio.create_task(consume()) for _ in range(writers)]
+    try:
+        await produce()
+    finally:
+        for _ in consumers:
+            await queue.put(None)
+        await asyncio.gather(*consumers)
+
+    return results
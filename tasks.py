@@ -0,0 +1,308 @@
+"""
+背景任務管理模組
+以有界執行緒池執行耗時工作（例如清理舊資料、爬蟲），並提供進度查詢與變更通知；
+多個行程（例如多個WSGI worker）可共用SQLite任務狀態檔，任一行程都能查詢其他行程的任務
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows：沒有檔案鎖，exclusive()只在行程內互斥
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TASK_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS tasks (
+        task_id TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        snapshot TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )
+'''
+
+FINISHED_STATUSES = ('success', 'error')
+# 尚未結束的狀態
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class BackgroundTaskManager:
+    """背景任務管理器"""
+
+    def __init__(self, max_workers: int = 2, max_history: int = 100,
+                 store_path: Optional[str] = None, store_retention: float = 3600.0,
+                 poll_interval: float = 0.5):
+        """
+        初始化背景任務管理器
+
+        Args:
+            max_workers: 同時執行的任務數上限，超過的任務會排隊
+            max_history: 保留的已結束任務數量
+            store_path: 共用任務狀態的SQLite檔案路徑（None代表只保存在本行程）
+            store_retention: 任務狀態檔保留已結束任務的秒數
+            poll_interval: 等待其他行程的任務時，讀取任務狀態檔的間隔秒數
+        """
+        self.max_history = max_history
+        self.store_path = store_path
+        self.store_retention = store_retention
+        self.poll_interval = poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="task")
+        self._tasks = OrderedDict()
+        self._lock = threading.Lock()
+        # 任務狀態或進度改變時通知等待中的讀取端（例如SSE串流）
+        self._changed = threading.Condition(self._lock)
+        self._exclusive_locks = {}
+
+        if store_path:
+            self._init_store()
+
+    def submit(self, kind: str, func: Callable, **params) -> str:
+        """
+        提交背景任務
+
+        Args:
+            kind: 任務類型（例如 "cleanup"）
+            func: 任務函數，會以 progress 更新函數作為唯一參數呼叫，
+                  返回值會存入任務結果
+            params: 記錄在任務資訊中的參數
+
+        Returns:
+            str: 任務ID
+        """
+        task_id = uuid.uuid4().hex
+        task = {
+            'task_id': task_id,
+            'kind': kind,
+            'params': params,
+            'status': 'queued',
+            'progress': {},
+            'version': 0,
+            'result': None,
+            'error': None,
+            'created_at': datetime.now().isoformat(),
+            'started_at': None,
+            'finished_at': None
+        }
+
+        with self._lock:
+            self._tasks[task_id] = task
+            self._trim_history()
+
+        self._persist(dict(task))
+        self._executor.submit(self._run, task_id, func)
+        return task_id
+
+    def _run(self, task_id: str, func: Callable):
+        """在工作執行緒中執行任務"""
+        self._update(task_id, status='running', started_at=datetime.now().isoformat())
+
+        def progress(**fields):
+            with self._lock:
+                task = self._tasks[task_id]
+                task['progress'].update(fields)
+                task['version'] += 1
+                self._changed.notify_all()
+                snapshot = self._snapshot_locked(task_id)
+            self._persist(snapshot)
+
+        try:
+            result = func(progress)
+            self._update(task_id, status='success', result=result,
+                         finished_at=datetime.now().isoformat())
+        except Exception as e:
+            logger.error(f"背景任務 {task_id} 執行失敗: {e}")
+            self._update(task_id, status='error', error=str(e),
+                         finished_at=datetime.now().isoformat())
+
+    def _update(self, task_id: str, **fields):
+        with self._lock:
+            task = self._tasks[task_id]
+            task.update(fields)
+            task['version'] += 1
+            self._changed.notify_all()
+            snapshot = self._snapshot_locked(task_id)
+        self._persist(snapshot)
+
+    def _trim_history(self):
+        """只保留最近的已結束任務（呼叫時需持有鎖）"""
+        finished = [task_id for task_id, task in self._tasks.items()
+                    if task['status'] in FINISHED_STATUSES]
+        for task_id in finished[:max(0, len(finished) - self.max_history)]:
+            del self._tasks[task_id]
+
+    def _connect_store(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.store_path, timeout=30)
+
+    def _init_store(self):
+        """建立任務狀態表格，並清除超過保留期的任務"""
+        conn = self._connect_store()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(TASK_TABLE_SQL)
+            conn.execute('DELETE FROM tasks WHERE updated_at < ?', (time.time() - self.store_retention,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _persist(self, task: Dict):
+        """將任務快照寫入共用的任務狀態檔（只寫入比已保存版本更新的快照）"""
+        if not self.store_path:
+            return
+        try:
+            conn = self._connect_store()
+            try:
+                conn.execute('''
+                    INSERT INTO tasks (task_id, version, snapshot, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (task_id) DO UPDATE SET
+                        version = excluded.version,
+                        snapshot = excluded.snapshot,
+                        updated_at = excluded.updated_at
+                    WHERE excluded.version > tasks.version
+                ''', (task['task_id'], task['version'],
+                      json.dumps(task, ensure_ascii=False, default=str), time.time()))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            # 狀態檔只影響其他行程的查詢，不中斷任務本身
+            logger.warning(f"寫入任務狀態檔時發生錯誤: {e}")
+
+    def _load(self, task_id: str) -> Optional[Dict]:
+        """從共用的任務狀態檔讀取其他行程的任務"""
+        if not self.store_path:
+            return None
+        conn = self._connect_store()
+        try:
+            row = conn.execute('SELECT snapshot FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else None
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        """獲取任務狀態的快照（本行程沒有這個任務時讀取共用的任務狀態檔）"""
+        with self._lock:
+            task = self._snapshot_locked(task_id)
+        return task if task is not None else self._load(task_id)
+
+    def _snapshot_locked(self, task_id: str) -> Optional[Dict]:
+        task = self._tasks.get(task_id)
+        if task is None:
+            return None
+        return dict(task, progress=dict(task['progress']))
+
+    def wait(self, task_id: str, version: int, timeout: float) -> Optional[Dict]:
+        """
+        等待任務的version大於指定值
+
+        Args:
+            task_id: 任務ID
+            version: 呼叫端已看過的版本
+            timeout: 最多等待秒數
+
+        Returns:
+            Optional[Dict]: 任務快照（逾時時為目前狀態），任務不存在時為None
+        """
+        with self._lock:
+            local = task_id in self._tasks
+        if not local and self.store_path:
+            return self._poll(task_id, version, timeout)
+
+        with self._changed:
+            self._changed.wait_for(
+                lambda: task_id not in self._tasks or self._tasks[task_id]['version'] > version,
+                timeout=timeout
+            )
+            return self._snapshot_locked(task_id)
+
+    def _poll(self, task_id: str, version: int, timeout: float) -> Optional[Dict]:
+        """定期讀取任務狀態檔，等待其他行程的任務更新"""
+        deadline = time.monotonic() + timeout
+        while True:
+            task = self._load(task_id)
+            remaining = deadline - time.monotonic()
+            if task is None or task['version'] > version or remaining <= 0:
+                return task
+            time.sleep(min(self.poll_interval, remaining))
+
+    def iter_updates(self, task_id: str, heartbeat: float = 15.0) -> Iterator[Optional[Dict]]:
+        """
+        依序產出任務的每次變更，任務結束後停止
+
+        Args:
+            task_id: 任務ID
+            heartbeat: 超過此秒數沒有變更時產出None（讓呼叫端送出保持連線的訊息）
+
+        Yields:
+            Optional[Dict]: 任務快照；None代表沒有變更
+        """
+        version = -1
+        while True:
+            task = self.wait(task_id, version, heartbeat)
+            if task is None:
+                return
+            if task['version'] == version:
+                yield None
+                continue
+
+            version = task['version']
+            yield task
+            if task['status'] in FINISHED_STATUSES:
+                return
+
+    def find_active(self, kind: str) -> Optional[str]:
+        """找出尚未結束的同類型任務（設定store_path時也包含其他行程的任務）"""
+        with self._lock:
+            for task_id, task in self._tasks.items():
+                if task['kind'] == kind and task['status'] in ACTIVE_STATUSES:
+                    return task_id
+        if not self.store_path:
+            return None
+
+        conn = self._connect_store()
+        try:
+            rows = conn.execute('SELECT snapshot FROM tasks WHERE updated_at >= ? ORDER BY updated_at',
+                                (time.time() - self.store_retention,)).fetchall()
+        finally:
+            conn.close()
+        for (snapshot,) in rows:
+            task = json.loads(snapshot)
+            if task['kind'] == kind and task['status'] in ACTIVE_STATUSES:
+                return task['task_id']
+        return None
+
+    @contextmanager
+    def exclusive(self, name: str):
+        """
+        互斥執行一段工作（例如同一時間只執行一個清理任務）
+
+        設定store_path時以 <store_path>.<name>.lock 檔案鎖讓共用任務狀態檔的所有行程互斥，
+        兩個行程同時提交同類型任務時後執行的任務會等待前一個結束
+        """
+        with self._lock:
+            lock = self._exclusive_locks.setdefault(name, threading.Lock())
+
+        with lock:
+            lock_file = None
+            if self.store_path and fcntl is not None:
+                lock_file = open(f"{self.store_path}.{name}.lock", 'a')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if lock_file is not None:
+                    lock_file.close()
+
+    def shutdown(self, wait: bool = True):
+        """停止接受新任務並等待執行中的任務結束"""
+        self._executor.shutdown(wait=wait)
@@ -6,11 +6,41 @@
 
 import unittest
 from unittest.mock import patch, MagicMock
+import gzip
 import json
 import tempfile
 import os
+import shutil
+import sqlite3
+import subprocess
+import socket
+import sys
+import threading
+import time
+from contextlib import asynccontextmanager
 from scrape_104 import Job104Scraper
 from database import JobDatabase
+from tasks import BackgroundTaskManager
+from scrape_coalescer import ScrapeCoalescer
+from admission import AdmissionRejected, AdmissionTimeout, ScrapeAdmission, TokenBucketLimiter
+from job_fields import parse_fields, project_jobs, select_list
+from job_stats import JobStatsTracker
+from job_feed import FeedFilter, FeedFull, FeedPublishingDatabase, JobFeed
+from feed_server import AsyncSubscription, FeedServer
+from http_cache import compress_response, conditional
+from metrics import (DB_METHOD_SECONDS, JOBS_INSERTED, SCRAPE_PAGE_ERRORS, InstrumentedDatabase,
+                     MetricsRegistry, start_http_server)
+from profiling import RequestProfiler, phase, pstats_text
+from flask import Flask, Response, jsonify
+from async_database import AsyncPostgresJobDatabase, AsyncSQLiteJobDatabase
+from scrape_pipeline import run_scrape_pipeline
+from query_cache import CachedJobDatabase
+from cloudflare_d1 import CloudflareD1Database, QueryMetrics
+from local_d1 import LocalD1Server
+from d1_spool import SpooledD1Database
+from d1_sync import D1Sync
+from d1_tiered import TieredD1Database
+import asyncio
 
 class TestJob104Scraper(unittest.TestCase):
     """測試Job104Scraper類別"""
@@ -272,6 +302,1710 @@ class TestJobDatabase(unittest.TestCase):
         self.assertEqual(len(facebook_jobs), 1)
         self.assertEqual(facebook_jobs[0]['custName'], 'Facebook')
 
+def make_test_job(job_id: str, **overrides) -> dict:
+    """產生測試用職缺資料"""
+    job = {
+        'jobId': job_id,
+        'jobName': 'Python工程師',
+        'custName': '測試公司',
+        'jobUrl': f'/job/{job_id}',
+        'jobAddrNoDesc': '台北市信義區',
+        'salaryDesc': '50000-80000',
+        'jobDetail': '工作內容',
+        'appearDate': '2024-01-01',
+        'jobCat': '軟體工程師',
+        'jobType': '全職',
+        'workExp': '1年以上',
+        'edu': '大學',
+        'skill': 'Python',
+        'benefit': '年終獎金',
+        'remoteWork': '1'
+    }
+    job.update(overrides)
+    return job
+
+class TestJobStats(unittest.TestCase):
+    """測試增量維護的統計彙總"""
+    
+    def setUp(self):
+        self.temp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.temp_db.close()
+        self.db = JobDatabase(db_type="sqlite", db_path=self.temp_db.name)
+    
+    def tearDown(self):
+        if os.path.exists(self.temp_db.name):
+            os.unlink(self.temp_db.name)
+    
+    def test_insert_updates_counters(self):
+        """測試寫入時更新計數，重複寫入不重複計算"""
+        self.db.insert_jobs([
+            make_test_job('1'),
+            make_test_job('2', jobAddrNoDesc='新北市板橋區')
+        ], keyword='Python')
+        self.db.insert_jobs([make_test_job('1')], keyword='Python')
+        
+        summary = self.db.get_stats_summary(days=7)
+        self.assertEqual(summary['total_jobs'], 2)
+        self.assertEqual(summary['recent_jobs'], 2)
+        self.assertEqual(summary['total_jobs'], self.db.get_job_count())
+        
+        areas = {row['value']: row['count'] for row in self.db.get_stats_breakdown('area')}
+        self.assertEqual(areas, {'台北市': 1, '新北市': 1})
+        
+        keywords = self.db.get_stats_breakdown('keyword', days=0)
+        self.assertEqual(keywords, [{'value': 'Python', 'count': 3}])
+
+    def test_failed_row_not_recorded(self):
+        """測試寫入失敗的職缺不計入統計、近似重複與觀測歷史"""
+        inserted = self.db.insert_jobs([make_test_job('1'), make_test_job('bad', jobName=None)],
+                                       keyword='Python')
+        self.assertEqual(inserted, 1)
+        self.assertEqual(self.db.get_stats_summary()['total_jobs'], 1)
+        self.assertEqual(self.db.get_stats_breakdown('keyword', days=0), [{'value': 'Python', 'count': 1}])
+
+        conn = self.db.get_connection()
+        for table in ('job_signatures', 'job_observations'):
+            job_ids = [row[0] for row in conn.execute(f"SELECT job_id FROM {table}")]
+            self.assertEqual(job_ids, ['1'])
+        conn.close()
+
+    def test_delete_updates_counters(self):
+        """測試刪除舊職缺時扣除計數"""
+        self.db.insert_jobs([make_test_job('1'), make_test_job('2')])
+        
+        # 直接修改資料後重建統計，模擬舊資料
+        conn = self.db.get_connection()
+        conn.execute("UPDATE jobs SET created_at = datetime('now', '-60 days') WHERE job_id = '1'")
+        conn.commit()
+        conn.close()
+        self.db.rebuild_stats()
+        self.assertEqual(self.db.get_stats_summary(days=7)['recent_jobs'], 1)
+        
+        deleted_count = self.db.delete_old_jobs(days=30)
+        self.assertEqual(deleted_count, 1)
+        
+        summary = self.db.get_stats_summary(days=7)
+        self.assertEqual(summary['total_jobs'], 1)
+        self.assertEqual(summary['recent_jobs'], 1)
+    
+    def test_delete_in_batches(self):
+        """測試分批刪除並回報進度"""
+        self.db.insert_jobs([make_test_job(str(i)) for i in range(5)])
+        
+        conn = self.db.get_connection()
+        conn.execute("UPDATE jobs SET created_at = datetime('now', '-60 days')")
+        conn.commit()
+        conn.close()
+        self.db.rebuild_stats()
+        
+        progress = []
+        deleted_count = self.db.delete_old_jobs(days=30, batch_size=2, pause=0,
+                                                progress_callback=progress.append)
+        self.assertEqual(deleted_count, 5)
+        self.assertEqual(progress, [2, 4, 5])
+        self.assertEqual(self.db.get_job_count(), 0)
+        self.assertEqual(self.db.get_stats_summary()['total_jobs'], 0)
+
+    def test_large_batch_deleted_in_chunks(self):
+        """測試超過參數上限的批次分段刪除，不合法的參數被拒絕"""
+        self.db.insert_jobs([make_test_job(str(i)) for i in range(600)])
+        conn = self.db.get_connection()
+        conn.execute("UPDATE jobs SET created_at = datetime('now', '-60 days')")
+        conn.commit()
+        conn.close()
+
+        self.assertEqual(self.db.delete_old_jobs(days=30, batch_size=1000, pause=0), 600)
+        self.assertEqual(self.db.get_job_count(), 0)
+        with self.assertRaises(ValueError):
+            self.db.delete_old_jobs(days=30, batch_size=0)
+
+    def test_cleanup_api_validates_parameters(self):
+        """測試清理API在提交背景任務前檢查days與batch_size"""
+        import app as web_app
+        client = web_app.app.test_client()
+        with patch.object(web_app, 'ensure_state'), patch.object(web_app, 'task_manager') as task_manager:
+            for body in ({'days': 0}, {'days': '30 days'}, {'batch_size': 0}, {'batch_size': 1.5},
+                         {'days': True}):
+                response = client.post('/api/jobs/cleanup', json=body)
+                self.assertEqual(response.status_code, 400, body)
+            task_manager.submit.assert_not_called()
+
+class TestFacetCounts(unittest.TestCase):
+    """測試分面計數"""
+    
+    def setUp(self):
+        self.temp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.temp_db.close()
+        self.db = JobDatabase(db_type="sqlite", db_path=self.temp_db.name)
+        self.db.insert_jobs([
+            make_test_job('1'),
+            make_test_job('2', custName='另一間公司', remoteWork='0'),
+            make_test_job('3', jobAddrNoDesc='新北市板橋區', jobCat='資料工程師')
+        ])
+    
+    def tearDown(self):
+        if os.path.exists(self.temp_db.name):
+            os.unlink(self.temp_db.name)
+    
+    def test_precomputed_facets_follow_writes(self):
+        """測試無篩選的分面讀取增量維護的計數，並隨寫入與刪除更新"""
+        facets = self.db.facet_counts()
+        self.assertEqual(facets['area'], [{'value': '台北市', 'count': 2}, {'value': '新北市', 'count': 1}])
+        self.assertEqual(facets['company'][0], {'value': '測試公司', 'count': 2})
+        
+        # 職缺改名公司後，舊公司計數扣除
+        self.db.insert_jobs([make_test_job('1', custName='另一間公司')])
+        companies = {item['value']: item['count'] for item in self.db.facet_counts()['company']}
+        self.assertEqual(companies, {'測試公司': 1, '另一間公司': 2})
+        
+        conn = self.db.get_connection()
+        conn.execute("UPDATE jobs SET created_at = datetime('now', '-60 days') WHERE job_id = '3'")
+        conn.commit()
+        conn.close()
+        self.db.delete_old_jobs(days=30)
+        self.assertEqual(self.db.facet_counts()['category'], [{'value': '軟體工程師', 'count': 2}])
+    
+    def test_filtered_facets_match_rebuild(self):
+        """測試篩選後的分面與重建後的統計一致"""
+        facets = self.db.facet_counts({'area': '台北市'})
+        self.assertEqual(facets['category'], [{'value': '軟體工程師', 'count': 2}])
+        # 分面不套用自己的篩選條件
+        self.assertEqual(len(facets['area']), 2)
+        # 只篩選地區時讀取預先計算的計數，結果與GROUP BY相同
+        grouped = self.db.facet_counts({'area': '台北市', 'keyword': 'Python'})
+        for dimension in ('category', 'company', 'remote'):
+            self.assertEqual(sorted(facets[dimension], key=str), sorted(grouped[dimension], key=str))
+        
+        before = self.db.facet_counts()
+        self.db.rebuild_stats()
+        self.assertEqual(self.db.facet_counts(), before)
+
+    def test_untrimmed_address_counts_consistent(self):
+        """測試地址前後有空白時，加上其他篩選條件的分面與只篩選地區的計數一致"""
+        self.db.insert_jobs([make_test_job('4', jobAddrNoDesc=' 台北市大安區')])
+
+        by_area = self.db.facet_counts({'area': '台北市'})
+        self.assertEqual(by_area['category'], [{'value': '軟體工程師', 'count': 3}])
+        self.assertEqual(self.db.facet_counts({'area': '台北市', 'keyword': 'Python'})['category'],
+                         by_area['category'])
+        self.assertEqual(self.db.facet_counts({'area': '台北市', 'company': '測試公司'})['category'],
+                         [{'value': '軟體工程師', 'count': 2}])
+        # 地區分面在有其他篩選條件時也以相同方式取縣市
+        self.assertEqual(self.db.facet_counts({'remote': '1'})['area'],
+                         [{'value': '台北市', 'count': 2}, {'value': '新北市', 'count': 1}])
+
+    def test_long_area_scoped_company(self):
+        """測試地區 + 公司名稱的分面值超過255字元時仍可寫入與查詢（PostgreSQL的dim_value為TEXT）"""
+        long_name = '公' * 255
+        self.db.insert_jobs([make_test_job('4', custName=long_name)])
+        self.assertIn({'value': long_name, 'count': 1},
+                      self.db.facet_counts({'area': '台北市'}, limit=10)['company'])
+
+        cursor = MagicMock()
+        JobStatsTracker('postgresql').create_table(cursor)
+        statements = ' '.join(call.args[0] for call in cursor.execute.call_args_list)
+        self.assertNotIn('VARCHAR(255)', statements)
+        self.assertIn('ALTER COLUMN dim_value TYPE TEXT', statements)
+
+class TestJobDedup(unittest.TestCase):
+    """測試近似重複偵測"""
+    
+    DETAIL = '負責後端API開發與維護，使用Python、Django與PostgreSQL，參與系統架構設計與效能調校，' * 3
+    
+    def setUp(self):
+        self.temp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.temp_db.close()
+        self.db = JobDatabase(db_type="sqlite", db_path=self.temp_db.name)
+    
+    def tearDown(self):
+        if os.path.exists(self.temp_db.name):
+            os.unlink(self.temp_db.name)
+    
+    def canonical_ids(self):
+        conn = self.db.get_connection()
+        rows = dict(conn.execute("SELECT job_id, canonical_id FROM job_signatures").fetchall())
+        conn.close()
+        return rows
+    
+    def test_repost_joins_cluster(self):
+        """測試換了職缺ID與地區的重新刊登被歸入同一群"""
+        self.db.insert_jobs([make_test_job('1', jobDetail=self.DETAIL)])
+        self.db.insert_jobs([
+            make_test_job('2', jobDetail=self.DETAIL + '（急徵）', jobAddrNoDesc='新北市板橋區'),
+            make_test_job('3', jobName='行銷企劃', jobDetail='規劃社群行銷活動與廣告投放')
+        ])
+        
+        self.assertEqual(self.canonical_ids(), {'1': '1', '2': '1', '3': '3'})
+        self.assertEqual(self.db.get_stats_summary()['unique_jobs'], 2)
+        
+        collapsed = self.db.search_jobs(collapse_duplicates=True)
+        self.assertEqual(sorted(job['job_id'] for job in collapsed), ['1', '3'])
+    
+    def test_delete_canonical_promotes_member(self):
+        """測試刪除代表職缺後由群內其他職缺接任"""
+        self.db.insert_jobs([make_test_job('1', jobDetail=self.DETAIL)])
+        self.db.insert_jobs([make_test_job('2', jobDetail=self.DETAIL)])
+        
+        conn = self.db.get_connection()
+        conn.execute("UPDATE jobs SET created_at = datetime('now', '-60 days') WHERE job_id = '1'")
+        conn.commit()
+        conn.close()
+        self.db.rebuild_stats()
+        self.db.delete_old_jobs(days=30)
+        
+        self.assertEqual(self.canonical_ids(), {'2': '2'})
+        self.assertEqual(self.db.get_stats_summary()['unique_jobs'], 1)
+    
+    def test_rebuild_duplicates(self):
+        """測試重新計算既有職缺的重複群"""
+        self.db.insert_jobs([make_test_job('1', jobDetail=self.DETAIL),
+                             make_test_job('2', jobDetail=self.DETAIL)])
+        
+        result = self.db.rebuild_duplicates(batch_size=1)
+        self.assertEqual(result, {'jobs': 2, 'duplicates': 1})
+        self.assertEqual(set(self.canonical_ids().values()), {'1'})
+
+class TestD1BatchWrites(unittest.TestCase):
+    """測試D1批次寫入（使用本機D1替身）"""
+    
+    def setUp(self):
+        self.server = LocalD1Server().start()
+        self.db = CloudflareD1Database('test', 'test', 'test', base_url=self.server.url)
+    
+    def tearDown(self):
+        self.db.close()
+        self.server.stop()
+    
+    def test_multi_row_chunks(self):
+        """測試多列INSERT不超過參數上限，且請求數遠少於職缺數"""
+        self.server.request_count = 0
+        inserted = self.db.insert_jobs([make_test_job(str(i)) for i in range(20)])
+        
+        self.assertEqual(inserted, 20)
+        report = self.db.last_insert_report
+        self.assertEqual(report['chunks'], 4)
+        self.assertEqual(report['failed_chunks'], [])
+        # 4個批次加上一次寫入世代更新
+        self.assertEqual(self.server.request_count, 5)
+        self.assertEqual(self.db.get_job_count(), 20)
+    
+    def test_failed_rows_reported(self):
+        """測試整批失敗時逐筆重試並回報失敗的職缺"""
+        jobs = [make_test_job(str(i)) for i in range(3)] + [make_test_job('bad', jobName=None)]
+        
+        report = self.db.insert_jobs_batched(jobs)
+        self.assertEqual(report['inserted'], 3)
+        self.assertEqual([chunk['job_ids'] for chunk in report['failed_chunks']], [['0', '1', '2', 'bad']])
+        self.assertEqual([row['job_id'] for row in report['failed_rows']], ['bad'])
+        self.assertIn('NOT NULL', report['failed_rows'][0]['error'])
+
+    def test_transient_failure_not_split(self):
+        """測試暫時性錯誤不逐筆重試，整批回報為可重送"""
+        self.db.retry_backoff = 0.01
+        self.server.fail_next = self.db.max_retries + 1
+        self.server.request_count = 0
+
+        report = self.db.insert_jobs_batched([make_test_job(str(i)) for i in range(3)])
+        self.assertEqual(report['inserted'], 0)
+        # 只有同一批次的重試，沒有逐筆寫入的請求
+        self.assertEqual(self.server.request_count, self.db.max_retries + 1)
+        self.assertEqual([row['job_id'] for row in report['failed_rows']], ['0', '1', '2'])
+        self.assertFalse(any(row['permanent'] for row in report['failed_rows']))
+
+class TestJobFieldProjection(unittest.TestCase):
+    """測試 fields= 欄位投影與精簡模式"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = JobDatabase(db_type="sqlite", db_path=os.path.join(self.temp_dir, 'jobs.db'))
+        self.jobs = [make_test_job(str(i), jobDetail='很長的工作內容' * 50) for i in range(3)]
+        self.db.insert_jobs(self.jobs)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_parse_fields(self):
+        """測試職缺欄位與資料表欄位名稱都可使用，且拒絕不存在的欄位"""
+        self.assertEqual(parse_fields('jobName, cust_name,jobName'), ('job_name', 'cust_name'))
+        self.assertIsNone(parse_fields(''))
+        with self.assertRaises(ValueError):
+            parse_fields('job_name,password')
+        with self.assertRaises(ValueError):
+            select_list(['job_name; DROP TABLE jobs'])
+
+    def test_projection_pushed_into_sql(self):
+        """測試只返回指定的欄位，精簡模式截斷長文字欄位"""
+        jobs = self.db.search_jobs(keyword='Python', fields=('job_id', 'job_name'))
+        self.assertEqual(len(jobs), 3)
+        self.assertEqual(set(jobs[0]), {'job_id', 'job_name'})
+
+        compact = self.db.get_recent_jobs(fields=('job_id', 'job_detail'), truncate=10)
+        self.assertEqual({len(job['job_detail']) for job in compact}, {10})
+        full = self.db.get_recent_jobs(truncate=10)
+        self.assertIn('cust_name', full[0])
+        self.assertEqual(len(full[0]['job_detail']), 10)
+
+    def test_d1_projection(self):
+        """測試D1查詢同樣只讀取指定的欄位"""
+        server = LocalD1Server().start()
+        d1 = CloudflareD1Database('test', 'test', 'test', base_url=server.url)
+        try:
+            d1.insert_jobs(self.jobs)
+            jobs = d1.search_jobs(keyword='Python', fields=('job_id', 'job_detail'), truncate=5)
+            self.assertEqual(len(jobs), 3)
+            self.assertEqual(set(jobs[0]), {'job_id', 'job_detail'})
+            self.assertEqual(len(jobs[0]['job_detail']), 5)
+        finally:
+            d1.close()
+            server.stop()
+
+    def test_project_scraped_jobs(self):
+        """測試即時爬取的職缺（職缺欄位名稱）套用相同的投影，且不修改原本的資料"""
+        projected = project_jobs(self.jobs, ('job_name', 'job_detail'), truncate=4)
+        self.assertEqual(projected[0], {'jobName': 'Python工程師', 'jobDetail': '很長的工'})
+        self.assertEqual(len(self.jobs[0]['jobDetail']), 350)
+
+class TestD1Session(unittest.TestCase):
+    """測試D1查詢的重試、並行讀取與延遲統計"""
+    
+    def setUp(self):
+        self.server = LocalD1Server().start()
+        self.db = CloudflareD1Database('test', 'test', 'test', base_url=self.server.url,
+                                       retry_backoff=0.01)
+    
+    def tearDown(self):
+        self.db.close()
+        self.server.stop()
+    
+    def test_retries_rate_limit_and_server_errors(self):
+        """測試429（依Retry-After）與5xx會重試，並記錄在延遲統計中"""
+        # 不計入啟動時確認結構版本的查詢
+        self.db.metrics = QueryMetrics()
+        self.server.fail_status = 429
+        self.server.retry_after = 0
+        self.server.fail_next = 2
+        self.assertEqual(self.db.get_job_count(), 0)
+        
+        self.server.fail_status = 503
+        self.server.fail_next = self.db.max_retries + 1
+        with self.assertRaises(Exception):
+            self.db.execute_query("SELECT 1")
+        
+        metrics = self.db.query_metrics()['SELECT']
+        self.assertEqual(metrics['retries'], 2 + self.db.max_retries)
+        self.assertEqual(metrics['errors'], 1)
+        self.assertGreater(metrics['count'], 1)
+    
+    def test_execute_many_keeps_order(self):
+        """測試並行查詢依輸入順序返回"""
+        results = self.db.execute_many([("SELECT ?", [i]) for i in range(6)])
+        self.assertEqual([result['results'][0]['values'][0] for result in results], list(range(6)))
+
+class TestD1Migrations(unittest.TestCase):
+    """測試D1結構版本與遷移"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.temp_dir, 'schema.json')
+        self.server = LocalD1Server().start()
+        self.databases = []
+    
+    def tearDown(self):
+        for db in self.databases:
+            db.close()
+        self.server.stop()
+        shutil.rmtree(self.temp_dir)
+    
+    def _open(self, cls=CloudflareD1Database, cache_path=None):
+        db = cls('test', 'test', 'test', base_url=self.server.url, schema_cache_path=cache_path)
+        self.databases.append(db)
+        return db
+    
+    def test_startup_requests(self):
+        """測試標記檔為最新時啟動不發出請求，沒有標記檔時只確認版本而不重新遷移"""
+        db = self._open(cache_path=self.cache_path)
+        latest = CloudflareD1Database.MIGRATIONS[-1][0]
+        self.assertEqual(db.get_schema_version(), latest)
+        
+        self.server.request_count = 0
+        self._open(cache_path=self.cache_path)
+        self.assertEqual(self.server.request_count, 0)
+        
+        self._open()
+        # 確認schema_version表格存在，再讀取版本
+        self.assertEqual(self.server.request_count, 2)
+
+    def test_fresh_database_logs_no_error(self):
+        """測試全新資料庫第一次啟動不記錄查詢錯誤"""
+        with patch('cloudflare_d1.logger.error') as log_error:
+            db = self._open()
+        log_error.assert_not_called()
+        self.assertEqual(db.get_schema_version(), CloudflareD1Database.MIGRATIONS[-1][0])
+    
+    def test_pending_migration_applied(self):
+        """測試新增的遷移在下次啟動時套用"""
+        self._open(cache_path=self.cache_path)
+        
+        class ExtendedD1Database(CloudflareD1Database):
+            MIGRATIONS = CloudflareD1Database.MIGRATIONS + [
+                (len(CloudflareD1Database.MIGRATIONS) + 1, '新增欄位',
+                 ['ALTER TABLE jobs ADD COLUMN source TEXT'])
+            ]
+        
+        db = self._open(ExtendedD1Database, cache_path=self.cache_path)
+        self.assertEqual(db.get_schema_version(), ExtendedD1Database.MIGRATIONS[-1][0])
+        columns = self.server.execute('SELECT * FROM jobs LIMIT 0', [])['columns']
+        self.assertIn('source', columns)
+
+class TestD1Spool(unittest.TestCase):
+    """測試D1寫入暫存佇列"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.spool_path = os.path.join(self.temp_dir, 'spool.db')
+        self.server = LocalD1Server().start()
+        self.spool = self._open_spool()
+    
+    def tearDown(self):
+        self.spool.close(timeout=1)
+        self.server.stop()
+        shutil.rmtree(self.temp_dir)
+    
+    def _open_spool(self):
+        d1 = CloudflareD1Database('test', 'test', 'test', base_url=self.server.url,
+                                  max_retries=0, retry_backoff=0.01)
+        return SpooledD1Database(d1, spool_path=self.spool_path, batch_size=50, autostart=False)
+    
+    def test_outage_keeps_jobs_and_survives_restart(self):
+        """測試D1無法使用時職缺留在暫存檔，重新開啟後寫入D1"""
+        self.server.request_count = 0
+        self.assertEqual(self.spool.insert_jobs([make_test_job(str(i)) for i in range(10)]), 10)
+        self.assertEqual(self.server.request_count, 0)
+        
+        self.server.fail_next = 1000
+        result = self.spool.flush_once()
+        self.assertEqual(result['retrying'], 10)
+        self.assertEqual(self.spool.spool_status()['pending'], 10)
+        self.assertEqual(self.spool.spool_status()['max_attempts'], 1)
+        
+        # 模擬行程重啟
+        self.spool.db.close()
+        self.server.fail_next = 0
+        self.spool = self._open_spool()
+        self.assertTrue(self.spool.flush(timeout=5))
+        self.assertEqual(self.spool.get_job_count(), 10)
+        self.assertEqual(self.spool.spool_status()['flushed'], 10)
+    
+    def test_latest_version_wins(self):
+        """測試同一職缺的多個版本依加入順序寫入"""
+        self.spool.insert_jobs([make_test_job('1', jobName='舊職稱')])
+        self.spool.insert_jobs([make_test_job('1', jobName='新職稱'), make_test_job('2')])
+        
+        result = self.spool.flush_once()
+        self.assertEqual((result['fetched'], result['sent'], result['flushed']), (3, 2, 3))
+        names = self.server.execute("SELECT job_name FROM jobs WHERE job_id = '1'", [])['results']
+        self.assertEqual(names[0]['values'][0], '新職稱')
+    
+    def test_permanent_failures_dead_lettered(self):
+        """測試D1拒絕的職缺移出佇列，不影響其他職缺"""
+        self.spool.insert_jobs([make_test_job('ok'), make_test_job('bad', jobName=None)])
+        
+        result = self.spool.flush_once()
+        self.assertEqual((result['flushed'], result['dead_lettered'], result['retrying']), (1, 1, 0))
+        status = self.spool.spool_status()
+        self.assertEqual((status['pending'], status['dead_letter']), (0, 1))
+    
+    def test_background_flusher(self):
+        """測試背景執行緒自動寫入"""
+        self.spool.start()
+        self.spool.insert_jobs([make_test_job(str(i)) for i in range(5)])
+        
+        for _ in range(100):
+            if self.spool.pending_count() == 0:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.spool.get_job_count(), 5)
+
+class TestD1Tiered(unittest.TestCase):
+    """測試D1本機副本與增量同步"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.server = LocalD1Server().start()
+        self.remote = CloudflareD1Database('test', 'test', 'test', base_url=self.server.url,
+                                           max_retries=0)
+        self.local = JobDatabase(db_type="sqlite", db_path=os.path.join(self.temp_dir, 'replica.db'))
+        self.tiered = TieredD1Database(self.remote, self.local, max_staleness=60, autostart=False)
+    
+    def tearDown(self):
+        self.tiered.close()
+        self.server.stop()
+        shutil.rmtree(self.temp_dir)
+    
+    def test_reads_served_locally(self):
+        """測試讀取先同步一次，之後由本機副本回應"""
+        self.remote.insert_jobs([make_test_job(str(i)) for i in range(5)])
+        
+        self.assertEqual(self.tiered.get_job_count(), 5)
+        self.server.request_count = 0
+        self.assertEqual(len(self.tiered.search_jobs(keyword='Python')), 5)
+        self.assertEqual(self.server.request_count, 0)
+        self.assertEqual(self.tiered.reads, {'local': 2, 'remote': 0})
+    
+    def test_delta_sync_keeps_newest_version(self):
+        """測試增量同步只套用較新的版本"""
+        self.remote.insert_jobs([make_test_job('1')])
+        self.tiered.sync_now()
+        
+        self.remote.insert_jobs([make_test_job('1', jobName='新職稱')])
+        report = self.tiered.sync.pull()
+        self.assertEqual(report['applied'], 1)
+        self.assertEqual(self.local.search_jobs()[0]['job_name'], '新職稱')
+        
+        stale = dict(self.local.search_jobs()[0], job_name='舊職稱', updated_at='2000-01-01T00:00:00')
+        self.assertEqual(self.local.apply_changes([stale]), {'applied': 0, 'skipped': 1})
+    
+    def test_stale_replica_falls_back_to_d1(self):
+        """測試超過容許落後時間且無法同步時改讀D1"""
+        self.tiered.max_staleness = 0
+        self.server.fail_next = 1
+        self.assertEqual(self.tiered.get_job_count(), 0)
+        self.assertEqual(self.tiered.reads['remote'], 1)
+        self.assertIsNotNone(self.tiered.last_error)
+    
+    def test_pull_resumes_from_watermark(self):
+        """測試中斷後從水位繼續同步"""
+        self.remote.insert_jobs([make_test_job(str(i)) for i in range(5)])
+        
+        first = D1Sync(self.local, self.remote, batch_size=2, overlap=0).pull(max_batches=1)
+        self.assertEqual(first['rows'], 2)
+        
+        second = D1Sync(self.local, self.remote, batch_size=2, overlap=0).pull()
+        self.assertEqual(second['rows'], 3)
+        self.assertEqual(self.local.get_job_count(), 5)
+    
+    def test_failed_d1_write_not_written_locally(self):
+        """測試D1沒有接受的職缺不寫入本機副本"""
+        self.server.fail_next = 1
+        self.assertEqual(self.tiered.insert_jobs([make_test_job(str(i)) for i in range(3)]), 0)
+        self.assertEqual(self.local.get_job_count(), 0)
+        
+        self.assertEqual(self.tiered.insert_jobs([make_test_job('1')]), 1)
+        self.assertEqual(self.local.get_job_count(), 1)
+    
+    def test_delete_passes_options_to_replica(self):
+        """測試刪除舊職缺的分批參數同時傳給本機副本"""
+        with patch.object(self.local, 'delete_old_jobs', return_value=0) as local_delete:
+            self.tiered.delete_old_jobs(days=7, batch_size=10, progress_callback=print)
+        local_delete.assert_called_once_with(days=7, batch_size=10, progress_callback=print)
+
+class TestD1Sync(unittest.TestCase):
+    """測試本機資料庫與D1的雙向增量同步"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.server = LocalD1Server().start()
+        self.remote = CloudflareD1Database('test', 'test', 'test', base_url=self.server.url)
+        self.local = JobDatabase(db_type="sqlite", db_path=os.path.join(self.temp_dir, 'jobs.db'))
+        self.sync = D1Sync(self.local, self.remote, batch_size=2)
+    
+    def tearDown(self):
+        self.remote.close()
+        self.server.stop()
+        shutil.rmtree(self.temp_dir)
+    
+    def _names(self, db):
+        return {job['job_id']: job['job_name'] for job in db.search_jobs(limit=100)}
+    
+    def test_bidirectional(self):
+        """測試兩邊新增的職缺互相同步，再次同步時沒有新的寫入"""
+        self.local.insert_jobs([make_test_job('local-1'), make_test_job('local-2'), make_test_job('local-3')])
+        self.remote.insert_jobs([make_test_job('remote-1')])
+        
+        result = self.sync.sync()
+        self.assertEqual(result['pull']['applied'], 1)
+        self.assertEqual(result['push']['applied'], 3)
+        self.assertGreater(result['rows_per_sec'], 0)
+        self.assertEqual(set(self._names(self.local)), set(self._names(self.remote)))
+        self.assertEqual(self.local.get_job_count(), 4)
+        
+        again = self.sync.sync()
+        self.assertEqual(again['pull']['applied'] + again['push']['applied'], 0)
+    
+    def test_newest_version_wins(self):
+        """測試同一職缺在兩邊都被修改時保留updated_at較新的版本"""
+        self.local.insert_jobs([make_test_job('a'), make_test_job('b')])
+        self.sync.sync()
+        
+        self.remote.insert_jobs([make_test_job('a', jobName='D1版本')])
+        self.local.insert_jobs([make_test_job('a', jobName='本機版本')])
+        self.local.insert_jobs([make_test_job('b', jobName='本機舊版本')])
+        self.remote.insert_jobs([make_test_job('b', jobName='D1新版本')])
+        
+        self.sync.sync()
+        for db in (self.local, self.remote):
+            names = self._names(db)
+            self.assertEqual(names['a'], '本機版本')
+            self.assertEqual(names['b'], 'D1新版本')
+    
+    def test_push_resumes_after_interruption(self):
+        """測試推送中斷後從水位繼續"""
+        self.local.insert_jobs([make_test_job(str(i)) for i in range(5)])
+        
+        first = self.sync.push(max_batches=1)
+        self.assertEqual(first['rows'], 2)
+        
+        resumed = D1Sync(self.local, self.remote, batch_size=2).push()
+        self.assertEqual(resumed['applied'], 3)
+        self.assertEqual(self.remote.get_job_count(), 5)
+
+    def test_failed_apply_rolls_back_and_closes(self):
+        """測試套用同步資料失敗時回滾交易並釋放連線"""
+        self.local.insert_jobs([make_test_job('seed')])
+        rows = [dict(self.local.search_jobs()[0], job_id=str(i)) for i in range(3)]
+        connections = []
+        connect = self.local.get_connection
+
+        def tracked():
+            conn = connect()
+            connections.append(conn)
+            return conn
+
+        with patch.object(self.local, 'get_connection', side_effect=tracked), \
+                patch.object(self.local.dedup, 'record', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.local.apply_changes(rows)
+            self.local.get_changes()
+
+        self.assertEqual(self.local.get_job_count(), 1)
+        for conn in connections:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                conn.execute('SELECT 1')
+
+class TestJobHistory(unittest.TestCase):
+    """測試職缺觀測歷史"""
+    
+    def setUp(self):
+        self.temp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.temp_db.close()
+        self.db = JobDatabase(db_type="sqlite", db_path=self.temp_db.name)
+    
+    def tearDown(self):
+        if os.path.exists(self.temp_db.name):
+            os.unlink(self.temp_db.name)
+    
+    def test_record_and_compact(self):
+        """測試只記錄變動並壓縮為有效區間"""
+        self.db.insert_jobs([make_test_job('1')], keyword='Python')
+        self.db.insert_jobs([make_test_job('1')], keyword='Python')
+        self.db.insert_jobs([make_test_job('1')], keyword='Python')
+        self.db.insert_jobs([make_test_job('1', salaryDesc='60000-90000')], keyword='Python')
+        
+        history = self.db.get_job_history('1')
+        self.assertEqual(len(history), 4)
+        self.assertEqual(history[0]['salary_desc'], '50000-80000')
+        self.assertIsNone(history[1]['salary_desc'])
+        
+        result = self.db.compact_history()
+        self.assertEqual(result, {'chains': 1, 'merged': 2})
+        
+        history = self.db.get_job_history('1')
+        self.assertEqual([row['observation_count'] for row in history], [3, 1])
+        self.assertEqual(history[1]['salary_desc'], '60000-90000')
+        self.assertLessEqual(history[0]['valid_from'], history[0]['valid_to'])
+        
+        # 已壓縮的資料再次壓縮不會有變化
+        self.assertEqual(self.db.compact_history(), {'chains': 0, 'merged': 0})
+    
+    def test_alive_per_day(self):
+        """測試每日在架職缺數"""
+        self.db.insert_jobs([make_test_job('1'), make_test_job('2')], keyword='Python')
+        self.db.insert_jobs([make_test_job('3')], keyword='Java')
+        
+        series = self.db.get_alive_per_day(keyword='Python', days=3)
+        self.assertEqual(len(series), 3)
+        self.assertEqual(series[-1]['alive'], 2)
+        self.assertEqual(series[0]['alive'], 0)
+        self.assertEqual(self.db.get_alive_per_day(days=1)[-1]['alive'], 3)
+
+class TestScrapePipeline(unittest.TestCase):
+    """測試非同步資料庫與爬取寫入管線"""
+    
+    def setUp(self):
+        self.temp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.temp_db.close()
+        self.db = JobDatabase(db_type="sqlite", db_path=self.temp_db.name)
+    
+    def tearDown(self):
+        if os.path.exists(self.temp_db.name):
+            os.unlink(self.temp_db.name)
+    
+    def test_pipeline_persists_every_page(self):
+        """測試逐頁爬取的資料都被寫入"""
+        scraper = MagicMock()
+        scraper.iter_pages.side_effect = lambda keyword, pages: iter([
+            (page, [make_test_job(f'{keyword}-{page}-{i}', jobName=f'{keyword}工程師') for i in range(3)])
+            for page in range(1, pages + 1)
+        ])
+        
+        async def run():
+            async_db = AsyncSQLiteJobDatabase(self.db)
+            try:
+                results = await run_scrape_pipeline(
+                    scraper, async_db,
+                    [{'keyword': 'Python', 'pages': 3}, {'keyword': 'Java', 'pages': 2}],
+                    queue_size=1
+                )
+                count = await async_db.get_job_count()
+                found = await async_db.search_jobs(keyword='Java')
+            finally:
+                await async_db.close()
+            return results, count, found
+        
+        results, count, found = asyncio.run(run())
+        
+        self.assertEqual([r['scraped'] for r in results], [9, 6])
+        self.assertEqual([r['inserted'] for r in results], [9, 6])
+        self.assertEqual([r['pages_done'] for r in results], [3, 2])
+        self.assertEqual(count, 15)
+        self.assertEqual(len(found), 6)
+        self.assertEqual(self.db.get_stats_breakdown('keyword', days=0),
+                         [{'value': 'Python', 'count': 9}, {'value': 'Java', 'count': 6}])
+
+    def test_async_postgres_isolates_failed_rows(self):
+        """測試非同步PostgreSQL寫入與同步版本相同，失敗的職缺只撤銷該筆"""
+        class FakeConnection:
+            def __init__(self):
+                self.savepoints = 0
+
+            @asynccontextmanager
+            async def transaction(self):
+                self.savepoints += 1
+                yield
+
+            async def executemany(self, sql, rows):
+                for row in rows:
+                    await self.execute(sql, *row)
+
+            async def execute(self, sql, *row):
+                if row[1] is None:
+                    raise ValueError('null value in column "job_name"')
+
+        conn = FakeConnection()
+        jobs = [make_test_job('1'), make_test_job('bad', jobName=None), make_test_job('2')]
+        rows = [[job['jobId'], job['jobName']] for job in jobs]
+        written = asyncio.run(AsyncPostgresJobDatabase._write_rows(conn, 'INSERT', jobs, rows))
+        self.assertEqual([job['jobId'] for job in written], ['1', '2'])
+        # 整批一次，失敗後每筆各一次
+        self.assertEqual(conn.savepoints, 4)
+
+class TestBackgroundTaskManager(unittest.TestCase):
+    """測試背景任務管理器"""
+    
+    def test_task_progress_and_result(self):
+        """測試任務進度與結果"""
+        manager = BackgroundTaskManager(max_workers=1)
+        
+        def work(progress):
+            progress(done=1)
+            return {'value': 42}
+        
+        task_id = manager.submit('demo', work, size=1)
+        manager.shutdown(wait=True)
+        
+        task = manager.get(task_id)
+        self.assertEqual(task['status'], 'success')
+        self.assertEqual(task['progress'], {'done': 1})
+        self.assertEqual(task['result'], {'value': 42})
+        self.assertIsNone(manager.get('missing'))
+    
+    def test_task_error(self):
+        """測試任務失敗時記錄錯誤"""
+        manager = BackgroundTaskManager(max_workers=1)
+        
+        def fail(progress):
+            raise RuntimeError('boom')
+        
+        task_id = manager.submit('demo', fail)
+        manager.shutdown(wait=True)
+        
+        task = manager.get(task_id)
+        self.assertEqual(task['status'], 'error')
+        self.assertEqual(task['error'], 'boom')
+    
+    def test_iter_updates_until_finished(self):
+        """測試依序產出任務進度（連續的變更可能合併），沒有變更時產出心跳，任務結束後停止"""
+        manager = BackgroundTaskManager(max_workers=1)
+        step = threading.Event()
+        
+        def work(progress):
+            for page in (1, 2):
+                step.wait(5)
+                step.clear()
+                progress(pages_done=page)
+            return {'pages': 2}
+        
+        task_id = manager.submit('demo', work)
+        seen = []
+        for task in manager.iter_updates(task_id, heartbeat=0.05):
+            if task is None:
+                seen.append(None)
+                step.set()
+                continue
+            seen.append((task['status'], task['progress'].get('pages_done')))
+        manager.shutdown(wait=True)
+        
+        self.assertIn(None, seen)
+        updates = [item for item in seen if item is not None]
+        self.assertIn(('running', 1), updates)
+        self.assertEqual(updates[-1], ('success', 2))
+        self.assertEqual(list(manager.iter_updates('missing', heartbeat=0.01)), [])
+
+    def test_shared_store_across_managers(self):
+        """測試共用任務狀態檔時，其他行程（另一個管理器）也能查詢與等待任務"""
+        temp_dir = tempfile.mkdtemp()
+        store_path = os.path.join(temp_dir, 'tasks.db')
+        owner = BackgroundTaskManager(max_workers=1, store_path=store_path)
+        other = BackgroundTaskManager(max_workers=1, store_path=store_path, poll_interval=0.01)
+        release = threading.Event()
+
+        def work(progress):
+            progress(pages_done=1)
+            release.wait(5)
+            return {'value': 42}
+
+        try:
+            task_id = owner.submit('demo', work, keyword='Python')
+            self.assertEqual(other.get(task_id)['params'], {'keyword': 'Python'})
+
+            release.set()
+            updates = [task for task in other.iter_updates(task_id, heartbeat=0.05) if task is not None]
+            self.assertEqual(updates[-1]['status'], 'success')
+            self.assertEqual(updates[-1]['result'], {'value': 42})
+            self.assertIsNone(other.get('missing'))
+        finally:
+            owner.shutdown(wait=True)
+            other.shutdown(wait=True)
+            shutil.rmtree(temp_dir)
+
+    def test_exclusive_across_managers(self):
+        """測試其他行程的執行中任務也找得到，且同名的互斥工作不會同時執行"""
+        temp_dir = tempfile.mkdtemp()
+        store_path = os.path.join(temp_dir, 'tasks.db')
+        owner = BackgroundTaskManager(max_workers=1, store_path=store_path)
+        other = BackgroundTaskManager(max_workers=1, store_path=store_path)
+        release = threading.Event()
+        events = []
+
+        def work(manager, name):
+            def run(progress):
+                with manager.exclusive('cleanup'):
+                    events.append(f'{name}-start')
+                    release.wait(5)
+                    events.append(f'{name}-end')
+            return run
+
+        try:
+            task_id = owner.submit('cleanup', work(owner, 'a'))
+            self.assertEqual(other.find_active('cleanup'), task_id)
+            self.assertIsNone(other.find_active('scrape'))
+
+            while not events:
+                time.sleep(0.01)
+            other.submit('cleanup', work(other, 'b'))
+            time.sleep(0.1)
+            self.assertEqual(events, ['a-start'])
+            release.set()
+            owner.shutdown(wait=True)
+            other.shutdown(wait=True)
+            self.assertEqual(events, ['a-start', 'a-end', 'b-start', 'b-end'])
+            self.assertIsNone(other.find_active('cleanup'))
+        finally:
+            release.set()
+            owner.shutdown(wait=True)
+            other.shutdown(wait=True)
+            shutil.rmtree(temp_dir)
+
+class TestScrapeCoalescer(unittest.TestCase):
+    """測試即時爬蟲的請求合併與結果快取"""
+    
+    def setUp(self):
+        self.manager = BackgroundTaskManager(max_workers=2)
+        self.release = threading.Event()
+        self.runs = 0
+    
+    def tearDown(self):
+        self.release.set()
+        self.manager.shutdown(wait=True)
+    
+    def _make_task(self):
+        def run(progress):
+            self.runs += 1
+            self.release.wait(5)
+            return {'data': [self.runs]}
+        return run
+    
+    def _wait(self, task_id):
+        for task in self.manager.iter_updates(task_id, heartbeat=1):
+            pass
+    
+    def test_concurrent_requests_share_one_task(self):
+        """測試相同條件（忽略關鍵字大小寫與空白）的請求共用同一個任務"""
+        coalescer = ScrapeCoalescer(self.manager, 'search')
+        first = coalescer.lookup({'keyword': 'Python', 'pages': 1}, self._make_task)
+        second = coalescer.lookup({'keyword': ' python ', 'pages': 1}, self._make_task)
+        other = coalescer.lookup({'keyword': 'Go', 'pages': 1}, self._make_task)
+        
+        self.assertEqual((first['state'], second['state'], other['state']), ('new', 'inflight', 'new'))
+        self.assertEqual(first['task_id'], second['task_id'])
+        self.assertNotEqual(first['task_id'], other['task_id'])
+        
+        self.release.set()
+        self._wait(first['task_id'])
+        cached = coalescer.lookup({'keyword': 'PYTHON', 'pages': 1}, self._make_task)
+        self.assertEqual(cached['state'], 'fresh')
+        self.assertEqual(cached['result'], self.manager.get(first['task_id'])['result'])
+        self.assertEqual(self.runs, 2)
+    
+    def test_stale_while_revalidate(self):
+        """測試過期結果先返回並只啟動一個重新爬取的任務"""
+        coalescer = ScrapeCoalescer(self.manager, 'search', fresh_ttl=0.01, stale_ttl=60)
+        self.release.set()
+        first = coalescer.lookup({'keyword': 'Python'}, self._make_task)
+        self._wait(first['task_id'])
+        time.sleep(0.02)
+        
+        self.release.clear()
+        stale = coalescer.lookup({'keyword': 'Python'}, self._make_task)
+        again = coalescer.lookup({'keyword': 'Python'}, self._make_task)
+        self.assertEqual((stale['state'], again['state']), ('stale', 'stale'))
+        self.assertEqual(stale['result'], {'data': [1]})
+        self.assertEqual(stale['task_id'], again['task_id'])
+        
+        self.release.set()
+        self._wait(stale['task_id'])
+        self.assertEqual(coalescer.lookup({'keyword': 'Python'}, self._make_task)['result'], {'data': [2]})
+    
+    def test_rejected_revalidation_serves_stale(self):
+        """測試准入控制拒絕時，有舊結果則返回舊結果，沒有時拋出例外"""
+        coalescer = ScrapeCoalescer(self.manager, 'search', fresh_ttl=0.01, stale_ttl=60)
+        self.release.set()
+        self._wait(coalescer.lookup({'keyword': 'Python'}, self._make_task)['task_id'])
+        time.sleep(0.02)
+        
+        def reject():
+            raise AdmissionRejected('佇列已滿', 'queue_full', retry_after=1)
+        stale = coalescer.lookup({'keyword': 'Python'}, reject)
+        self.assertEqual((stale['state'], stale['task_id']), ('stale', None))
+        self.assertEqual(stale['result'], {'data': [1]})
+        with self.assertRaises(AdmissionRejected):
+            coalescer.lookup({'keyword': 'Go'}, reject)
+        self.assertEqual(coalescer.stats()['inflight'], 0)
+
+class TestScrapeAdmission(unittest.TestCase):
+    """測試爬蟲准入控制與用戶端速率限制"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def test_concurrency_cap_and_queue(self):
+        """測試同時執行數不超過上限，佇列已滿時拒絕"""
+        admission = ScrapeAdmission(max_concurrent=2, max_queue=4, queue_timeout=5)
+        tickets = [admission.admit() for _ in range(4)]
+        self.assertEqual([ticket.position for ticket in tickets], [0, 0, 1, 2])
+        with self.assertRaises(AdmissionRejected) as context:
+            admission.admit()
+        self.assertEqual(context.exception.reason, 'queue_full')
+        
+        lock = threading.Lock()
+        active = []
+        peak = []
+        
+        def run(ticket):
+            with admission.slot(ticket):
+                with lock:
+                    active.append(1)
+                    peak.append(len(active))
+                time.sleep(0.05)
+                with lock:
+                    active.pop()
+        
+        threads = [threading.Thread(target=run, args=(ticket,)) for ticket in tickets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(len(peak), 4)
+        stats = admission.stats()
+        self.assertEqual((stats['running'], stats['waiting'], stats['queue_full']), (0, 0, 1))
+    
+    def test_queue_timeout(self):
+        """測試排隊超過時限的任務失敗並釋出佇列"""
+        admission = ScrapeAdmission(max_concurrent=1, max_queue=2, queue_timeout=0.05)
+        first, second = admission.admit(), admission.admit()
+        with admission.slot(first):
+            with self.assertRaises(AdmissionTimeout):
+                with admission.slot(second):
+                    pass
+        stats = admission.stats()
+        self.assertEqual((stats['running'], stats['waiting'], stats['timeout']), (0, 0, 1))
+    
+    def test_shared_slots_across_instances(self):
+        """測試共用鎖檔目錄的多個行程（以兩個實例模擬）共用名額"""
+        slot_dir = os.path.join(self.temp_dir, 'slots')
+        worker_a = ScrapeAdmission(max_concurrent=1, queue_timeout=0.1, slot_dir=slot_dir, poll_interval=0.01)
+        worker_b = ScrapeAdmission(max_concurrent=1, queue_timeout=0.1, slot_dir=slot_dir, poll_interval=0.01)
+        with worker_a.slot(worker_a.admit()):
+            with self.assertRaises(AdmissionTimeout):
+                with worker_b.slot(worker_b.admit()):
+                    pass
+        with worker_b.slot(worker_b.admit()):
+            self.assertEqual(worker_b.stats()['running'], 1)
+        self.assertEqual(worker_b.stats()['running'], 0)
+    
+    def test_failed_submit_releases_ticket(self):
+        """測試受理後提交背景任務失敗時釋出等待名額"""
+        import app as web_app
+        client = web_app.app.test_client()
+        admission = ScrapeAdmission(max_concurrent=1, max_queue=1)
+        task_manager = MagicMock()
+        task_manager.submit.side_effect = RuntimeError('executor shut down')
+        with patch.object(web_app, 'ensure_state'), \
+                patch.object(web_app, 'scrape_admission', admission), \
+                patch.object(web_app, 'scrape_limiter', TokenBucketLimiter(rate=0, burst=0)), \
+                patch.object(web_app, 'scrape_flights', ScrapeCoalescer(task_manager, 'scrape', fresh_ttl=0, stale_ttl=0)):
+            for _ in range(3):
+                response = client.post('/api/scrape', json={'keyword': 'Python'})
+                self.assertEqual(response.status_code, 500)
+        self.assertEqual(admission.stats()['waiting'], 0)
+        
+        ticket = admission.admit()
+        admission.release(ticket)
+        admission.release(ticket)
+        self.assertEqual(admission.stats()['waiting'], 0)
+    
+    def test_token_bucket(self):
+        """測試每個用戶端的權杖桶與補充"""
+        limiter = TokenBucketLimiter(rate=20, burst=2)
+        self.assertEqual(limiter.consume('a'), 0)
+        self.assertEqual(limiter.consume('a'), 0)
+        self.assertGreater(limiter.consume('a'), 0)
+        self.assertEqual(limiter.consume('b'), 0)
+        with self.assertRaises(AdmissionRejected) as context:
+            limiter.check('a')
+        self.assertEqual(context.exception.reason, 'rate_limited')
+        time.sleep(0.06)
+        self.assertEqual(limiter.consume('a'), 0)
+        self.assertEqual(TokenBucketLimiter(rate=0, burst=0).consume('a'), 0)
+
+class TestJobFeed(unittest.TestCase):
+    """測試新職缺推送的篩選、分送與緩衝區上限"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.jobs = [
+            {'jobId': '1', 'jobName': 'Python工程師', 'custName': '甲公司', 'jobAddrNoDesc': '台北市信義區'},
+            {'jobId': '2', 'jobName': 'Go工程師', 'custName': '乙公司', 'jobAddrNoDesc': '台北市大安區'},
+            {'jobId': '3', 'jobName': 'python後端', 'custName': '丙公司', 'jobAddrNoDesc': '高雄市前鎮區'}
+        ]
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def test_filters_and_fan_out(self):
+        """測試每個訂閱者依關鍵字、地區代碼與公司收到各自符合的職缺"""
+        feed = JobFeed()
+        python_taipei = feed.subscribe(FeedFilter(keyword='PYTHON', area='6001001000'))
+        company = feed.subscribe(FeedFilter(company='乙'))
+        everything = feed.subscribe(FeedFilter())
+        
+        feed.publish(self.jobs)
+        self.assertEqual([job['job_id'] for job in python_taipei.take(1)[0]], ['1'])
+        self.assertEqual([job['job_id'] for job in company.take(1)[0]], ['2'])
+        self.assertEqual(len(everything.take(1)[0]), 3)
+        self.assertEqual(python_taipei.take(0.01), ([], 0))
+        
+        feed.unsubscribe(everything)
+        self.assertEqual(feed.stats()['subscribers'], 2)
+        feed.close()
+        self.assertEqual(list(feed.iter_batches(company)), [])
+    
+    def test_bounded_buffer(self):
+        """測試消費太慢時只保留最新的職缺並回報丟棄的筆數，訂閱者有上限"""
+        feed = JobFeed(buffer_size=2, max_subscribers=1)
+        slow = feed.subscribe(FeedFilter())
+        with self.assertRaises(FeedFull):
+            feed.subscribe(FeedFilter())
+        
+        feed.publish(self.jobs[:2])
+        feed.publish(self.jobs[2:])
+        jobs, dropped = slow.take(1)
+        self.assertEqual([job['job_id'] for job in jobs], ['2', '3'])
+        self.assertEqual(dropped, 1)
+    
+    def test_shared_store_across_processes(self):
+        """測試共用推送紀錄時其他行程（以另一個JobFeed模擬）寫入的職缺也會推送"""
+        store_path = os.path.join(self.temp_dir, 'feed.db')
+        old_publisher = JobFeed(store_path=store_path)
+        old_publisher.publish([dict(self.jobs[0], salaryDesc='待遇面議')])
+        
+        worker = JobFeed(store_path=store_path, poll_interval=0.05)
+        subscription = worker.subscribe(FeedFilter(keyword='python'))
+        JobFeed(store_path=store_path).publish(self.jobs)
+        try:
+            jobs, _ = subscription.take(2)
+            self.assertEqual([job['job_id'] for job in jobs], ['1', '3'])
+        finally:
+            worker.close()
+    
+    def test_publishing_database(self):
+        """測試insert_jobs成功後才發布寫入的職缺"""
+        feed = JobFeed()
+        subscription = feed.subscribe(FeedFilter())
+        db = FeedPublishingDatabase(JobDatabase(db_type="sqlite", db_path=os.path.join(self.temp_dir, 'jobs.db')),
+                                    feed)
+        db.insert_jobs([make_test_job('1')], keyword='Python')
+        self.assertEqual(db.get_job_count(), 1)
+        self.assertEqual([job['job_id'] for job in subscription.take(1)[0]], ['1'])
+        
+        with patch.object(db.db, 'insert_jobs', side_effect=RuntimeError('down')):
+            with self.assertRaises(RuntimeError):
+                db.insert_jobs([make_test_job('2')])
+        self.assertEqual(subscription.take(0.01), ([], 0))
+        
+        # 重複爬到內容相同的職缺不再推送，內容變動時才推送
+        db.insert_jobs([make_test_job('1'), make_test_job('3')], keyword='Python')
+        self.assertEqual([job['job_id'] for job in subscription.take(1)[0]], ['3'])
+        db.insert_jobs([make_test_job('1', salaryDesc='月薪60,000元')], keyword='Python')
+        self.assertEqual([job['salary_desc'] for job in subscription.take(1)[0]], ['月薪60,000元'])
+        self.assertEqual(feed.stats()['unchanged'], 1)
+    
+    def test_failed_row_published_after_retry(self):
+        """測試寫入失敗的職缺不推送，之後以相同內容成功寫入時仍會推送"""
+        feed = JobFeed()
+        subscription = feed.subscribe(FeedFilter())
+        inner = JobDatabase(db_type="sqlite", db_path=os.path.join(self.temp_dir, 'jobs.db'))
+        db = FeedPublishingDatabase(InstrumentedDatabase(inner, backend='test'), feed)
+        write_job = inner._write_job
+
+        def flaky(cursor, job, now):
+            if job['jobId'] == '2':
+                raise sqlite3.OperationalError('database is locked')
+            return write_job(cursor, job, now)
+
+        with patch.object(inner, '_write_job', side_effect=flaky):
+            self.assertEqual(db.insert_jobs([make_test_job('1'), make_test_job('2')]), 1)
+        self.assertEqual([row['job_id'] for row in inner.last_insert_report['failed_rows']], ['2'])
+        self.assertEqual([job['job_id'] for job in subscription.take(1)[0]], ['1'])
+
+        self.assertEqual(db.insert_jobs([make_test_job('1'), make_test_job('2')]), 2)
+        self.assertEqual([job['job_id'] for job in subscription.take(1)[0]], ['2'])
+
+    def test_unchanged_jobs_not_republished(self):
+        """測試共用推送紀錄時，任一行程再次寫入內容相同的職缺都不會重複推送"""
+        store_path = os.path.join(self.temp_dir, 'feed.db')
+        worker = JobFeed(store_path=store_path, poll_interval=0.05)
+        subscription = worker.subscribe(FeedFilter())
+        try:
+            JobFeed(store_path=store_path).publish(self.jobs)
+            self.assertEqual(len(subscription.take(2)[0]), 3)
+            
+            JobFeed(store_path=store_path).publish(self.jobs + [dict(self.jobs[1], jobName='Go資深工程師')])
+            jobs, _ = subscription.take(2)
+            self.assertEqual([job['job_name'] for job in jobs], ['Go資深工程師'])
+        finally:
+            worker.close()
+
+    def test_feed_server_serves_clients_without_threads(self):
+        """測試推送伺服器以協程服務所有SSE連線：連線數增加不會增加執行緒，且各自收到符合條件的職缺"""
+        store_path = os.path.join(self.temp_dir, 'feed.db')
+        feed = JobFeed(store_path=store_path, poll_interval=0.05, subscription_class=AsyncSubscription)
+        server = FeedServer(feed, heartbeat=0.2)
+        loop = asyncio.new_event_loop()
+        port = loop.run_until_complete(server.start('127.0.0.1', 0))
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        sockets = []
+
+        def connect(query):
+            sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+            sockets.append(sock)
+            sock.sendall(f"GET /api/jobs/feed?{query} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+            return sock
+
+        def read_until(sock, marker):
+            data = b''
+            while marker not in data:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+            return data.decode('utf-8')
+
+        try:
+            clients = [connect('keyword=python') for _ in range(30)]
+            go_client = connect('company=%E4%B9%99&fields=job_id,job_name')
+            for sock in clients + [go_client]:
+                self.assertIn('200 OK', read_until(sock, b': connected'))
+            threads = threading.active_count()
+            self.assertEqual(feed.stats()['subscribers'], 31)
+
+            JobFeed(store_path=store_path).publish(self.jobs)
+            for sock in clients:
+                payload = read_until(sock, b'}]}\n\n').split('event: jobs\ndata: ', 1)[1]
+                self.assertEqual([job['job_id'] for job in json.loads(payload)['data']], ['1', '3'])
+            payload = read_until(go_client, b'}]}\n\n').split('event: jobs\ndata: ', 1)[1]
+            self.assertEqual(json.loads(payload)['data'], [{'job_id': '2', 'job_name': 'Go工程師'}])
+            self.assertEqual(threading.active_count(), threads)
+
+            # 用戶端斷線後訂閱隨即結束
+            for sock in clients:
+                sock.close()
+            deadline = time.time() + 5
+            while feed.stats()['subscribers'] > 1 and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(feed.stats()['subscribers'], 1)
+        finally:
+            for sock in sockets:
+                sock.close()
+            asyncio.run_coroutine_threadsafe(server.close(), loop).result(10)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(5)
+            loop.close()
+
+class TestJobStreaming(unittest.TestCase):
+    """測試串流讀取"""
+    
+    def setUp(self):
+        self.temp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.temp_db.close()
+        self.db = JobDatabase(db_type="sqlite", db_path=self.temp_db.name)
+    
+    def tearDown(self):
+        if os.path.exists(self.temp_db.name):
+            os.unlink(self.temp_db.name)
+    
+    def test_iter_jobs_in_batches(self):
+        """測試分批讀取所有職缺且可套用篩選"""
+        self.db.insert_jobs([make_test_job(str(i)) for i in range(7)])
+        self.db.insert_jobs([make_test_job('java', jobName='Java工程師')])
+        
+        jobs = list(self.db.iter_jobs(batch_size=3))
+        self.assertEqual(len(jobs), 8)
+        self.assertEqual([job['id'] for job in jobs], sorted(job['id'] for job in jobs))
+        
+        java_jobs = list(self.db.iter_jobs(keyword='Java', days=7, batch_size=3))
+        self.assertEqual([job['job_id'] for job in java_jobs], ['java'])
+
+class TestQueryCache(unittest.TestCase):
+    """測試查詢結果快取"""
+    
+    def setUp(self):
+        self.temp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.temp_db.close()
+        self.db = CachedJobDatabase(
+            JobDatabase(db_type="sqlite", db_path=self.temp_db.name),
+            max_entries=2, check_interval=0
+        )
+    
+    def tearDown(self):
+        if os.path.exists(self.temp_db.name):
+            os.unlink(self.temp_db.name)
+    
+    def test_hit_and_local_invalidation(self):
+        """測試重複查詢命中快取，本行程寫入後失效"""
+        self.db.insert_jobs([make_test_job('1')])
+        self.assertEqual(self.db.get_job_count(), 1)
+        self.assertEqual(self.db.get_job_count(), 1)
+        self.assertEqual(self.db.cache_stats()['hits'], 1)
+        
+        self.db.insert_jobs([make_test_job('2')])
+        self.assertEqual(self.db.get_job_count(), 2)
+    
+    def test_invalidation_by_other_writer(self):
+        """測試其他連線（如排程器行程）寫入後依寫入世代失效"""
+        self.db.insert_jobs([make_test_job('1')])
+        self.assertEqual(len(self.db.search_jobs(keyword='Python')), 1)
+        
+        other = JobDatabase(db_type="sqlite", db_path=self.temp_db.name)
+        other.insert_jobs([make_test_job('2')])
+        
+        self.assertEqual(len(self.db.search_jobs(keyword='Python')), 2)
+    
+    def test_lru_eviction(self):
+        """測試超過容量時淘汰最久未使用的項目"""
+        self.db.search_jobs(keyword='a')
+        self.db.search_jobs(keyword='b')
+        self.db.search_jobs(keyword='c')
+        
+        stats = self.db.cache_stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertGreater(stats['bytes'], 0)
+
+class TestHttpCache(unittest.TestCase):
+    """測試ETag / 304與回應壓縮"""
+
+    def setUp(self):
+        self.generation = 1
+        self.calls = 0
+        app = Flask(__name__)
+        app.after_request(compress_response)
+
+        @app.route('/jobs')
+        @conditional('public, max-age=30', generation=lambda: self.generation)
+        def jobs():
+            self.calls += 1
+            return jsonify({'data': ['Python工程師'] * 200})
+
+        @app.route('/task')
+        @conditional()
+        def task():
+            self.calls += 1
+            return jsonify({'status': 'running'})
+
+        @app.route('/stream')
+        def stream():
+            return Response((line for line in ['a' * 2000]), mimetype='text/plain')
+
+        self.client = app.test_client()
+
+    def test_generation_etag_skips_view(self):
+        """測試寫入世代未變時直接返回304，不執行端點；世代改變後重新產生"""
+        first = self.client.get('/jobs')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers['Cache-Control'], 'public, max-age=30')
+        etag = first.headers['ETag']
+
+        cached = self.client.get('/jobs', headers={'If-None-Match': etag})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.data, b'')
+        self.assertEqual(self.calls, 1)
+
+        self.generation = 2
+        self.assertEqual(self.client.get('/jobs', headers={'If-None-Match': etag}).status_code, 200)
+        self.assertEqual(self.calls, 2)
+
+    def test_body_etag(self):
+        """測試沒有寫入世代的端點以回應內容的雜湊比對"""
+        etag = self.client.get('/task').headers['ETag']
+        self.assertEqual(self.client.get('/task', headers={'If-None-Match': etag}).status_code, 304)
+        self.assertEqual(self.client.get('/task', headers={'If-None-Match': '"other"'}).status_code, 200)
+
+    def test_gzip_and_encoded_etag(self):
+        """測試gzip壓縮、壓縮後的ETag帶有後綴且仍可用於304，串流回應不壓縮"""
+        response = self.client.get('/jobs', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.data))['data'][0], 'Python工程師')
+        etag = response.headers['ETag']
+        self.assertTrue(etag.endswith('-gzip"'))
+
+        cached = self.client.get('/jobs', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(cached.status_code, 304)
+
+        plain = self.client.get('/jobs')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        streamed = self.client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', streamed.headers)
+
+class TestMetrics(unittest.TestCase):
+    """測試行程內指標與Prometheus格式輸出"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.registry = MetricsRegistry()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_render_histogram_and_counter(self):
+        """測試直方圖的累計區間、總和與次數，以及標籤跳脫"""
+        latency = self.registry.histogram('demo_seconds', '示範延遲', ('endpoint',), buckets=(0.1, 1.0))
+        errors = self.registry.counter('demo_errors_total', '示範錯誤', ('reason',))
+        latency.observe(0.05, endpoint='/a')
+        latency.observe(0.5, endpoint='/a')
+        latency.observe(5, endpoint='/a')
+        errors.inc(reason='say "hi"')
+
+        text = self.registry.render()
+        self.assertIn('# TYPE demo_seconds histogram', text)
+        self.assertIn('demo_seconds_bucket{endpoint="/a",le="0.1"} 1', text)
+        self.assertIn('demo_seconds_bucket{endpoint="/a",le="1.0"} 2', text)
+        self.assertIn('demo_seconds_bucket{endpoint="/a",le="+Inf"} 3', text)
+        self.assertIn('demo_seconds_count{endpoint="/a"} 3', text)
+        self.assertIn('demo_errors_total{reason="say \\"hi\\""} 1.0', text)
+        with self.assertRaises(ValueError):
+            errors.inc(other='x')
+
+    def test_multiprocess_merge(self):
+        """測試多個行程寫入共用目錄後合併輸出"""
+        for name in ('1.json', '2.json'):
+            other = MetricsRegistry()
+            other.counter('jobs_total', '職缺數').inc(3)
+            other.histogram('wait_seconds', '等待', buckets=(1.0,)).observe(0.5)
+            with open(os.path.join(self.temp_dir, name), 'w') as f:
+                json.dump(other.snapshot(), f)
+
+        self.registry.directory = self.temp_dir
+        self.registry.counter('jobs_total', '職缺數').inc(1)
+        text = self.registry.render()
+        self.assertIn('jobs_total 7.0', text)
+        self.assertIn('wait_seconds_count 2', text)
+
+    def test_dead_worker_gauges_dropped(self):
+        """測試已結束行程的量測值不列入合計，計數器仍保留"""
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+        for pid, running in ((dead.pid, 5), (os.getppid(), 1)):
+            other = MetricsRegistry()
+            other.counter('jobs_total', '職缺數').inc(3)
+            other.gauge('running', '執行中').set(running)
+            with open(os.path.join(self.temp_dir, f'{pid}.json'), 'w') as f:
+                json.dump(other.snapshot(), f)
+
+        self.registry.directory = self.temp_dir
+        text = self.registry.render()
+        self.assertIn('jobs_total 6.0', text)
+        self.assertIn('running 1.0', text)
+
+    def test_instrumented_database(self):
+        """測試資料庫方法耗時與寫入職缺數"""
+        db = InstrumentedDatabase(JobDatabase(db_type="sqlite", db_path=os.path.join(self.temp_dir, 'jobs.db')),
+                                  backend='test')
+        inserted_before = JOBS_INSERTED.value(backend='test')
+        count_before = DB_METHOD_SECONDS.count(backend='test', method='get_job_count')
+
+        db.insert_jobs([make_test_job('1'), make_test_job('2')])
+        self.assertEqual(db.get_job_count(), 2)
+        self.assertEqual(list(db.iter_jobs())[0]['job_id'], '1')
+
+        self.assertEqual(JOBS_INSERTED.value(backend='test') - inserted_before, 2)
+        self.assertEqual(DB_METHOD_SECONDS.count(backend='test', method='get_job_count') - count_before, 1)
+        self.assertEqual(DB_METHOD_SECONDS.count(backend='test', method='iter_jobs'), 0)
+
+    @patch('requests.get')
+    def test_scrape_page_metrics(self, mock_get):
+        """測試爬蟲每頁的延遲、錯誤與職缺數"""
+        import requests
+        mock_get.side_effect = requests.exceptions.ConnectionError('down')
+        errors_before = SCRAPE_PAGE_ERRORS.value(reason='request')
+        Job104Scraper().scrape_104(keyword='Python', pages=1)
+        self.assertEqual(SCRAPE_PAGE_ERRORS.value(reason='request') - errors_before, 1)
+
+    def test_http_server(self):
+        """測試排程器使用的 /metrics HTTP端點"""
+        self.registry.gauge('queue_depth', '佇列長度').set(4)
+        server = start_http_server(0, host='127.0.0.1', registry=self.registry)
+        try:
+            import requests
+            response = requests.get(f"http://127.0.0.1:{server.server_address[1]}/metrics", timeout=5)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('queue_depth 4.0', response.text)
+        finally:
+            server.shutdown()
+
+class TestRequestProfiler(unittest.TestCase):
+    """測試請求階段耗時、慢請求記錄與剖析結果"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.profiler = RequestProfiler(directory=self.temp_dir, token='secret',
+                                        slow_threshold=0.01, max_files=2, sample_interval=0.001)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_slow_request_log_phases(self):
+        """測試超過門檻的請求記錄各階段耗時，不在請求中的階段不記錄"""
+        with phase('db'):
+            pass
+        self.assertIsNone(self.profiler.start())
+        db = InstrumentedDatabase(JobDatabase(db_type="sqlite", db_path=os.path.join(self.temp_dir, 'jobs.db')),
+                                  backend='test')
+        db.get_job_count()
+        with phase('json'):
+            time.sleep(0.02)
+        with self.assertLogs('profiling', level='WARNING') as logs:
+            self.assertIsNone(self.profiler.finish('GET', '/api/search', 200))
+        self.assertIn('慢請求 GET /api/search 200', logs.output[0])
+        self.assertIn('json=', logs.output[0])
+        self.assertIn('db=', logs.output[0])
+
+        self.profiler.start()
+        with self.assertNoLogs('profiling', level='WARNING'):
+            self.profiler.finish('GET', '/api/jobs/stats', 200)
+
+    def test_profile_authorization(self):
+        """測試權杖不正確或未設定PROFILE_TOKEN時不剖析"""
+        self.assertEqual(self.profiler.start(token='wrong', mode='cprofile'), 'unauthorized')
+        self.assertIsNone(self.profiler.finish('GET', '/', 200))
+        self.assertEqual(self.profiler.start(token='secret', mode='trace'), 'invalid_mode')
+        self.profiler.discard()
+
+        disabled = RequestProfiler(directory=self.temp_dir)
+        self.assertFalse(disabled.authorized(None))
+        self.assertEqual(disabled.start(token='', mode='cprofile'), 'unauthorized')
+        disabled.discard()
+        self.assertEqual(self.profiler.list_profiles(), [])
+
+    def test_cprofile_artifact(self):
+        """測試cProfile結果存成pstats檔案，同一時間只剖析一個請求"""
+        self.assertEqual(self.profiler.start(token='secret', mode='cprofile'), 'started')
+        results = []
+        busy = threading.Thread(target=lambda: results.append(self.profiler.start('secret', 'sample')))
+        busy.start()
+        busy.join()
+        self.assertEqual(results, ['busy'])
+
+        sorted(str(i) for i in range(1000))
+        profile_id = self.profiler.finish('GET', '/api/search', 200)
+        path = self.profiler.find(profile_id)
+        self.assertTrue(path.endswith('.prof'))
+        self.assertIn('function calls', pstats_text(path))
+        self.assertIsNone(self.profiler.find('../' + profile_id))
+
+    def test_sample_artifact_and_prune(self):
+        """測試取樣結果為collapsed格式，並只保留max_files個結果"""
+        for _ in range(3):
+            self.assertEqual(self.profiler.start(token='secret', mode='sample'), 'started')
+            time.sleep(0.03)
+            profile_id = self.profiler.finish('GET', '/api/search', 200)
+            time.sleep(0.01)
+
+        profiles = self.profiler.list_profiles()
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual(profiles[0]['id'], profile_id)
+        with open(self.profiler.find(profile_id), encoding='utf-8') as f:
+            self.assertIn('test_scraper.py:test_sample_artifact_and_prune', f.read())
+
+class TestHealthChecks(unittest.TestCase):
+    """測試存活/就緒檢查與延遲初始化"""
+
+    def setUp(self):
+        import app as web_app
+        self.web_app = web_app
+        self.client = web_app.app.test_client()
+        web_app._readiness['checked_at'] = None
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.web_app._readiness['checked_at'] = None
+        shutil.rmtree(self.temp_dir)
+
+    def test_healthz_does_not_initialize(self):
+        """測試 /healthz 不建立爬蟲與資料庫"""
+        with patch.object(self.web_app, 'ensure_state') as ensure_state:
+            response = self.client.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['status'], 'ok')
+        ensure_state.assert_not_called()
+
+    def test_readyz_caches_ping(self):
+        """測試 /readyz 的資料庫ping在快取時間內只執行一次，失敗時返回503"""
+        fake_db = MagicMock()
+        with patch.object(self.web_app, 'ensure_state'), patch.object(self.web_app, 'db', fake_db):
+            self.assertEqual(self.client.get('/readyz').status_code, 200)
+            self.assertEqual(self.client.get('/readyz').status_code, 200)
+            self.assertEqual(fake_db.ping.call_count, 1)
+
+            fake_db.ping.side_effect = ConnectionError('down')
+            self.web_app._readiness['checked_at'] -= self.web_app.READYZ_CACHE_SECONDS
+            response = self.client.get('/readyz')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.get_json()['database']['error'], 'down')
+
+    def test_database_ping(self):
+        """測試SQLite的ping"""
+        db = JobDatabase(db_type="sqlite", db_path=os.path.join(self.temp_dir, 'jobs.db'))
+        self.assertIsNone(db.ping())
+        db.db_path = os.path.join(self.temp_dir, 'missing', 'jobs.db')
+        with self.assertRaises(Exception):
+            db.ping()
+
+class TestReadReplicas(unittest.TestCase):
+    """測試讀寫分離"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.primary_path = os.path.join(self.temp_dir, 'primary.db')
+        self.replica_path = os.path.join(self.temp_dir, 'replica.db')
+        JobDatabase(db_type="sqlite", db_path=self.primary_path).insert_jobs([make_test_job('1')])
+        shutil.copyfile(self.primary_path, self.replica_path)
+        
+        self.db = JobDatabase(db_type="sqlite", db_path=self.primary_path,
+                              replicas=[self.replica_path], max_replica_lag=60,
+                              lag_check_interval=0)
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def test_reads_use_replica_and_writes_use_primary(self):
+        """測試讀取走副本、寫入走主庫"""
+        self.assertEqual(self.db.get_job_count(), 1)
+        self.assertEqual(self.db.read_routing, {'replica': 1, 'primary': 0})
+        
+        self.db.insert_jobs([make_test_job('2')])
+        self.assertEqual(JobDatabase(db_type="sqlite", db_path=self.primary_path).get_job_count(), 2)
+        
+        # 副本落後但仍在容許範圍內
+        self.assertEqual(self.db.get_job_count(), 1)
+        self.assertEqual(self.db.read_routing['replica'], 2)
+    
+    def test_lagging_replica_falls_back_to_primary(self):
+        """測試副本落後超過上限時改讀主庫"""
+        self.db.max_replica_lag = 0
+        self.db.get_job_count()
+        self.db.insert_jobs([make_test_job('2')])
+        self.db._refresh_replicas()
+        
+        # 主庫到達副本尚未包含的世代已經1秒
+        for generation in self.db._generation_seen:
+            self.db._generation_seen[generation] -= 1
+        self.assertEqual(self.db.get_job_count(), 2)
+        self.assertEqual(self.db.read_routing['primary'], 1)
+        self.assertFalse(self.db.replica_status()['replicas'][0]['usable'])
+    
+    def test_replica_one_generation_behind_under_steady_writes(self):
+        """測試持續寫入、副本只落後一個世代時，落後秒數不會累積而改讀主庫"""
+        self.db.max_replica_lag = 0.5
+        self.db.get_job_count()
+        for i in range(6):
+            shutil.copyfile(self.primary_path, self.replica_path)
+            self.db.insert_jobs([make_test_job(f'w{i}')])
+            time.sleep(0.15)
+            self.db.get_job_count()
+        
+        self.assertEqual(self.db.read_routing, {'replica': 7, 'primary': 0})
+        self.assertLess(self.db.replica_status()['replicas'][0]['lag'], 0.5)
+    
+    def test_cache_does_not_store_stale_replica_result(self):
+        """測試快取的世代來自主庫時，不使用尚未追上該世代的副本"""
+        cached = CachedJobDatabase(self.db, check_interval=0)
+        self.assertEqual(len(cached.search_jobs(keyword='Python')), 1)
+
+        cached.insert_jobs([make_test_job('2')])
+        self.assertEqual(len(cached.search_jobs(keyword='Python')), 2)
+        self.assertEqual(self.db.read_routing['primary'], 1)
+
+        # 副本追上後仍返回相同（最新）的結果，並可再次使用副本
+        shutil.copyfile(self.primary_path, self.replica_path)
+        self.assertEqual(len(cached.search_jobs(keyword='Python')), 2)
+        self.assertEqual(len(cached.search_jobs(keyword='Java')), 0)
+        self.assertEqual(self.db.read_routing['replica'], 2)
+
+    def test_missing_replica_falls_back_to_primary(self):
+        """測試副本無法連接時改讀主庫"""
+        os.unlink(self.replica_path)
+        self.assertEqual(len(self.db.search_jobs(keyword='Python')), 1)
+        self.assertEqual(self.db.read_routing, {'replica': 0, 'primary': 1})
+
 def run_integration_test():
     """執行整合測試"""
     print("執行整合測試...")